@@ -0,0 +1,213 @@
+# Copyright 2017 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""NumPy implementation of the spectrogram and MFCC feature frontend.
+
+These functions reproduce what `contrib_audio.audio_spectrogram` and
+`contrib_audio.mfcc` compute, following the TensorFlow kernels step by step
+(periodic Hann window, power of two FFT, the same mel band mapping, log floor
+and DCT), but work on a whole [batch, samples] array at once and don't need a
+TensorFlow graph or session. That makes them usable from worker processes and
+offline tools, and lets the feature pipeline run entirely in memory when the
+clips come from the clip store.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+# Defaults of the TensorFlow Mfcc op.
+MFCC_UPPER_FREQUENCY_LIMIT = 4000.0
+MFCC_LOWER_FREQUENCY_LIMIT = 20.0
+MFCC_FILTERBANK_CHANNEL_COUNT = 40
+MFCC_FILTERBANK_FLOOR = 1e-12
+
+
+def frame_signal(pcm, window_size, stride):
+  """Splits a batch of clips into overlapping frames without copying.
+
+  Args:
+    pcm: Array of shape [batch, samples].
+    window_size: Length of each frame in samples.
+    stride: How far apart frames start, in samples.
+
+  Returns:
+    Read-only strided view of shape [batch, frames, window_size].
+  """
+  pcm = np.ascontiguousarray(pcm)
+  batch_size, sample_count = pcm.shape
+  if sample_count < window_size:
+    frame_count = 0
+  else:
+    frame_count = 1 + (sample_count - window_size) // stride
+  return np.lib.stride_tricks.as_strided(
+      pcm,
+      shape=(batch_size, frame_count, window_size),
+      strides=(pcm.strides[0], stride * pcm.strides[1], pcm.strides[1]),
+      writeable=False)
+
+
+def periodic_hann_window(window_size):
+  """Hann window as used by the spectrogram op."""
+  return 0.5 - 0.5 * np.cos(2.0 * np.pi * np.arange(window_size) / window_size)
+
+
+def spectrogram(pcm, window_size, stride):
+  """Calculates magnitude squared spectrograms for a batch of clips.
+
+  Args:
+    pcm: Float array of shape [batch, samples].
+    window_size: Length of the analysis window in samples.
+    stride: How far to move in time between windows, in samples.
+
+  Returns:
+    Float64 array of shape [batch, frames, fft_length // 2 + 1], where
+    fft_length is the smallest power of two holding the window.
+  """
+  fft_length = 1
+  while fft_length < window_size:
+    fft_length *= 2
+  frames = frame_signal(np.asarray(pcm, dtype=np.float64), window_size, stride)
+  spectrum = np.fft.rfft(frames * periodic_hann_window(window_size),
+                         n=fft_length, axis=-1)
+  return spectrum.real**2 + spectrum.imag**2
+
+
+def _freq_to_mel(freq):
+  return 1127.0 * np.log1p(freq / 700.0)
+
+
+def mel_filterbank(input_length, sample_rate,
+                   channel_count=MFCC_FILTERBANK_CHANNEL_COUNT,
+                   lower_frequency_limit=MFCC_LOWER_FREQUENCY_LIMIT,
+                   upper_frequency_limit=MFCC_UPPER_FREQUENCY_LIMIT):
+  """Builds the triangular mel filterbank of the MFCC op as a matrix.
+
+  The op weights the square root of every spectrogram bin between the
+  frequency limits into the two mel channels whose centers surround it. This
+  builds the same weights as a [input_length, channel_count] matrix, so the
+  whole filterbank is a single matrix product.
+
+  Args:
+    input_length: Number of frequency bins in the spectrogram.
+    sample_rate: Samples per second of the audio.
+    channel_count: Number of mel channels.
+    lower_frequency_limit: Lowest frequency to include, in Hz.
+    upper_frequency_limit: Highest frequency to include, in Hz.
+
+  Returns:
+    Float64 array of shape [input_length, channel_count].
+  """
+  mel_low = _freq_to_mel(lower_frequency_limit)
+  mel_high = _freq_to_mel(upper_frequency_limit)
+  mel_spacing = (mel_high - mel_low) / (channel_count + 1)
+  center_frequencies = mel_low + mel_spacing * np.arange(1, channel_count + 2)
+  hz_per_sbin = 0.5 * sample_rate / (input_length - 1)
+  start_index = int(1.5 + (lower_frequency_limit / hz_per_sbin))
+  end_index = int(upper_frequency_limit / hz_per_sbin)
+
+  filterbank = np.zeros((input_length, channel_count))
+  channel = 0
+  for i in range(start_index, min(end_index, input_length - 1) + 1):
+    melf = _freq_to_mel(i * hz_per_sbin)
+    while channel < channel_count and center_frequencies[channel] < melf:
+      channel += 1
+    band = channel - 1
+    if band >= 0:
+      weight = ((center_frequencies[band + 1] - melf) /
+                (center_frequencies[band + 1] - center_frequencies[band]))
+      filterbank[i, band] += weight
+    else:
+      weight = (center_frequencies[0] - melf) / (center_frequencies[0] - mel_low)
+    if band + 1 < channel_count:
+      filterbank[i, band + 1] += 1.0 - weight
+  return filterbank
+
+
+def dct_matrix(input_length, coefficient_count):
+  """Builds the scaled DCT-II matrix of the MFCC op.
+
+  Returns:
+    Float64 array of shape [input_length, coefficient_count].
+  """
+  j = np.arange(input_length)
+  i = np.arange(coefficient_count)[:, np.newaxis]
+  cosines = np.sqrt(2.0 / input_length) * np.cos(
+      np.pi / input_length * i * (j + 0.5))
+  return cosines.T
+
+
+def mfcc(spectrograms, sample_rate, dct_coefficient_count):
+  """Calculates MFCCs from magnitude squared spectrograms.
+
+  Args:
+    spectrograms: Array of shape [batch, frames, bins] from `spectrogram`.
+    sample_rate: Samples per second of the audio.
+    dct_coefficient_count: How many cepstral coefficients to keep.
+
+  Returns:
+    Float64 array of shape [batch, frames, dct_coefficient_count].
+  """
+  filterbank = mel_filterbank(spectrograms.shape[-1], sample_rate)
+  mel_energies = np.dot(np.sqrt(spectrograms), filterbank)
+  log_mel = np.log(np.maximum(mel_energies, MFCC_FILTERBANK_FLOOR))
+  return np.dot(log_mel, dct_matrix(filterbank.shape[1],
+                                    dct_coefficient_count))
+
+
+def time_shift(pcm, time_shift_amounts):
+  """Shifts every row of a batch of clips in time, padding gaps with zeros.
+
+  Positive amounts move the clip later, like `input_data.time_shift_batch`.
+
+  Args:
+    pcm: Array of shape [batch, samples].
+    time_shift_amounts: Integer array of shape [batch].
+
+  Returns:
+    Array of the same shape and type holding the shifted clips.
+  """
+  sample_count = pcm.shape[1]
+  positions = (np.arange(sample_count)[np.newaxis, :] -
+               np.asarray(time_shift_amounts)[:, np.newaxis])
+  valid = (positions >= 0) & (positions < sample_count)
+  rows = np.arange(pcm.shape[0])[:, np.newaxis]
+  shifted = pcm[rows, np.clip(positions, 0, sample_count - 1)]
+  return np.where(valid, shifted, 0).astype(pcm.dtype)
+
+
+def fingerprints(pcm, model_settings, features='mfcc'):
+  """Builds flat model fingerprints for a batch of clips.
+
+  This matches the output of the processing graphs in `input_data`.
+
+  Args:
+    pcm: Float array of shape [batch, samples].
+    model_settings: Information about the current model being trained.
+    features: Which features to compute, 'raw', 'spectrogram' or 'mfcc'.
+
+  Returns:
+    Float32 array of shape [batch, fingerprint_size].
+  """
+  if features == 'raw':
+    result = pcm
+  else:
+    result = spectrogram(pcm, model_settings['window_size_samples'],
+                         model_settings['window_stride_samples'])
+    if features != 'spectrogram':
+      result = mfcc(result, int(model_settings['sample_rate']),
+                    int(model_settings['dct_coefficient_count']))
+  return np.reshape(result, (-1, model_settings['fingerprint_size'])).astype(
+      np.float32)
@@ -0,0 +1,125 @@
+# Copyright 2017 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for the NumPy audio feature frontend."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from tensorflow.contrib.framework.python.ops import audio_ops as contrib_audio
+from tensorflow.examples.speech_commands import audio_features
+from tensorflow.python.platform import test
+
+
+def _model_settings():
+  return {
+      "sample_rate": 16000,
+      "desired_samples": 16000,
+      "window_size_samples": 480,
+      "window_stride_samples": 160,
+      "dct_coefficient_count": 40,
+      "fingerprint_size": 98 * 40,
+  }
+
+
+def _tf_features(sess, pcm, model_settings):
+  """Runs the TensorFlow ops the processing graphs use on one clip."""
+  spectrogram = contrib_audio.audio_spectrogram(
+      pcm.reshape([-1, 1]),
+      window_size=model_settings["window_size_samples"],
+      stride=model_settings["window_stride_samples"],
+      magnitude_squared=True)
+  mfcc = contrib_audio.mfcc(
+      spectrogram,
+      model_settings["sample_rate"],
+      dct_coefficient_count=model_settings["dct_coefficient_count"])
+  return sess.run([spectrogram, mfcc])
+
+
+class AudioFeaturesTest(test.TestCase):
+
+  def testFrameSignal(self):
+    pcm = np.arange(20, dtype=np.float32).reshape([2, 10])
+    frames = audio_features.frame_signal(pcm, 4, 3)
+    self.assertEqual((2, 3, 4), frames.shape)
+    self.assertAllEqual([13, 14, 15, 16], frames[1, 1])
+
+  def testTimeShift(self):
+    pcm = np.array([[1, 2, 3, 4], [1, 2, 3, 4]], dtype=np.float32)
+    self.assertAllEqual([[0, 1, 2, 3], [3, 4, 0, 0]],
+                        audio_features.time_shift(pcm, [1, -2]))
+
+  def testMatchesAudioOps(self):
+    model_settings = _model_settings()
+    np.random.seed(0)
+    pcm = np.random.uniform(-0.5, 0.5, [2, 16000]).astype(np.float32)
+    spectrogram = audio_features.spectrogram(
+        pcm, model_settings["window_size_samples"],
+        model_settings["window_stride_samples"])
+    mfcc = audio_features.mfcc(spectrogram, model_settings["sample_rate"],
+                               model_settings["dct_coefficient_count"])
+    with self.test_session() as sess:
+      for i in range(pcm.shape[0]):
+        expected_spectrogram, expected_mfcc = _tf_features(
+            sess, pcm[i], model_settings)
+        self.assertAllClose(expected_spectrogram[0], spectrogram[i],
+                            rtol=1e-4, atol=1e-4)
+        self.assertAllClose(expected_mfcc[0], mfcc[i], rtol=1e-4, atol=1e-4)
+
+  def testFingerprints(self):
+    model_settings = _model_settings()
+    pcm = np.zeros([3, 16000], dtype=np.float32)
+    result = audio_features.fingerprints(pcm, model_settings, "mfcc")
+    self.assertEqual((3, model_settings["fingerprint_size"]), result.shape)
+    self.assertEqual(np.float32, result.dtype)
+    raw = audio_features.fingerprints(
+        pcm, dict(model_settings, fingerprint_size=16000), "raw")
+    self.assertEqual((3, 16000), raw.shape)
+
+
+class AudioFeaturesBenchmark(test.Benchmark):
+
+  def benchmarkMfcc(self):
+    model_settings = _model_settings()
+    pcm = np.random.uniform(-0.5, 0.5, [100, 16000]).astype(np.float32)
+    start_time = time.time()
+    audio_features.fingerprints(pcm, model_settings, "mfcc")
+    self.report_benchmark(name="numpy_mfcc_batch_100",
+                          iters=1, wall_time=time.time() - start_time)
+    with tf.Session(graph=tf.Graph()) as sess:
+      pcm_placeholder = tf.placeholder(tf.float32, [16000, 1])
+      spectrogram = contrib_audio.audio_spectrogram(
+          pcm_placeholder,
+          window_size=model_settings["window_size_samples"],
+          stride=model_settings["window_stride_samples"],
+          magnitude_squared=True)
+      mfcc = contrib_audio.mfcc(
+          spectrogram,
+          model_settings["sample_rate"],
+          dct_coefficient_count=model_settings["dct_coefficient_count"])
+      start_time = time.time()
+      for i in range(pcm.shape[0]):
+        sess.run(mfcc, feed_dict={pcm_placeholder: pcm[i].reshape([-1, 1])})
+      self.report_benchmark(name="tf_mfcc_per_clip_100",
+                            iters=1, wall_time=time.time() - start_time)
+
+
+if __name__ == "__main__":
+  test.main()
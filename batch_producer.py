@@ -0,0 +1,207 @@
+# Copyright 2017 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Produces training batches in a pool of worker processes.
+
+Augmentation and feature extraction in `AudioProcessor.get_data` are mostly
+Python and single session work, so running them on the training thread caps
+training at about one core. `BatchProducerPool` starts N worker processes that
+each hold their own `AudioProcessor` and TensorFlow session, and write finished
+batches into a ring of preallocated shared memory slots. The trainer reads a
+batch straight out of its slot, and the slot goes back to the workers when the
+next batch is requested.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import multiprocessing
+import random
+
+import numpy as np
+from six.moves import queue
+import tensorflow as tf
+
+import input_data
+
+# How long blocking queue operations wait before checking for shutdown.
+POLL_INTERVAL_SECONDS = 0.5
+# Shared memory type codes of the fingerprint types.
+FINGERPRINT_TYPECODES = {np.float64: 'd', np.float32: 'f', np.int16: 'h'}
+
+
+def _slot_views(fingerprints_buffer, labels_buffer, noise_labels_buffer,
+                num_slots, batch_size, model_settings, features,
+                noise_label_count):
+  """Wraps the shared buffers in numpy arrays of shape [slot, batch, size]."""
+  fingerprints = np.frombuffer(
+      fingerprints_buffer,
+      dtype=input_data.fingerprint_dtype(model_settings, features)).reshape(
+      (num_slots, batch_size, model_settings['fingerprint_size']))
+  labels = np.frombuffer(labels_buffer, dtype=np.float32).reshape(
+      (num_slots, batch_size, model_settings['label_count']))
+  noise_labels = np.frombuffer(noise_labels_buffer, dtype=np.float32).reshape(
+      (num_slots, batch_size, noise_label_count))
+  return fingerprints, labels, noise_labels
+
+
+def _worker_loop(worker_id, seed, data_url, data_dir, model_settings,
+                 batch_size, background_frequency, background_volume_range,
+                 time_shift, features, num_slots, noise_label_count,
+                 fingerprints_buffer, labels_buffer, noise_labels_buffer,
+                 free_slots, ready_slots, stop_event):
+  """Fills free slots with training batches until asked to stop."""
+  fingerprints, labels, noise_labels = _slot_views(
+      fingerprints_buffer, labels_buffer, noise_labels_buffer, num_slots,
+      batch_size, model_settings, features, noise_label_count)
+  # Each worker only runs small per-batch graphs, so keep it on the CPU and
+  # off the other workers' cores.
+  config = tf.ConfigProto(
+      intra_op_parallelism_threads=1,
+      inter_op_parallelism_threads=1,
+      device_count={'GPU': 0})
+  with tf.Graph().as_default(), tf.Session(config=config) as sess:
+    tf.set_random_seed(seed + worker_id)
+    audio_processor = input_data.AudioProcessor(data_url, data_dir,
+                                                model_settings)
+    # The processor reseeds `random` to build a stable data index, so the
+    # per-worker seeds have to be set after it's created.
+    random.seed(seed + worker_id)
+    np.random.seed(seed + worker_id)
+    audio_processor.prepare_sampler(model_settings, seed + worker_id)
+    while not stop_event.is_set():
+      try:
+        slot = free_slots.get(timeout=POLL_INTERVAL_SECONDS)
+      except queue.Empty:
+        continue
+      batch_fingerprints, batch_labels, batch_noise_labels, _ = (
+          audio_processor.get_data(batch_size, 0, model_settings,
+                                   background_frequency,
+                                   background_volume_range, time_shift,
+                                   'training', sess, features=features))
+      fingerprints[slot] = batch_fingerprints
+      labels[slot] = batch_labels
+      noise_labels[slot] = batch_noise_labels
+      ready_slots.put(slot)
+
+
+class BatchProducerPool(object):
+  """Pool of processes producing training batches into shared memory."""
+
+  def __init__(self, data_url, data_dir, model_settings, num_workers,
+               batch_size, background_frequency, background_volume_range,
+               time_shift, features='mfcc', num_slots=None,
+               seed=input_data.RANDOM_SEED):
+    """Starts the workers.
+
+    Args:
+      data_url: Web location of the tar file containing the data set.
+      data_dir: Directory holding the data set.
+      model_settings: Information about the current model being trained.
+      num_workers: How many worker processes to start.
+      batch_size: How many samples each batch should hold.
+      background_frequency: How many clips will have background noise, 0.0 to
+        1.0.
+      background_volume_range: How loud the background noise will be.
+      time_shift: How much to randomly shift the clips by in time.
+      features: Which features to compute, 'raw', 'spectrogram' or 'mfcc'.
+      num_slots: How many batches can be buffered, defaults to two per
+        worker.
+      seed: Base random seed, worker i is seeded with seed + i.
+    """
+    if num_slots is None:
+      num_slots = 2 * num_workers
+    self.num_slots = num_slots
+    self.batch_size = batch_size
+    noise_label_count = int(model_settings['noise_label_count'])
+    # Workers build their own TensorFlow runtime, which isn't safe to inherit
+    # through fork() once the parent has a session.
+    context = multiprocessing.get_context('spawn')
+    fingerprints_buffer = context.RawArray(
+        FINGERPRINT_TYPECODES[input_data.fingerprint_dtype(model_settings,
+                                                           features)],
+        num_slots * batch_size * model_settings['fingerprint_size'])
+    labels_buffer = context.RawArray(
+        'f', num_slots * batch_size * model_settings['label_count'])
+    noise_labels_buffer = context.RawArray(
+        'f', num_slots * batch_size * noise_label_count)
+    self.fingerprints, self.labels, self.noise_labels = _slot_views(
+        fingerprints_buffer, labels_buffer, noise_labels_buffer, num_slots,
+        batch_size, model_settings, features, noise_label_count)
+    self.free_slots = context.Queue()
+    self.ready_slots = context.Queue()
+    for slot in range(num_slots):
+      self.free_slots.put(slot)
+    self.stop_event = context.Event()
+    self.current_slot = None
+    self.workers = []
+    for worker_id in range(num_workers):
+      worker = context.Process(
+          target=_worker_loop,
+          args=(worker_id, seed, data_url, data_dir, model_settings,
+                batch_size, background_frequency, background_volume_range,
+                time_shift, features, num_slots, noise_label_count,
+                fingerprints_buffer, labels_buffer, noise_labels_buffer,
+                self.free_slots, self.ready_slots, self.stop_event))
+      worker.daemon = True
+      worker.start()
+      self.workers.append(worker)
+    tf.logging.info('Started %d batch producer workers with %d slots',
+                    num_workers, num_slots)
+
+  def get_batch(self):
+    """Returns the next finished batch.
+
+    The returned arrays are views into shared memory, not copies. They stay
+    valid until the next call, which hands their slot back to the workers.
+
+    Returns:
+      Fingerprints, one-hot labels and one-hot noise labels of the batch.
+
+    Raises:
+      Exception: If a worker died, since it may never deliver its batch.
+    """
+    if self.current_slot is not None:
+      self.free_slots.put(self.current_slot)
+      self.current_slot = None
+    while True:
+      try:
+        slot = self.ready_slots.get(timeout=POLL_INTERVAL_SECONDS)
+        break
+      except queue.Empty:
+        for worker in self.workers:
+          if not worker.is_alive():
+            raise Exception('Batch producer worker exited with code %s' %
+                            worker.exitcode)
+    self.current_slot = slot
+    return self.fingerprints[slot], self.labels[slot], self.noise_labels[slot]
+
+  def close(self):
+    """Stops the workers and waits for them to exit."""
+    self.stop_event.set()
+    for worker in self.workers:
+      worker.join(2 * POLL_INTERVAL_SECONDS + 5)
+      if worker.is_alive():
+        worker.terminate()
+        worker.join()
+    self.workers = []
+    for slot_queue in [self.free_slots, self.ready_slots]:
+      slot_queue.close()
+      slot_queue.cancel_join_thread()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
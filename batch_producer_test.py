@@ -0,0 +1,105 @@
+# Copyright 2017 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for the multiprocess batch producer pool."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import multiprocessing
+import threading
+
+import numpy as np
+
+from tensorflow.examples.speech_commands import batch_producer
+from tensorflow.python.platform import test
+
+
+class _FakeWorker(object):
+  """Stands in for a worker process."""
+
+  def __init__(self, alive=True, exitcode=None, exits_on_join=True):
+    self.alive = alive
+    self.exitcode = exitcode
+    self.exits_on_join = exits_on_join
+    self.joined = False
+    self.terminated = False
+
+  def is_alive(self):
+    return self.alive
+
+  def join(self, timeout=None):
+    self.joined = True
+    if self.exits_on_join:
+      self.alive = False
+
+  def terminate(self):
+    self.terminated = True
+    self.alive = False
+
+
+class BatchProducerTest(test.TestCase):
+
+  def _pool(self, workers, num_slots=2):
+    # The slots are filled by hand instead of by worker processes.
+    pool = batch_producer.BatchProducerPool.__new__(
+        batch_producer.BatchProducerPool)
+    pool.num_slots = num_slots
+    pool.batch_size = 1
+    pool.fingerprints = np.arange(num_slots * 3).reshape((num_slots, 1, 3))
+    pool.labels = np.zeros((num_slots, 1, 2), np.float32)
+    pool.noise_labels = np.zeros((num_slots, 1, 2), np.float32)
+    pool.free_slots = multiprocessing.Queue()
+    pool.ready_slots = multiprocessing.Queue()
+    pool.stop_event = threading.Event()
+    pool.current_slot = None
+    pool.workers = workers
+    return pool
+
+  def testGetBatchHandsBackSlot(self):
+    pool = self._pool([_FakeWorker()])
+    pool.ready_slots.put(1)
+    fingerprints, _, _ = pool.get_batch()
+    self.assertAllEqual([[3, 4, 5]], fingerprints)
+    self.assertTrue(pool.free_slots.empty())
+    pool.ready_slots.put(0)
+    fingerprints, _, _ = pool.get_batch()
+    self.assertAllEqual([[0, 1, 2]], fingerprints)
+    # The slot of the previous batch went back to the workers.
+    self.assertEqual(1, pool.free_slots.get(timeout=1.0))
+    self.assertEqual(0, pool.current_slot)
+    pool.close()
+
+  def testGetBatchDeadWorker(self):
+    pool = self._pool([_FakeWorker(), _FakeWorker(alive=False, exitcode=3)])
+    with self.assertRaises(Exception) as e:
+      pool.get_batch()
+    self.assertTrue("exited with code 3" in str(e.exception))
+    pool.close()
+
+  def testClose(self):
+    stopping = _FakeWorker()
+    stuck = _FakeWorker(exits_on_join=False)
+    with self._pool([stopping, stuck]) as pool:
+      pass
+    self.assertTrue(pool.stop_event.is_set())
+    self.assertTrue(stopping.joined)
+    self.assertFalse(stopping.terminated)
+    self.assertTrue(stuck.terminated)
+    self.assertEqual([], pool.workers)
+
+
+if __name__ == "__main__":
+  test.main()
@@ -0,0 +1,154 @@
+# Copyright 2017 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Averages the predictions of several trained models in a single graph.
+
+An ensemble config lists the members, one section each, with the model config
+they were trained with, their checkpoint and an optional weight:
+
+  [wave_net]
+  arch_config_file = model_configs/wave_net.config
+  checkpoint = /tmp/speech_commands_train/wave_net.ckpt-30000
+  weight = 2.0
+
+  [ds_cnn]
+  arch_config_file = model_configs/ds_cnn.config
+  checkpoint = /tmp/speech_commands_train/ds_cnn.ckpt-30000
+
+Every member is built in a variable scope named after its section and reads
+its fingerprints from features computed in the same graph. Clips are decoded
+once, and members with the same feature settings share one set of
+fingerprints, so a batch of files goes through every model in one session
+call. With test-time augmentation every clip is expanded into time shifted
+copies before the features, and each member's outputs are averaged over the
+copies.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import configparser
+
+import tensorflow as tf
+
+from feature_cache import feature_settings_key
+from input_data import (average_copies, batch_fingerprint, decode_clip,
+                        decode_wav_data, expand_copies, prepare_model_settings)
+from models import Graph
+
+ENSEMBLE_AVERAGES = ['probabilities', 'logits']
+
+
+def load_ensemble_config(config_file):
+  """Reads the members of an ensemble.
+
+  Args:
+    config_file: Path of the ensemble config, see the module docstring.
+
+  Returns:
+    List of (name, model settings, checkpoint path, weight) tuples.
+
+  Raises:
+    Exception: If the config has no members.
+  """
+  config = configparser.ConfigParser()
+  config.read(config_file)
+  members = []
+  for name in config.sections():
+    section = config[name]
+    members.append((name, prepare_model_settings(section['arch_config_file']),
+                    section['checkpoint'], float(section.get('weight', 1.0))))
+  if not members:
+    raise Exception('Ensemble config "' + config_file + '" has no members')
+  return members
+
+
+class Ensemble(object):
+  """Graph of several models fed from shared, in-graph features."""
+
+  def __init__(self, members, average='probabilities', time_shifts=None,
+               noise_stddev=0.0, wav_data_input=False):
+    """Builds every member and the weighted average of their outputs.
+
+    Args:
+      members: List of (name, model settings, checkpoint path, weight) tuples
+        from `load_ensemble_config`.
+      average: Whether the members' 'probabilities' or 'logits' are averaged.
+      time_shifts: Optional list of shifts in samples for test-time
+        augmentation, one copy of every clip is made per shift.
+      noise_stddev: Level of the noise added to the augmented copies.
+      wav_data_input: Whether the graph is fed WAV-encoded file contents
+        instead of file paths.
+
+    Raises:
+      Exception: If the averaging mode isn't recognized or the members don't
+        agree on the labels.
+    """
+    if average not in ENSEMBLE_AVERAGES:
+      raise Exception('ensemble average "' + average +
+                      '" not recognized, should be one of ' +
+                      ', '.join(ENSEMBLE_AVERAGES))
+    label_counts = set(settings['label_count'] for _, settings, _, _ in members)
+    if len(label_counts) != 1:
+      raise Exception('Ensemble members have different label counts: %s' %
+                      sorted(label_counts))
+    self.members = members
+    if wav_data_input:
+      self.wavs = tf.placeholder(tf.string, [None], name='wav_data')
+      decode_fn = decode_wav_data
+    else:
+      self.wavs = tf.placeholder(tf.string, [None], name='wav_file_names')
+      decode_fn = decode_clip
+    clips = {}
+    fingerprints = {}
+    self.graphs = []
+    outputs = []
+    for name, model_settings, _, weight in members:
+      desired_samples = model_settings['desired_samples']
+      if desired_samples not in clips:
+        clips[desired_samples] = tf.map_fn(
+            lambda wav: decode_fn(wav, desired_samples),
+            self.wavs, dtype=tf.float32, back_prop=False)
+        if time_shifts:
+          clips[desired_samples] = expand_copies(
+              clips[desired_samples], time_shifts, noise_stddev)
+      features = model_settings['features']
+      key = feature_settings_key(model_settings, features)
+      if key not in fingerprints:
+        fingerprints[key] = batch_fingerprint(clips[desired_samples],
+                                              model_settings, features)
+      with tf.variable_scope(name):
+        graph = Graph(model_settings, (fingerprints[key],),
+                      inference_only=True)
+      self.graphs.append(graph)
+      logits = graph.final_fc
+      if average == 'probabilities':
+        output = tf.nn.softmax(logits)
+      else:
+        output = logits
+      if time_shifts:
+        output = average_copies(output, len(time_shifts))
+      outputs.append(weight * output)
+    total_weight = sum(weight for _, _, _, weight in members)
+    self.scores = tf.add_n(outputs) / total_weight
+    self.predicted_indices = tf.argmax(self.scores, 1)
+
+  def load_variables_from_checkpoints(self, sess):
+    """Restores every member from its own checkpoint."""
+    for (name, _, checkpoint, _), graph in zip(self.members, self.graphs):
+      graph.load_variables_from_checkpoint(sess, checkpoint, scope=name)
+
+  def feed_dict(self, wavs):
+    """Returns the feed dict predicting the given .wav paths or contents."""
+    return {self.wavs: wavs}
@@ -0,0 +1,161 @@
+# Copyright 2017 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for the single-graph ensemble of trained models."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from tensorflow.examples.speech_commands import ensemble
+from tensorflow.examples.speech_commands import input_data
+from tensorflow.examples.speech_commands import models
+from tensorflow.python.platform import test
+
+
+def _softmax(logits):
+  exp = np.exp(logits - np.max(logits, axis=1, keepdims=True))
+  return exp / np.sum(exp, axis=1, keepdims=True)
+
+
+class EnsembleTest(test.TestCase):
+
+  def _writeModelConfig(self):
+    config_path = os.path.join(self.get_temp_dir(), "single_fc.config")
+    with open(config_path, "w") as f:
+      f.write("\n".join([
+          "[arch-parameters]",
+          "arch = single_fc",
+          "[vocabulary]",
+          "wanted_words = a,b",
+          "[data-processing-parameters]",
+          "features = mfcc",
+          "fft_window_size = 128",
+          "sample_rate = 16000",
+          "clip_duration_ms = 10",
+          "window_size_ms = 6",
+          "window_stride_ms = 6",
+          "dct_coefficient_count = 40",
+          "[train-parameters]",
+          "how_many_training_steps = 10",
+          "learning_rate = 0.001",
+          "batch_size = 4",
+      ]) + "\n")
+    return config_path
+
+  def _saveCheckpoint(self, model_settings, name, seed):
+    # Trained models are saved without the scope of their ensemble member.
+    rng = np.random.RandomState(seed)
+    values = [rng.randn(model_settings["fingerprint_size"],
+                        model_settings["label_count"]).astype(np.float32),
+              rng.randn(model_settings["label_count"]).astype(np.float32)]
+    checkpoint = os.path.join(self.get_temp_dir(), name + ".ckpt")
+    with tf.Graph().as_default(), tf.Session() as sess:
+      graph = models.Graph(model_settings, inference_only=True)
+      for variable, value in zip(graph.model_variables, values):
+        sess.run(variable.assign(value))
+      tf.train.Saver().save(sess, checkpoint)
+    return checkpoint, values
+
+  def _writeEnsemble(self):
+    model_config = self._writeModelConfig()
+    model_settings = input_data.prepare_model_settings(model_config)
+    first, first_values = self._saveCheckpoint(model_settings, "first", 1)
+    second, second_values = self._saveCheckpoint(model_settings, "second", 2)
+    config_path = os.path.join(self.get_temp_dir(), "ensemble.config")
+    with open(config_path, "w") as f:
+      f.write("\n".join([
+          "[first]",
+          "arch_config_file = " + model_config,
+          "checkpoint = " + first,
+          "weight = 3.0",
+          "[second]",
+          "arch_config_file = " + model_config,
+          "checkpoint = " + second,
+      ]) + "\n")
+    return config_path, [first_values, second_values]
+
+  def _predict(self, average):
+    config_path, values = self._writeEnsemble()
+    members = ensemble.load_ensemble_config(config_path)
+    fingerprint_size = members[0][1]["fingerprint_size"]
+    fingerprints = np.random.RandomState(3).randn(
+        5, fingerprint_size).astype(np.float32)
+    with tf.Graph().as_default(), tf.Session() as sess:
+      model = ensemble.Ensemble(members, average=average)
+      model.load_variables_from_checkpoints(sess)
+      restored = [sess.run(graph.model_variables) for graph in model.graphs]
+      # Both members use the same features, so they read one tensor.
+      self.assertEqual(model.graphs[0].fingerprint_input,
+                       model.graphs[1].fingerprint_input)
+      scores, predicted_indices = sess.run(
+          [model.scores, model.predicted_indices],
+          feed_dict={model.graphs[0].fingerprint_input: fingerprints})
+    logits = [np.dot(fingerprints, weights) + bias for weights, bias in values]
+    return values, restored, logits, scores, predicted_indices
+
+  def testLoadEnsembleConfig(self):
+    config_path, _ = self._writeEnsemble()
+    members = ensemble.load_ensemble_config(config_path)
+    self.assertEqual(["first", "second"], [name for name, _, _, _ in members])
+    self.assertEqual([3.0, 1.0], [weight for _, _, _, weight in members])
+    self.assertEqual(
+        [os.path.join(self.get_temp_dir(), "first.ckpt"),
+         os.path.join(self.get_temp_dir(), "second.ckpt")],
+        [checkpoint for _, _, checkpoint, _ in members])
+    self.assertEqual("single_fc", members[0][1]["arch"])
+    self.assertEqual(4, members[0][1]["label_count"])
+
+  def testLoadEnsembleConfigEmpty(self):
+    config_path = os.path.join(self.get_temp_dir(), "empty.config")
+    with open(config_path, "w") as f:
+      f.write("\n")
+    with self.assertRaises(Exception) as e:
+      ensemble.load_ensemble_config(config_path)
+    self.assertTrue("has no members" in str(e.exception))
+
+  def testScopedRestore(self):
+    values, restored, _, _, _ = self._predict("probabilities")
+    for member_values, member_restored in zip(values, restored):
+      for value, restored_value in zip(member_values, member_restored):
+        self.assertAllClose(value, restored_value)
+
+  def testAverageProbabilities(self):
+    _, _, logits, scores, predicted_indices = self._predict("probabilities")
+    expected = (3.0 * _softmax(logits[0]) + _softmax(logits[1])) / 4.0
+    self.assertAllClose(expected, scores, rtol=1e-5, atol=1e-5)
+    self.assertAllEqual(np.argmax(expected, 1), predicted_indices)
+
+  def testAverageLogits(self):
+    _, _, logits, scores, predicted_indices = self._predict("logits")
+    expected = (3.0 * logits[0] + logits[1]) / 4.0
+    self.assertAllClose(expected, scores, rtol=1e-4, atol=1e-4)
+    self.assertAllEqual(np.argmax(expected, 1), predicted_indices)
+
+  def testBadAverage(self):
+    config_path, _ = self._writeEnsemble()
+    members = ensemble.load_ensemble_config(config_path)
+    with tf.Graph().as_default():
+      with self.assertRaises(Exception) as e:
+        ensemble.Ensemble(members, average="median")
+    self.assertTrue("not recognized" in str(e.exception))
+
+
+if __name__ == "__main__":
+  test.main()
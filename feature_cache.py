@@ -0,0 +1,189 @@
+# Copyright 2017 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Persistent on-disk cache of processed fingerprints.
+
+Validation, test and submission runs compute exactly the same features for the
+same files every time. `FeatureCache` stores them once as memory-mapped .npy
+shards, in a directory named after a hash of the model settings the features
+depend on, so every configuration sharing a frontend shares the cache and a
+changed frontend never reads stale features. The total size of the cache can
+be bounded, in which case the least recently used shards of any configuration
+are evicted first.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import glob
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import tensorflow as tf
+
+# Model settings that change the fingerprints computed for a clip.
+FEATURE_SETTINGS = [
+    'features', 'sample_rate', 'desired_samples', 'window_size_samples',
+    'window_stride_samples', 'dct_coefficient_count', 'fft_window_size'
+]
+DEFAULT_SHARD_SIZE = 4096
+
+
+def feature_settings_key(model_settings, features):
+  """Hashes the model settings the fingerprints depend on.
+
+  Args:
+    model_settings: Information about the current model being trained.
+    features: Which features are computed, 'raw', 'spectrogram' or 'mfcc'.
+
+  Returns:
+    Hex string identifying the feature configuration.
+  """
+  settings = dict(model_settings)
+  settings['features'] = features
+  # Config files are parsed into floats, so 40 and 40.0 have to hash the same.
+  values = []
+  for key in FEATURE_SETTINGS:
+    value = settings.get(key)
+    try:
+      value = float(value)
+    except (TypeError, ValueError):
+      pass
+    values.append([key, value])
+  return hashlib.sha1(json.dumps(values).encode('utf-8')).hexdigest()
+
+
+class FeatureCache(object):
+  """Content-addressed, size-bounded cache of fingerprint shards."""
+
+  def __init__(self, cache_dir, model_settings, features, max_bytes=None,
+               shard_size=DEFAULT_SHARD_SIZE):
+    """Opens the cache for one feature configuration.
+
+    Args:
+      cache_dir: Root directory shared by all configurations.
+      model_settings: Information about the current model being trained.
+      features: Which features are computed, 'raw', 'spectrogram' or 'mfcc'.
+      max_bytes: Total size the cache directory is kept under, or None for no
+        limit.
+      shard_size: How many clips each shard holds.
+    """
+    self.cache_dir = cache_dir
+    self.config_dir = os.path.join(cache_dir,
+                                   feature_settings_key(model_settings,
+                                                        features))
+    self.max_bytes = max_bytes
+    self.shard_size = shard_size
+    self.fingerprint_size = model_settings['fingerprint_size']
+    if not os.path.exists(self.config_dir):
+      os.makedirs(self.config_dir)
+
+  def _shard_path(self, name, shard):
+    return os.path.join(self.config_dir, '%s-%05d' % (name, shard))
+
+  def _load_shard(self, shard_path, entries):
+    """Returns the memory-mapped shard, or None if it's missing or stale."""
+    if not (os.path.exists(shard_path + '.npy') and
+            os.path.exists(shard_path + '.json')):
+      return None
+    with open(shard_path + '.json') as f:
+      if json.load(f)['entries'] != entries:
+        return None
+    # Mark the shard as recently used for eviction.
+    os.utime(shard_path + '.json', None)
+    return np.load(shard_path + '.npy', mmap_mode='r')
+
+  def _save_shard(self, shard_path, entries, data):
+    data = np.asarray(data, dtype=np.float32)
+    shard = np.lib.format.open_memmap(
+        shard_path + '.npy.tmp', mode='w+', dtype=np.float32, shape=data.shape)
+    shard[:] = data
+    shard.flush()
+    del shard
+    with open(shard_path + '.json.tmp', 'w') as f:
+      json.dump({'entries': entries}, f)
+    os.rename(shard_path + '.npy.tmp', shard_path + '.npy')
+    os.rename(shard_path + '.json.tmp', shard_path + '.json')
+
+  def get_rows(self, name, entries, offset, count, compute_fn):
+    """Returns fingerprints for a range of clips, computing missing shards.
+
+    Args:
+      name: Name of the clip list, e.g. the partition, used for shard files.
+      entries: List of strings identifying every clip in the list. A shard is
+        only reused if the entries it was computed for are unchanged.
+      offset: Index of the first clip to return.
+      count: How many clips to return.
+      compute_fn: Function taking (start, end) and returning the fingerprints
+        of clips start to end - 1, called for shards that aren't cached yet.
+
+    Returns:
+      Float32 array of shape [count, fingerprint_size].
+    """
+    result = np.zeros((count, self.fingerprint_size), dtype=np.float32)
+    first_shard = offset // self.shard_size
+    last_shard = (offset + count - 1) // self.shard_size
+    for shard in range(first_shard, last_shard + 1):
+      shard_start = shard * self.shard_size
+      shard_end = min(shard_start + self.shard_size, len(entries))
+      shard_entries = entries[shard_start:shard_end]
+      shard_path = self._shard_path(name, shard)
+      data = self._load_shard(shard_path, shard_entries)
+      if data is None:
+        data = compute_fn(shard_start, shard_end)
+        self._save_shard(shard_path, shard_entries, data)
+        self.evict(keep=shard_path)
+      copy_start = max(offset, shard_start)
+      copy_end = min(offset + count, shard_end)
+      result[copy_start - offset:copy_end - offset] = (
+          data[copy_start - shard_start:copy_end - shard_start])
+    return result
+
+  def evict(self, keep=None):
+    """Deletes least recently used shards until the cache fits its limit.
+
+    Args:
+      keep: Path of a shard that must not be evicted, without extension.
+    """
+    if self.max_bytes is None:
+      return
+    shards = []
+    total_bytes = 0
+    for npy_path in glob.glob(os.path.join(self.cache_dir, '*', '*.npy')):
+      shard_path = npy_path[:-len('.npy')]
+      try:
+        size = os.path.getsize(npy_path)
+        last_used = os.path.getmtime(shard_path + '.json')
+      except OSError:
+        continue
+      total_bytes += size
+      shards.append((last_used, size, shard_path))
+    for _, size, shard_path in sorted(shards):
+      if total_bytes <= self.max_bytes:
+        break
+      if shard_path == keep:
+        continue
+      for extension in ['.json', '.npy']:
+        if os.path.exists(shard_path + extension):
+          os.remove(shard_path + extension)
+      total_bytes -= size
+      tf.logging.info('Evicted feature cache shard %s', shard_path)
+    # Drop configurations that have no shards left.
+    for config_dir in glob.glob(os.path.join(self.cache_dir, '*')):
+      if (config_dir != self.config_dir and os.path.isdir(config_dir) and
+          not os.listdir(config_dir)):
+        shutil.rmtree(config_dir)
@@ -0,0 +1,100 @@
+# Copyright 2017 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for the on-disk feature cache."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import glob
+import os
+
+import numpy as np
+
+from tensorflow.examples.speech_commands import feature_cache
+from tensorflow.python.platform import test
+
+
+def _model_settings():
+  return {
+      "sample_rate": 16000.0,
+      "desired_samples": 16000,
+      "window_size_samples": 480,
+      "window_stride_samples": 160,
+      "dct_coefficient_count": 40.0,
+      "fft_window_size": 256.0,
+      "fingerprint_size": 3,
+  }
+
+
+class FeatureCacheTest(test.TestCase):
+
+  def testFeatureSettingsKey(self):
+    model_settings = _model_settings()
+    key = feature_cache.feature_settings_key(model_settings, "mfcc")
+    self.assertEqual(key, feature_cache.feature_settings_key(
+        dict(model_settings, dct_coefficient_count=40), "mfcc"))
+    self.assertNotEqual(key, feature_cache.feature_settings_key(
+        model_settings, "spectrogram"))
+    self.assertNotEqual(key, feature_cache.feature_settings_key(
+        dict(model_settings, window_stride_samples=320), "mfcc"))
+
+  def testGetRows(self):
+    cache_dir = os.path.join(self.get_temp_dir(), "get_rows")
+    cache = feature_cache.FeatureCache(cache_dir, _model_settings(), "mfcc",
+                                       shard_size=4)
+    entries = ["clip%d" % i for i in range(10)]
+    computed = []
+
+    def compute_fn(start, end):
+      computed.append((start, end))
+      return np.tile(np.arange(start, end)[:, np.newaxis], [1, 3])
+
+    rows = cache.get_rows("validation", entries, 3, 4, compute_fn)
+    self.assertAllEqual([3, 4, 5, 6], rows[:, 0])
+    self.assertEqual([(0, 4), (4, 8)], computed)
+    rows = cache.get_rows("validation", entries, 6, 4, compute_fn)
+    self.assertAllEqual([6, 7, 8, 9], rows[:, 2])
+    self.assertEqual([(0, 4), (4, 8), (8, 10)], computed)
+    # A changed clip list invalidates only the shards it touches.
+    entries[9] = "other"
+    cache.get_rows("validation", entries, 0, 10, compute_fn)
+    self.assertEqual([(0, 4), (4, 8), (8, 10), (8, 10)], computed)
+
+  def testEvict(self):
+    cache_dir = os.path.join(self.get_temp_dir(), "evict")
+    model_settings = _model_settings()
+    shard_bytes = 4 * 3 * 4 + 128
+    cache = feature_cache.FeatureCache(cache_dir, model_settings, "mfcc",
+                                       max_bytes=2 * shard_bytes, shard_size=4)
+    entries = ["clip%d" % i for i in range(12)]
+
+    def compute_fn(start, end):
+      return np.zeros((end - start, 3))
+
+    cache.get_rows("validation", entries, 0, 12, compute_fn)
+    self.assertEqual(2, len(glob.glob(os.path.join(cache_dir, "*", "*.npy"))))
+    other_cache = feature_cache.FeatureCache(cache_dir, model_settings,
+                                             "spectrogram",
+                                             max_bytes=2 * shard_bytes,
+                                             shard_size=4)
+    other_cache.get_rows("validation", entries, 0, 8, compute_fn)
+    self.assertEqual(2, len(glob.glob(os.path.join(cache_dir, "*", "*.npy"))))
+    self.assertEqual([other_cache.config_dir],
+                     glob.glob(os.path.join(cache_dir, "*")))
+
+
+if __name__ == "__main__":
+  test.main()
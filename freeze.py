@@ -18,20 +18,26 @@ Once you've trained a model using the `train.py` script, you can use this tool
 to convert it into a binary GraphDef file that can be loaded into the Android,
 iOS, or Raspberry Pi example code. Here's an example of how to run it:
 
-bazel run tensorflow/examples/speech_commands/freeze -- \
---sample_rate=16000 --dct_coefficient_count=40 --window_size_ms=20 \
---window_stride_ms=10 --clip_duration_ms=1000 \
---model_architecture=conv \
---start_checkpoint=/tmp/speech_commands_train/conv.ckpt-1300 \
+python tensorflow/examples/speech_commands/freeze.py \
+--arch_config_file=model_configs/wave_net.config \
+--start_checkpoint=/tmp/speech_commands_train/wave_net.ckpt-30000 \
 --output_file=/tmp/my_frozen_graph.pb
 
-One thing to watch out for is that you need to pass in the same arguments for
-`sample_rate` and other command line variables here as you did for the training
-script.
+The model, its feature frontend (raw samples, spectrogram or MFCC) and the clip
+settings all come from the same arch config file the model was trained with.
+The model is built for inference only, without labels, loss or optimizer, and
+with its training switches as constants, so the frozen graph holds nothing but
+the decoder, the frontend and the forward pass.
 
-The resulting graph has an input for WAV-encoded data named 'wav_data', one for
-raw PCM data (as floats in the range -1.0 to 1.0) called 'decoded_sample_data',
-and the output is called 'labels_softmax'.
+The resulting graph has an input for WAV-encoded data named 'wav_data', and the
+output is called 'labels_softmax'. By default 'wav_data' takes one file, and
+the decoded PCM data (as floats in the range -1.0 to 1.0) is available as
+'decoded_sample_data'. With --batched_input 'wav_data' takes a vector of files
+instead, which lets servers run several clips in one call.
+
+With --optimize the batch norms, dropout and constant subgraphs are folded out
+of the frozen graph by `optimize_graph.py`, and the result is checked against
+the unoptimized graph before it is saved.
 
 """
 from __future__ import absolute_import
@@ -47,133 +53,133 @@ import tensorflow as tf
 from tensorflow.contrib.framework.python.ops import audio_ops as contrib_audio
 import input_data
 import models
+import optimize_graph
 from tensorflow.python.framework import graph_util
 
 FLAGS = None
 
+# Nodes that clients address by name and must survive the pruning.
+INPUT_NODE_NAMES = ['wav_data', 'decoded_sample_data']
+OUTPUT_NODE_NAME = 'labels_softmax'
+
 
-def create_inference_graph(wanted_words, sample_rate, clip_duration_ms,
-                           clip_stride_ms, window_size_ms, window_stride_ms,
-                           dct_coefficient_count, model_architecture):
+def create_inference_graph(model_settings, batched_input=False):
   """Creates an audio model with the nodes needed for inference.
 
-  Uses the supplied arguments to create a model, and inserts the input and
-  output nodes that are needed to use the graph for inference.
+  Builds the WAV input, decodes it, computes the fingerprints with the
+  frontend the model settings ask for and runs them through an inference-only
+  `models.Graph`.
 
   Args:
-    wanted_words: Comma-separated list of the words we're trying to recognize.
-    sample_rate: How many samples per second are in the input audio files.
-    clip_duration_ms: How many samples to analyze for the audio pattern.
-    clip_stride_ms: How often to run recognition. Useful for models with cache.
-    window_size_ms: Time slice duration to estimate frequencies from.
-    window_stride_ms: How far apart time slices should be.
-    dct_coefficient_count: Number of frequency bands to analyze.
-    model_architecture: Name of the kind of model to generate.
+    model_settings: Information about the model, from
+      `input_data.prepare_model_settings`.
+    batched_input: Whether 'wav_data' takes a vector of files instead of one.
+
+  Returns:
+    The inference-only `models.Graph`.
   """
+  desired_samples = model_settings['desired_samples']
+  if batched_input:
+    wav_data_placeholder = tf.placeholder(tf.string, [None], name='wav_data')
+    pcm = tf.map_fn(
+        lambda wav_data: input_data.decode_wav_data(wav_data, desired_samples),
+        wav_data_placeholder, dtype=tf.float32, back_prop=False)
+  else:
+    wav_data_placeholder = tf.placeholder(tf.string, [], name='wav_data')
+    decoded_sample_data = contrib_audio.decode_wav(
+        wav_data_placeholder,
+        desired_channels=1,
+        desired_samples=desired_samples,
+        name='decoded_sample_data')
+    # A batch of one clip, [1, desired_samples].
+    pcm = tf.transpose(decoded_sample_data.audio)
+  fingerprints = input_data.batch_fingerprint(pcm, model_settings,
+                                              model_settings['features'])
+  return models.Graph(model_settings, (fingerprints,), inference_only=True)
+
+
+def freeze_graph_def(sess, batched_input=False):
+  """Turns the variables into constants and strips everything unused.
 
-  words_list = input_data.prepare_words_list(wanted_words.split(','))
-  model_settings = models.prepare_model_settings(
-      len(words_list), sample_rate, clip_duration_ms, window_size_ms,
-      window_stride_ms, dct_coefficient_count)
-  runtime_settings = {'clip_stride_ms': clip_stride_ms}
-
-  wav_data_placeholder = tf.placeholder(tf.string, [], name='wav_data')
-  decoded_sample_data = contrib_audio.decode_wav(
-      wav_data_placeholder,
-      desired_channels=1,
-      desired_samples=model_settings['desired_samples'],
-      name='decoded_sample_data')
-  spectrogram = contrib_audio.audio_spectrogram(
-      decoded_sample_data.audio,
-      window_size=model_settings['window_size_samples'],
-      stride=model_settings['window_stride_samples'],
-      magnitude_squared=True)
-  fingerprint_input = contrib_audio.mfcc(
-      spectrogram,
-      decoded_sample_data.sample_rate,
-      dct_coefficient_count=dct_coefficient_count)
-  fingerprint_frequency_size = model_settings['dct_coefficient_count']
-  fingerprint_time_size = model_settings['spectrogram_length']
-  reshaped_input = tf.reshape(fingerprint_input, [
-      -1, fingerprint_time_size * fingerprint_frequency_size
-  ])
-
-  logits = models.create_model(
-      reshaped_input, model_settings, model_architecture, is_training=False,
-      runtime_settings=runtime_settings)
-
-  # Create an output to use for inference.
-  tf.nn.softmax(logits, name='labels_softmax')
+  Args:
+    sess: Session holding the graph from `create_inference_graph` with its
+      weights loaded.
+    batched_input: Whether the graph was built with a batched input.
+
+  Returns:
+    The minimal GraphDef computing 'labels_softmax' from 'wav_data'.
+  """
+  frozen_graph_def = graph_util.convert_variables_to_constants(
+      sess, sess.graph_def, [OUTPUT_NODE_NAME])
+  protected_nodes = [OUTPUT_NODE_NAME] + (
+      INPUT_NODE_NAMES[:1] if batched_input else INPUT_NODE_NAMES)
+  frozen_graph_def = graph_util.remove_training_nodes(
+      frozen_graph_def, protected_nodes=protected_nodes)
+  # Device placements from the training machine only slow down loading.
+  for node in frozen_graph_def.node:
+    node.device = ''
+  return frozen_graph_def
 
 
 def main(_):
+  tf.logging.set_verbosity(tf.logging.INFO)
+  model_settings = input_data.prepare_model_settings(FLAGS.arch_config_file)
+  model_settings['noise_label_count'] = FLAGS.noise_label_count
 
   # Create the model and load its weights.
-  sess = tf.InteractiveSession()
-  create_inference_graph(FLAGS.wanted_words, FLAGS.sample_rate,
-                         FLAGS.clip_duration_ms, FLAGS.clip_stride_ms,
-                         FLAGS.window_size_ms, FLAGS.window_stride_ms,
-                         FLAGS.dct_coefficient_count, FLAGS.model_architecture)
-  models.load_variables_from_checkpoint(sess, FLAGS.start_checkpoint)
-
-  # Turn all the variables into inline constants inside the graph and save it.
-  frozen_graph_def = graph_util.convert_variables_to_constants(
-      sess, sess.graph_def, ['labels_softmax'])
+  with tf.Session() as sess:
+    graph = create_inference_graph(model_settings, FLAGS.batched_input)
+    graph.load_variables_from_checkpoint(sess, FLAGS.start_checkpoint)
+
+    # Turn all the variables into inline constants inside the graph and save it.
+    frozen_graph_def = freeze_graph_def(sess, FLAGS.batched_input)
+  if FLAGS.optimize:
+    input_node_names = (INPUT_NODE_NAMES[:1] if FLAGS.batched_input else
+                        INPUT_NODE_NAMES)
+    optimized_graph_def = optimize_graph.optimize_graph_def(
+        frozen_graph_def, input_node_names, [OUTPUT_NODE_NAME])
+    optimize_graph.check_equivalence(
+        frozen_graph_def, optimized_graph_def,
+        optimize_graph.synthetic_wav_feeds(
+            frozen_graph_def,
+            sample_rate=model_settings['sample_rate'],
+            clip_samples=model_settings['desired_samples']),
+        [OUTPUT_NODE_NAME])
+    frozen_graph_def = optimized_graph_def
   tf.train.write_graph(
       frozen_graph_def,
       os.path.dirname(FLAGS.output_file),
       os.path.basename(FLAGS.output_file),
       as_text=False)
-  tf.logging.info('Saved frozen graph to %s', FLAGS.output_file)
+  tf.logging.info('Saved frozen graph with %d nodes to %s',
+                  len(frozen_graph_def.node), FLAGS.output_file)
 
 
 if __name__ == '__main__':
   parser = argparse.ArgumentParser()
   parser.add_argument(
-      '--sample_rate',
-      type=int,
-      default=16000,
-      help='Expected sample rate of the wavs',)
-  parser.add_argument(
-      '--clip_duration_ms',
-      type=int,
-      default=1000,
-      help='Expected duration in milliseconds of the wavs',)
-  parser.add_argument(
-      '--clip_stride_ms',
-      type=int,
-      default=30,
-      help='How often to run recognition. Useful for models with cache.',)
-  parser.add_argument(
-      '--window_size_ms',
-      type=float,
-      default=30.0,
-      help='How long each spectrogram timeslice is',)
-  parser.add_argument(
-      '--window_stride_ms',
-      type=float,
-      default=10.0,
-      help='How long the stride is between spectrogram timeslices',)
-  parser.add_argument(
-      '--dct_coefficient_count',
-      type=int,
-      default=40,
-      help='How many bins to use for the MFCC fingerprint',)
+      '--arch_config_file',
+      type=str,
+      default='',
+      help='File containing the parameters the model was trained with.')
   parser.add_argument(
       '--start_checkpoint',
       type=str,
       default='',
-      help='If specified, restore this pretrained model before any training.')
+      help='Checkpoint of the trained model.')
   parser.add_argument(
-      '--model_architecture',
-      type=str,
-      default='conv',
-      help='What model architecture to use')
+      '--noise_label_count',
+      type=int,
+      default=11,
+      help='Number of noise labels, only used by adversarial models.')
   parser.add_argument(
-      '--wanted_words',
-      type=str,
-      default='yes,no,up,down,left,right,on,off,stop,go',
-      help='Words to use (others will be added to an unknown label)',)
+      '--batched_input',
+      action='store_true',
+      help='Make wav_data take a vector of files instead of a single one.')
+  parser.add_argument(
+      '--optimize',
+      action='store_true',
+      help='Fold batch norms, dropout and constants out of the frozen graph.')
   parser.add_argument(
       '--output_file', type=str, help='Where to save the frozen graph.')
   FLAGS, unparsed = parser.parse_known_args()
@@ -18,21 +18,57 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import os
+
+import tensorflow as tf
+
 from tensorflow.examples.speech_commands import freeze
+from tensorflow.examples.speech_commands import input_data
 from tensorflow.python.platform import test
 
 
 class FreezeTest(test.TestCase):
 
+  def _model_settings(self):
+    config_path = os.path.join(self.get_temp_dir(), "freeze_conf")
+    with open(config_path, "w") as f:
+      f.write("[arch-parameters]\n"
+              "arch = single_fc\n"
+              "[vocabulary]\n"
+              "wanted_words = a,b,c,d\n"
+              "[data-processing-parameters]\n"
+              "features = mfcc\n"
+              "fft_window_size = 256\n"
+              "sample_rate = 16000\n"
+              "clip_duration_ms = 1000\n"
+              "window_size_ms = 30\n"
+              "window_stride_ms = 10\n"
+              "dct_coefficient_count = 40\n"
+              "[train-parameters]\n"
+              "how_many_training_steps = 10\n"
+              "learning_rate = 0.001\n")
+    return input_data.prepare_model_settings(config_path)
+
   def testCreateInferenceGraph(self):
     with self.test_session() as sess:
-      freeze.create_inference_graph('a,b,c,d', 16000, 1000.0, 30.0, 30.0, 10.0,
-                                    40, 'conv')
+      freeze.create_inference_graph(self._model_settings())
       self.assertIsNotNone(sess.graph.get_tensor_by_name('wav_data:0'))
       self.assertIsNotNone(
           sess.graph.get_tensor_by_name('decoded_sample_data:0'))
       self.assertIsNotNone(sess.graph.get_tensor_by_name('labels_softmax:0'))
 
+  def testFreezeGraphDef(self):
+    with self.test_session() as sess:
+      freeze.create_inference_graph(self._model_settings(), batched_input=True)
+      sess.run(tf.global_variables_initializer())
+      frozen_graph_def = freeze.freeze_graph_def(sess, batched_input=True)
+    node_names = [node.name for node in frozen_graph_def.node]
+    self.assertTrue('wav_data' in node_names)
+    self.assertTrue('labels_softmax' in node_names)
+    for node in frozen_graph_def.node:
+      self.assertNotEqual('VariableV2', node.op)
+      self.assertFalse(node.name.startswith('train'))
+
 
 if __name__ == '__main__':
   test.main()
@@ -0,0 +1,425 @@
+# Copyright 2017 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+r"""Long-running local inference server with dynamic micro-batching.
+
+The model is loaded once, and requests from many concurrent clients are
+queued and run together: a batch is closed when it reaches --max_batch_size
+or when its oldest request has waited --max_wait_ms, and then goes through the
+model in a single session call. The model is either a `Graph` restored from a
+checkpoint (or an ensemble of them, see ensemble.py), which takes batches of
+WAV-encoded clips, or a frozen graph from freeze.py.
+
+Here's an example of running it:
+
+python tensorflow/examples/speech_commands/inference_server.py \
+--arch_config_file=model_configs/wave_net.config \
+--start_checkpoint=/tmp/speech_commands_train/wave_net.ckpt-30000 \
+--labels=/tmp/speech_commands_train/wave_net_labels.txt \
+--port=8500
+
+and labelling a clip:
+
+curl --data-binary @/tmp/speech_dataset/left/a5d485dc_nohash_0.wav \
+http://localhost:8500/predict
+
+POST /predict takes the contents of a .wav file and returns the top labels as
+JSON, and GET /stats returns the request latency percentiles, which are also
+logged every --stats_interval requests. With --unix_socket the server listens
+on that socket instead of a localhost port.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+from six.moves import BaseHTTPServer
+from six.moves import queue
+from six.moves import socketserver
+import tensorflow as tf
+
+from ensemble import Ensemble, load_ensemble_config
+from input_data import prepare_model_settings
+from label_wav import load_graph, load_labels, top_predictions
+
+FLAGS = None
+
+
+class GraphPredictor(object):
+  """Runs batches of WAV data through models restored from checkpoints."""
+
+  def __init__(self, members, average='probabilities'):
+    """Builds and restores the models.
+
+    Args:
+      members: List of (name, model settings, checkpoint path, weight) tuples,
+        see `ensemble.load_ensemble_config`.
+      average: Whether the members' 'probabilities' or 'logits' are averaged.
+    """
+    self.graph = tf.Graph()
+    with self.graph.as_default():
+      self.ensemble = Ensemble(members, average, wav_data_input=True)
+      self.sess = tf.Session()
+      self.sess.run(tf.global_variables_initializer())
+      self.ensemble.load_variables_from_checkpoints(self.sess)
+
+  def predict(self, wavs):
+    """Returns the scores of a list of WAV-encoded clips, [batch, labels]."""
+    return self.sess.run(self.ensemble.scores,
+                         feed_dict=self.ensemble.feed_dict(wavs))
+
+
+class FrozenGraphPredictor(object):
+  """Runs WAV data through a frozen graph."""
+
+  def __init__(self, graph_path, input_name, output_name):
+    self.graph = tf.Graph()
+    with self.graph.as_default():
+      load_graph(graph_path)
+    self.sess = tf.Session(graph=self.graph)
+    self.input = self.graph.get_tensor_by_name(input_name)
+    self.output = self.graph.get_tensor_by_name(output_name)
+    # Graphs with a scalar WAV input take one clip per session call.
+    self.batched_input = self.input.get_shape().ndims == 1
+
+  def predict(self, wavs):
+    """Returns the scores of a list of WAV-encoded clips, [batch, labels]."""
+    if self.batched_input:
+      return self.sess.run(self.output, {self.input: wavs})
+    return np.concatenate(
+        [self.sess.run(self.output, {self.input: wav}) for wav in wavs])
+
+
+class LatencyStats(object):
+  """Thread-safe record of recent request latencies and batch sizes."""
+
+  def __init__(self, window=10000):
+    self.latencies = collections.deque(maxlen=window)
+    self.request_count = 0
+    self.batch_count = 0
+    self.lock = threading.Lock()
+
+  def record_batch(self, latencies):
+    """Adds the latencies in seconds of the requests of one batch."""
+    with self.lock:
+      self.latencies.extend(latencies)
+      self.request_count += len(latencies)
+      self.batch_count += 1
+
+  def summary(self):
+    """Returns request counts, mean batch size and latency percentiles."""
+    with self.lock:
+      latencies = np.array(self.latencies) * 1000.0
+      summary = {
+          'requests': self.request_count,
+          'batches': self.batch_count,
+          'mean_batch_size': (self.request_count / self.batch_count
+                              if self.batch_count else 0.0),
+      }
+    for percentile in [50, 90, 99]:
+      summary['p%d_ms' % percentile] = (
+          float(np.percentile(latencies, percentile)) if len(latencies) else
+          0.0)
+    return summary
+
+
+class _Request(object):
+
+  def __init__(self, wav_data):
+    self.wav_data = wav_data
+    self.start_time = time.time()
+    self.done = threading.Event()
+    self.scores = None
+    self.error = None
+
+
+class MicroBatcher(object):
+  """Collects concurrent requests into batches for one predict call each.
+
+  A single worker thread owns the model. It blocks for the first request,
+  then keeps adding requests until the batch is full or the first one has
+  waited `max_wait_ms`. If the model fails on a batch, its requests are run
+  again one at a time, so a malformed clip only fails its own request.
+  """
+
+  def __init__(self, predict_fn, max_batch_size, max_wait_ms, stats=None,
+               stats_interval=0):
+    """Starts the worker thread.
+
+    Args:
+      predict_fn: Function taking a list of WAV-encoded clips and returning
+        their scores as a [batch, labels] array.
+      max_batch_size: Most requests run in one call.
+      max_wait_ms: Longest a request waits for others to join its batch.
+      stats: Optional `LatencyStats` the request latencies are added to.
+      stats_interval: Log the latency summary every this many requests, 0 to
+        never log it.
+    """
+    self.predict_fn = predict_fn
+    self.max_batch_size = max_batch_size
+    self.max_wait = max_wait_ms / 1000.0
+    self.stats = stats
+    self.stats_interval = stats_interval
+    self.requests = queue.Queue()
+    self.worker = threading.Thread(target=self._run)
+    self.worker.daemon = True
+    self.worker.start()
+
+  def predict(self, wav_data):
+    """Returns the scores of one WAV-encoded clip, blocking until it's run.
+
+    Raises:
+      Exception: Whatever the model raised for the clip of the request.
+    """
+    request = _Request(wav_data)
+    self.requests.put(request)
+    request.done.wait()
+    if request.error is not None:
+      raise request.error
+    return request.scores
+
+  def close(self):
+    """Stops the worker after the requests queued so far."""
+    self.requests.put(None)
+    self.worker.join()
+
+  def _next_batch(self):
+    """Returns the next batch of requests, or None once closed."""
+    first = self.requests.get()
+    if first is None:
+      return None
+    batch = [first]
+    deadline = first.start_time + self.max_wait
+    while len(batch) < self.max_batch_size:
+      # Requests that are already queued join even after the deadline.
+      timeout = max(0.0, deadline - time.time())
+      try:
+        request = self.requests.get(timeout=timeout) if timeout else (
+            self.requests.get_nowait())
+      except queue.Empty:
+        break
+      if request is None:
+        # Finish this batch, then stop on the next call.
+        self.requests.put(None)
+        break
+      batch.append(request)
+    return batch
+
+  def _predict(self, batch):
+    """Sets the scores of a batch of requests, or the error of each one."""
+    try:
+      scores = self.predict_fn([request.wav_data for request in batch])
+      for request, request_scores in zip(batch, scores):
+        request.scores = request_scores
+    except Exception as e:  # pylint: disable=broad-except
+      if len(batch) == 1:
+        batch[0].error = e
+        return
+      # Find the requests that fail on their own.
+      for request in batch:
+        self._predict([request])
+
+  def _run(self):
+    while True:
+      batch = self._next_batch()
+      if batch is None:
+        return
+      self._predict(batch)
+      end_time = time.time()
+      for request in batch:
+        request.done.set()
+      if self.stats is not None:
+        previous_count = self.stats.request_count
+        self.stats.record_batch(
+            [end_time - request.start_time for request in batch])
+        if (self.stats_interval and previous_count // self.stats_interval !=
+            self.stats.request_count // self.stats_interval):
+          tf.logging.info('Latency: %s', json.dumps(self.stats.summary()))
+
+
+class InferenceRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """Serves POST /predict and GET /stats from the server's batcher."""
+
+  def do_POST(self):
+    if self.path != '/predict':
+      self.send_error(404)
+      return
+    wav_data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+    start_time = time.time()
+    try:
+      scores = self.server.batcher.predict(wav_data)
+    except Exception as e:  # pylint: disable=broad-except
+      self.send_error(400, str(e))
+      return
+    self._send_json({
+        'predictions': [{'label': label, 'score': score}
+                        for label, score in top_predictions(
+                            scores, self.server.labels,
+                            self.server.how_many_labels)],
+        'latency_ms': (time.time() - start_time) * 1000.0
+    })
+
+  def do_GET(self):
+    if self.path != '/stats':
+      self.send_error(404)
+      return
+    self._send_json(self.server.stats.summary())
+
+  def _send_json(self, value):
+    body = json.dumps(value).encode('utf-8')
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def address_string(self):
+    # Unix socket clients have no address.
+    if isinstance(self.client_address, tuple):
+      return self.client_address[0]
+    return 'local'
+
+  def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+    tf.logging.debug('%s %s', self.address_string(), format % args)
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn,
+                          BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn,
+                              socketserver.UnixStreamServer):
+  daemon_threads = True
+
+
+def create_predictor():
+  """Loads the model named by the flags."""
+  if FLAGS.graph:
+    return FrozenGraphPredictor(FLAGS.graph, FLAGS.input_name,
+                                FLAGS.output_name)
+  if FLAGS.ensemble_config:
+    members = load_ensemble_config(FLAGS.ensemble_config)
+  else:
+    model_settings = prepare_model_settings(FLAGS.arch_config_file)
+    members = [(model_settings['arch'], model_settings, FLAGS.start_checkpoint,
+                1.0)]
+  for _, member_settings, _, _ in members:
+    member_settings['noise_label_count'] = FLAGS.noise_label_count
+  return GraphPredictor(members)
+
+
+def main(_):
+  tf.logging.set_verbosity(tf.logging.INFO)
+  predictor = create_predictor()
+  stats = LatencyStats()
+  batcher = MicroBatcher(predictor.predict, FLAGS.max_batch_size,
+                         FLAGS.max_wait_ms, stats, FLAGS.stats_interval)
+  if FLAGS.unix_socket:
+    if os.path.exists(FLAGS.unix_socket):
+      os.remove(FLAGS.unix_socket)
+    server = ThreadingUnixHTTPServer(FLAGS.unix_socket, InferenceRequestHandler)
+    tf.logging.info('Serving on %s', FLAGS.unix_socket)
+  else:
+    server = ThreadingHTTPServer(('localhost', FLAGS.port),
+                                 InferenceRequestHandler)
+    tf.logging.info('Serving on http://localhost:%d', FLAGS.port)
+  server.batcher = batcher
+  server.stats = stats
+  server.labels = load_labels(FLAGS.labels)
+  server.how_many_labels = FLAGS.how_many_labels
+  try:
+    server.serve_forever()
+  finally:
+    server.server_close()
+    batcher.close()
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--graph',
+      type=str,
+      default='',
+      help='Frozen graph to serve, instead of a checkpoint.')
+  parser.add_argument(
+      '--input_name',
+      type=str,
+      default='wav_data:0',
+      help='Name of WAVE data input node in the frozen graph.')
+  parser.add_argument(
+      '--output_name',
+      type=str,
+      default='labels_softmax:0',
+      help='Name of node outputting a prediction in the frozen graph.')
+  parser.add_argument(
+      '--arch_config_file',
+      type=str,
+      default='',
+      help='File containing model parameters')
+  parser.add_argument(
+      '--start_checkpoint',
+      type=str,
+      default='',
+      help='Checkpoint of the model to serve.')
+  parser.add_argument(
+      '--ensemble_config',
+      type=str,
+      default='',
+      help='File listing the models of an ensemble to serve, see ensemble.py.')
+  parser.add_argument(
+      '--noise_label_count',
+      type=int,
+      default=11,
+      help='Number of noise labels, only used by adversarial models.')
+  parser.add_argument(
+      '--labels', type=str, default='', help='Path to file containing labels.')
+  parser.add_argument(
+      '--how_many_labels',
+      type=int,
+      default=3,
+      help='Number of results to return.')
+  parser.add_argument(
+      '--port', type=int, default=8500, help='Localhost port to serve on.')
+  parser.add_argument(
+      '--unix_socket',
+      type=str,
+      default='',
+      help='Unix socket to serve on instead of a port.')
+  parser.add_argument(
+      '--max_batch_size',
+      type=int,
+      default=32,
+      help='Most requests run through the model at once.')
+  parser.add_argument(
+      '--max_wait_ms',
+      type=float,
+      default=5.0,
+      help='Longest a request waits for others to fill its batch.')
+  parser.add_argument(
+      '--stats_interval',
+      type=int,
+      default=1000,
+      help='Log latency percentiles every this many requests, 0 for never.')
+
+  FLAGS, unparsed = parser.parse_known_args()
+  tf.app.run(main=main, argv=[sys.argv[0]] + unparsed)
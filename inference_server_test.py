@@ -0,0 +1,141 @@
+# Copyright 2017 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for the micro-batching inference server."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import threading
+
+import numpy as np
+from six.moves import urllib
+
+from tensorflow.examples.speech_commands import inference_server
+from tensorflow.python.platform import test
+
+
+class InferenceServerTest(test.TestCase):
+
+  def testMicroBatcher(self):
+    batch_sizes = []
+
+    def predict_fn(wavs):
+      batch_sizes.append(len(wavs))
+      return np.array([[float(wav), 1.0] for wav in wavs])
+
+    stats = inference_server.LatencyStats()
+    batcher = inference_server.MicroBatcher(predict_fn, 4, 50.0, stats)
+    results = {}
+
+    def request(i):
+      results[i] = batcher.predict(i)
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(10)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    batcher.close()
+    for i in range(10):
+      self.assertAllEqual([float(i), 1.0], results[i])
+    self.assertEqual(10, sum(batch_sizes))
+    self.assertTrue(max(batch_sizes) <= 4)
+    summary = stats.summary()
+    self.assertEqual(10, summary["requests"])
+    self.assertEqual(len(batch_sizes), summary["batches"])
+
+  def testMicroBatcherError(self):
+
+    def predict_fn(wavs):
+      raise ValueError("bad audio")
+
+    batcher = inference_server.MicroBatcher(predict_fn, 4, 1.0)
+    with self.assertRaises(ValueError):
+      batcher.predict(b"")
+    batcher.close()
+
+  def testMicroBatcherMalformedRequest(self):
+    batch_sizes = []
+
+    def predict_fn(wavs):
+      batch_sizes.append(len(wavs))
+      if b"bad" in wavs:
+        raise ValueError("bad audio")
+      return np.array([[float(len(wav)), 1.0] for wav in wavs])
+
+    # The long wait puts all the requests into one batch.
+    batcher = inference_server.MicroBatcher(predict_fn, 4, 1000.0)
+    wavs = [b"a", b"bad", b"ccc", b"dddd"]
+    results = {}
+
+    def request(wav):
+      try:
+        results[wav] = batcher.predict(wav)
+      except ValueError as e:
+        results[wav] = e
+
+    threads = [threading.Thread(target=request, args=(wav,)) for wav in wavs]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    batcher.close()
+    self.assertEqual(4, batch_sizes[0])
+    self.assertTrue(isinstance(results[b"bad"], ValueError))
+    for wav in [b"a", b"ccc", b"dddd"]:
+      self.assertAllEqual([float(len(wav)), 1.0], results[wav])
+
+  def testPredictRequest(self):
+
+    def predict_fn(wavs):
+      if b"bad" in wavs:
+        raise ValueError("bad audio")
+      return np.array([[0.1, 0.7, 0.2] for _ in wavs])
+
+    stats = inference_server.LatencyStats()
+    batcher = inference_server.MicroBatcher(predict_fn, 4, 1.0, stats)
+    server = inference_server.ThreadingHTTPServer(
+        ("localhost", 0), inference_server.InferenceRequestHandler)
+    server.batcher = batcher
+    server.stats = stats
+    server.labels = ["_silence_", "yes", "no"]
+    server.how_many_labels = 2
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    url = "http://localhost:%d" % server.server_address[1]
+    try:
+      response = urllib.request.urlopen(url + "/predict", data=b"RIFF")
+      result = json.loads(response.read().decode("utf-8"))
+      self.assertEqual(["yes", "no"],
+                       [p["label"] for p in result["predictions"]])
+      self.assertAllClose([0.7, 0.2],
+                          [p["score"] for p in result["predictions"]])
+      with self.assertRaises(urllib.error.HTTPError) as context:
+        urllib.request.urlopen(url + "/predict", data=b"bad")
+      self.assertEqual(400, context.exception.code)
+      response = urllib.request.urlopen(url + "/stats")
+      summary = json.loads(response.read().decode("utf-8"))
+      self.assertEqual(2, summary["requests"])
+    finally:
+      server.shutdown()
+      server.server_close()
+      thread.join()
+      batcher.close()
+
+
+if __name__ == "__main__":
+  test.main()
@@ -20,7 +20,10 @@ from __future__ import division
 from __future__ import print_function
 
 import hashlib
+import json
 import math
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import os.path
 import random
 import re
@@ -38,6 +41,10 @@ from tensorflow.python.ops import io_ops
 from tensorflow.python.platform import gfile
 from tensorflow.python.util import compat
 
+import audio_features
+from feature_cache import FeatureCache
+import samplers
+
 MAX_NUM_WAVS_PER_CLASS = 2**27 - 1  # ~134M
 SILENCE_LABEL = '_silence_'
 SILENCE_INDEX = 0
@@ -45,6 +52,16 @@ UNKNOWN_WORD_LABEL = '_unknown_'
 UNKNOWN_WORD_INDEX = 1
 BACKGROUND_NOISE_DIR_NAME = '_background_noise_'
 RANDOM_SEED = 12345
+CLIP_STORE_FILE_NAME = 'clips.npy'
+CLIP_STORE_INDEX_FILE_NAME = 'clips_index.json'
+DATA_INDEX_MANIFEST_FILE_NAME = 'data_index_manifest.json'
+NOISE_BANK_FILE_NAME = 'noise.npy'
+NOISE_BANK_INDEX_FILE_NAME = 'noise_index.json'
+FINGERPRINT_DTYPES = {
+    'float64': np.float64,
+    'float32': np.float32,
+    'int16': np.int16,
+}
 
 
 def prepare_model_settings(arch_conf_file):
@@ -177,6 +194,159 @@ def which_set(filename, validation_percentage):
   return result
 
 
+def _scan_label_dir(dir_path):
+  """Lists the .wavs in a label folder, with their sizes and mtimes."""
+  files = []
+  for entry in os.scandir(dir_path):
+    if (entry.name.endswith('.wav') and not entry.name.startswith('.') and
+        entry.is_file()):
+      stat = entry.stat()
+      files.append([entry.name, stat.st_size, stat.st_mtime])
+  return sorted(files)
+
+
+def scan_data_dir(data_dir, validation_percentage, manifest_path=None):
+  """Finds all labelled .wavs in the data set, reusing earlier scans.
+
+  Globbing and hashing every file name of a large data set takes minutes, so
+  the result is kept in a JSON manifest that records, for every label folder,
+  its mtime and the name, size, mtime and partition of each of its .wavs. On
+  later runs only folders whose mtime changed are listed again, in parallel,
+  and partitions are only computed for file names that weren't seen before.
+  The sizes and mtimes are handed on to the clip store and the feature cache,
+  so clips replaced since they were cached are decoded again.
+
+  Args:
+    data_dir: Directory holding one folder of .wavs per label.
+    validation_percentage: How much of the data set to use for validation.
+    manifest_path: Where to read and write the manifest, or None to always
+      scan everything.
+
+  Returns:
+    List of (wav path, label folder name, partition, size, mtime) tuples
+    sorted by path.
+  """
+  manifest = None
+  if manifest_path and os.path.exists(manifest_path):
+    try:
+      with open(manifest_path) as f:
+        manifest = json.load(f)
+    except ValueError:
+      tf.logging.warning('Ignoring corrupt data index manifest %s',
+                         manifest_path)
+    if (manifest is not None and
+        manifest.get('validation_percentage') != validation_percentage):
+      manifest = None
+  old_dirs = manifest['dirs'] if manifest is not None else {}
+  dirs = {}
+  changed_dirs = []
+  for entry in os.scandir(data_dir):
+    if (entry.name.startswith('.') or entry.name == BACKGROUND_NOISE_DIR_NAME or
+        not entry.is_dir()):
+      continue
+    mtime = entry.stat().st_mtime
+    if entry.name in old_dirs and old_dirs[entry.name]['mtime'] == mtime:
+      dirs[entry.name] = old_dirs[entry.name]
+    else:
+      changed_dirs.append((entry.name, mtime))
+  if changed_dirs or set(dirs) != set(old_dirs):
+    tf.logging.info('Scanning %d changed folders in %s', len(changed_dirs),
+                    data_dir)
+    pool = ThreadPool(min(len(changed_dirs), multiprocessing.cpu_count()) or 1)
+    try:
+      listings = pool.map(_scan_label_dir, [
+          os.path.join(data_dir, name) for name, _ in changed_dirs])
+    finally:
+      pool.close()
+      pool.join()
+    for (name, mtime), files in zip(changed_dirs, listings):
+      known_sets = {}
+      if name in old_dirs:
+        known_sets = dict((f[0], f[3]) for f in old_dirs[name]['files'])
+      for f in files:
+        if f[0] in known_sets:
+          f.append(known_sets[f[0]])
+        else:
+          f.append(which_set(os.path.join(data_dir, name, f[0]),
+                             validation_percentage))
+      dirs[name] = {'mtime': mtime, 'files': files}
+    if manifest_path:
+      manifest = {'validation_percentage': validation_percentage, 'dirs': dirs}
+      try:
+        with open(manifest_path + '.tmp', 'w') as f:
+          json.dump(manifest, f)
+        os.rename(manifest_path + '.tmp', manifest_path)
+      except (IOError, OSError) as e:
+        tf.logging.warning('Could not write data index manifest %s: %s',
+                           manifest_path, e)
+  wav_files = []
+  for name in sorted(dirs):
+    for f in dirs[name]['files']:
+      wav_files.append((os.path.join(data_dir, name, f[0]), name, f[3], f[1],
+                        f[2]))
+  return wav_files
+
+
+def list_audio_files(audio_dir, manifest_path=None):
+  """Lists the .wavs directly inside a folder of unlabelled audio, once.
+
+  Args:
+    audio_dir: Directory holding the .wavs, e.g. the Kaggle test set.
+    manifest_path: Text file with one .wav name per line. If it exists it's
+      read instead of listing the directory, otherwise it's written after the
+      listing. None to always list the directory.
+
+  Returns:
+    Sorted list of .wav file names, relative to `audio_dir`.
+  """
+  if manifest_path and os.path.exists(manifest_path):
+    with open(manifest_path) as f:
+      return [line.rstrip('\n') for line in f if line.strip()]
+  file_names = sorted(
+      entry.name for entry in os.scandir(audio_dir)
+      if entry.name.endswith('.wav') and not entry.name.startswith('.') and
+      entry.is_file())
+  if manifest_path:
+    with open(manifest_path + '.tmp', 'w') as f:
+      f.write(''.join(name + '\n' for name in file_names))
+    os.rename(manifest_path + '.tmp', manifest_path)
+  return file_names
+
+
+def iterate_batches(items, batch_size, load_fn, prefetch=2):
+  """Loads fixed-size batches of a list on a thread pool, in order.
+
+  Up to `prefetch` batches are loaded ahead of the one being consumed, so
+  decoding overlaps with whatever the caller does with a batch, while no more
+  than `prefetch + 1` batches are ever held in memory.
+
+  Args:
+    items: List of things to load, e.g. file paths.
+    batch_size: How many items go in each batch. The last one may be smaller.
+    load_fn: Function taking a list of items and returning the loaded batch.
+      It's called from worker threads.
+    prefetch: How many batches to load ahead.
+
+  Yields:
+    Tuples of the loaded batch and the list of items in it.
+  """
+  pool = ThreadPool(max(1, prefetch))
+  pending = []
+  try:
+    for start in xrange(0, len(items), batch_size):
+      batch_items = items[start:start + batch_size]
+      pending.append((pool.apply_async(load_fn, (batch_items,)), batch_items))
+      if len(pending) > prefetch:
+        result, batch_items = pending.pop(0)
+        yield result.get(), batch_items
+    while pending:
+      result, batch_items = pending.pop(0)
+      yield result.get(), batch_items
+  finally:
+    pool.terminate()
+    pool.join()
+
+
 def load_wav_file(filename):
   """Loads an audio file and returns a float PCM-encoded array of samples.
 
@@ -219,18 +389,474 @@ def save_wav_file(filename, wav_data, sample_rate):
         })
 
 
+def fingerprint_dtype(model_settings, features='mfcc'):
+  """Returns the numpy type fingerprints are handed to the model in.
+
+  Set by 'fingerprint_dtype' in the model settings: 'float64' (the default),
+  'float32', or 'int16' for raw audio, which is scaled to the 16-bit PCM range
+  and converted back to float inside the model graph.
+
+  Args:
+    model_settings: Information about the current model being trained.
+    features: Which features are computed, 'raw', 'spectrogram' or 'mfcc'.
+
+  Returns:
+    Numpy dtype.
+
+  Raises:
+    Exception: If the type is unknown or doesn't fit the features.
+  """
+  name = model_settings.get('fingerprint_dtype', 'float64')
+  if name not in FINGERPRINT_DTYPES:
+    raise Exception('fingerprint_dtype "' + name + '" not recognized, should '
+                    'be one of ' + ', '.join(sorted(FINGERPRINT_DTYPES)))
+  if name == 'int16' and features != 'raw':
+    raise Exception('int16 fingerprints are only supported for raw features')
+  return FINGERPRINT_DTYPES[name]
+
+
+def convert_fingerprints(fingerprints, out):
+  """Copies float fingerprints into an array of the fingerprint type.
+
+  Args:
+    fingerprints: Float array of fingerprints.
+    out: Array of the same shape to write to. If it's int16, the values are
+      scaled from [-1, 1] to the 16-bit PCM range.
+
+  Returns:
+    `out`.
+  """
+  if out.dtype == np.int16:
+    out[...] = np.clip(np.rint(fingerprints * 32768.0), -32768, 32767)
+  else:
+    out[...] = fingerprints
+  return out
+
+
+class BatchBufferPool(object):
+  """Hands out preallocated arrays that are reused across batches.
+
+  Every (name, shape, dtype) combination gets a ring of `buffer_count`
+  arrays that are returned in turn, so an array stays valid until
+  `buffer_count` more have been requested under the same name and shape.
+  With a count of 0 every call allocates a new array.
+  """
+
+  def __init__(self, buffer_count):
+    self.buffer_count = buffer_count
+    self.buffers = {}
+
+  def get(self, name, shape, dtype):
+    if self.buffer_count <= 0:
+      return np.empty(shape, dtype)
+    key = (name, tuple(shape), np.dtype(dtype))
+    if key not in self.buffers:
+      self.buffers[key] = ([np.empty(shape, dtype)
+                            for _ in range(self.buffer_count)], [0])
+    buffers, position = self.buffers[key]
+    buffer = buffers[position[0]]
+    position[0] = (position[0] + 1) % self.buffer_count
+    return buffer
+
+
+def pack_clip_store(store_dir, wav_paths, labels, desired_samples,
+                    versions=None):
+  """Decodes a list of .wavs once into a memory-mapped int16 clip store.
+
+  Every clip is decoded to exactly `desired_samples` samples (padded with zeros
+  or truncated, like the processing graph does) and written as one row of a
+  [clip_count, desired_samples] int16 array saved in .npy format. A sidecar
+  JSON index records the source file, label, row offset and optionally the
+  version of every clip, so the store can be opened later without touching
+  the original .wav files.
+
+  The files are written under temporary names and renamed at the end, so a
+  partially packed store is never picked up by a concurrent run.
+
+  Args:
+    store_dir: Directory to write the store into.
+    wav_paths: List of .wav file paths to pack.
+    labels: List of labels matching `wav_paths`.
+    desired_samples: Number of samples every clip is decoded to.
+    versions: Optional list of the [size, mtime] of every file, which tell a
+      later run whether the file changed since it was packed.
+  """
+  if not os.path.exists(store_dir):
+    os.makedirs(store_dir)
+  clips_path = os.path.join(store_dir, CLIP_STORE_FILE_NAME)
+  index_path = os.path.join(store_dir, CLIP_STORE_INDEX_FILE_NAME)
+  clips = np.lib.format.open_memmap(
+      clips_path + '.tmp', mode='w+', dtype=np.int16,
+      shape=(len(wav_paths), desired_samples))
+  sample_rate = None
+  with tf.Session(graph=tf.Graph()) as sess:
+    wav_filename_placeholder = tf.placeholder(tf.string, [])
+    wav_loader = io_ops.read_file(wav_filename_placeholder)
+    wav_decoder = contrib_audio.decode_wav(
+        wav_loader, desired_channels=1, desired_samples=desired_samples)
+    for i, wav_path in enumerate(wav_paths):
+      if i % 10000 == 0:
+        tf.logging.info('Packing clip store: %d/%d', i, len(wav_paths))
+      decoded = sess.run(
+          wav_decoder, feed_dict={wav_filename_placeholder: wav_path})
+      # decode_wav scales int16 samples by 1/32768, so this is lossless.
+      clips[i, :] = np.clip(
+          np.round(decoded.audio.flatten() * 32768.0), -32768, 32767)
+      sample_rate = int(decoded.sample_rate)
+  clips.flush()
+  del clips
+  index = {
+      'desired_samples': desired_samples,
+      'sample_rate': sample_rate,
+      'clips': [{'file': wav_path, 'label': label, 'offset': i}
+                for i, (wav_path, label) in enumerate(zip(wav_paths, labels))]
+  }
+  if versions is not None:
+    for clip, version in zip(index['clips'], versions):
+      clip['version'] = version
+  with open(index_path + '.tmp', 'w') as f:
+    json.dump(index, f)
+  os.rename(clips_path + '.tmp', clips_path)
+  os.rename(index_path + '.tmp', index_path)
+  tf.logging.info('Packed %d clips into %s', len(wav_paths), store_dir)
+
+
+def load_clip_store(store_dir):
+  """Opens a clip store written by `pack_clip_store`.
+
+  Args:
+    store_dir: Directory the store was packed into.
+
+  Returns:
+    Read-only memory-mapped int16 array of clips, and the sidecar index
+    dictionary, or (None, None) if there's no complete store in `store_dir`.
+  """
+  clips_path = os.path.join(store_dir, CLIP_STORE_FILE_NAME)
+  index_path = os.path.join(store_dir, CLIP_STORE_INDEX_FILE_NAME)
+  if not (os.path.exists(clips_path) and os.path.exists(index_path)):
+    return None, None
+  with open(index_path) as f:
+    index = json.load(f)
+  clips = np.load(clips_path, mmap_mode='r')
+  return clips, index
+
+
+def pack_noise_bank(bank_dir, wav_paths):
+  """Decodes background noise .wavs into one memory-mapped float32 array.
+
+  The clips are concatenated into a flat array saved in .npy format, and a
+  sidecar JSON index records the source file, start and length of each one.
+  Like the clip store, the files are written under temporary names and
+  renamed at the end.
+
+  Args:
+    bank_dir: Directory to write the bank into.
+    wav_paths: List of background noise .wav paths.
+  """
+  if not os.path.exists(bank_dir):
+    os.makedirs(bank_dir)
+  bank_path = os.path.join(bank_dir, NOISE_BANK_FILE_NAME)
+  index_path = os.path.join(bank_dir, NOISE_BANK_INDEX_FILE_NAME)
+  clips = [load_wav_file(wav_path).astype(np.float32) for wav_path in wav_paths]
+  lengths = [len(clip) for clip in clips]
+  bank = np.lib.format.open_memmap(
+      bank_path + '.tmp', mode='w+', dtype=np.float32, shape=(sum(lengths),))
+  if clips:
+    bank[:] = np.concatenate(clips)
+  bank.flush()
+  del bank
+  index = {
+      'files': list(wav_paths),
+      'starts': [int(start) for start in np.cumsum([0] + lengths[:-1])],
+      'lengths': lengths
+  }
+  with open(index_path + '.tmp', 'w') as f:
+    json.dump(index, f)
+  os.rename(bank_path + '.tmp', bank_path)
+  os.rename(index_path + '.tmp', index_path)
+
+
+def load_noise_bank(bank_dir):
+  """Opens a noise bank written by `pack_noise_bank`.
+
+  Args:
+    bank_dir: Directory holding the bank.
+
+  Returns:
+    Read-only memory-mapped float32 array and the parsed index, or
+    (None, None) if there's no bank in the directory.
+  """
+  bank_path = os.path.join(bank_dir, NOISE_BANK_FILE_NAME)
+  index_path = os.path.join(bank_dir, NOISE_BANK_INDEX_FILE_NAME)
+  if not (os.path.exists(bank_path) and os.path.exists(index_path)):
+    return None, None
+  with open(index_path) as f:
+    index = json.load(f)
+  return np.load(bank_path, mmap_mode='r'), index
+
+
+def decode_clip(wav_filename, desired_samples):
+  """Builds ops decoding one clip, or silence for an empty filename.
+
+  Silence samples have no file behind them, so they cost nothing but a
+  buffer of zeros.
+
+  Args:
+    wav_filename: Scalar string tensor, the path of the .wav or ''.
+    desired_samples: Number of samples the clip is decoded to.
+
+  Returns:
+    Float tensor of shape [desired_samples].
+  """
+
+  return tf.cond(
+      tf.equal(wav_filename, ''), lambda: tf.zeros([desired_samples]),
+      lambda: decode_wav_data(io_ops.read_file(wav_filename), desired_samples))
+
+
+def decode_wav_data(wav_data, desired_samples):
+  """Builds ops decoding one WAV-encoded clip held in memory.
+
+  Args:
+    wav_data: Scalar string tensor with the contents of a .wav file.
+    desired_samples: Number of samples the clip is decoded to.
+
+  Returns:
+    Float tensor of shape [desired_samples].
+  """
+  wav_decoder = contrib_audio.decode_wav(
+      wav_data, desired_channels=1, desired_samples=desired_samples)
+  return tf.reshape(wav_decoder.audio, [desired_samples])
+
+
+def time_shift_batch(audio, time_shift_amounts):
+  """Shifts every row of a batch of clips in time, padding gaps with zeros.
+
+  A positive amount moves the clip later and a negative one earlier, which is
+  the same thing the pad and slice of the single clip processing graph does.
+
+  Args:
+    audio: Float tensor of shape [batch, samples].
+    time_shift_amounts: Int32 tensor of shape [batch], shift of each row.
+
+  Returns:
+    Float tensor of shape [batch, samples] holding the shifted clips.
+  """
+  batch_size = tf.shape(audio)[0]
+  samples = tf.shape(audio)[1]
+  positions = (tf.expand_dims(tf.range(samples), 0) -
+               tf.expand_dims(time_shift_amounts, 1))
+  valid = tf.logical_and(positions >= 0, positions < samples)
+  rows = tf.tile(tf.expand_dims(tf.range(batch_size), 1), [1, samples])
+  shifted = tf.gather_nd(
+      audio, tf.stack([rows, tf.clip_by_value(positions, 0, samples - 1)], 2))
+  return tf.where(valid, shifted, tf.zeros_like(shifted))
+
+
+def parse_time_shifts(time_shifts_ms, sample_rate):
+  """Converts a comma separated list of shifts in ms to samples.
+
+  Args:
+    time_shifts_ms: String like '0,-100,100', or '' for none.
+    sample_rate: Samples per second of the audio.
+
+  Returns:
+    List of integer shifts in samples.
+  """
+  return [int(float(shift) * sample_rate / 1000)
+          for shift in time_shifts_ms.split(',') if shift.strip()]
+
+
+def expand_copies(pcm, time_shifts, noise_stddev=0.0):
+  """Builds shifted, optionally noisy copies of every clip for test time.
+
+  All copies go through the model as one batch, so test-time augmentation
+  costs a bigger forward pass instead of a session call per copy. The copies
+  of a clip are adjacent, which is what `average_copies` expects.
+
+  Args:
+    pcm: Float tensor of shape [batch, samples].
+    time_shifts: List of shifts in samples, one per copy, see
+      `time_shift_batch`.
+    noise_stddev: Standard deviation of Gaussian noise added to every copy.
+
+  Returns:
+    Float tensor of shape [batch * len(time_shifts), samples].
+  """
+  copy_count = len(time_shifts)
+  sample_count = pcm.get_shape()[1].value
+  copies = tf.reshape(tf.tile(tf.expand_dims(pcm, 1), [1, copy_count, 1]),
+                      [-1, sample_count])
+  shifts = tf.tile(tf.constant(time_shifts, dtype=tf.int32),
+                   [tf.shape(pcm)[0]])
+  copies = time_shift_batch(copies, shifts)
+  if noise_stddev > 0:
+    copies = tf.clip_by_value(
+        copies + tf.random_normal(tf.shape(copies), stddev=noise_stddev),
+        -1.0, 1.0)
+  return copies
+
+
+def average_copies(outputs, copy_count):
+  """Averages model outputs over the copies from `expand_copies`.
+
+  Args:
+    outputs: Float tensor of shape [batch * copy_count, classes].
+    copy_count: How many copies of every clip there are.
+
+  Returns:
+    Float tensor of shape [batch, classes].
+  """
+  return tf.reduce_mean(
+      tf.reshape(outputs, [-1, copy_count, outputs.get_shape()[1].value]), 1)
+
+
+def batch_spectrogram(pcm, model_settings):
+  """Calculates spectrograms for a batch of clips in a single op.
+
+  audio_spectrogram takes its input as [samples, channels] and produces one
+  spectrogram per channel, so the batch is transposed into channels.
+
+  Args:
+    pcm: Float tensor of shape [batch, samples].
+    model_settings: Information about the current model being trained.
+
+  Returns:
+    Float tensor of shape [batch, spectrogram_length, frequency_bins].
+  """
+  return contrib_audio.audio_spectrogram(
+      tf.transpose(pcm),
+      window_size=model_settings['window_size_samples'],
+      stride=model_settings['window_stride_samples'],
+      magnitude_squared=True)
+
+
+def batch_mfcc(spectrogram, model_settings):
+  """Calculates MFCCs for a batch of spectrograms from `batch_spectrogram`.
+
+  Args:
+    spectrogram: Float tensor of shape [batch, spectrogram_length, bins].
+    model_settings: Information about the current model being trained.
+
+  Returns:
+    Float tensor of shape [batch, spectrogram_length, dct_coefficient_count].
+  """
+  return contrib_audio.mfcc(
+      spectrogram,
+      int(model_settings['sample_rate']),
+      dct_coefficient_count=int(model_settings['dct_coefficient_count']))
+
+
+def batch_fingerprint(pcm, model_settings, features='mfcc'):
+  """Builds flat model fingerprints for a batch of clips.
+
+  Args:
+    pcm: Float tensor of shape [batch, samples].
+    model_settings: Information about the current model being trained.
+    features: Which features to compute, 'raw', 'spectrogram' or 'mfcc'.
+
+  Returns:
+    Float tensor of shape [batch, fingerprint_size].
+  """
+  if features == 'raw':
+    fingerprint = pcm
+  else:
+    fingerprint = batch_spectrogram(pcm, model_settings)
+    if features != 'spectrogram':
+      fingerprint = batch_mfcc(fingerprint, model_settings)
+  return tf.reshape(fingerprint, [-1, model_settings['fingerprint_size']])
+
+
+class DataPartition(object):
+  """Columnar index of the samples in one partition of the data set.
+
+  Holding a dictionary per sample costs a lot of memory and makes every batch
+  look labels up one by one, so the samples are stored as numpy arrays of
+  ids instead:
+
+    paths: Deduplicated list of the .wav paths in the partition.
+    path_ids: Int32 array indexing `paths` for every sample.
+    words: Deduplicated list of the labels in the partition.
+    word_ids: Int32 array indexing `words` for every sample.
+    label_ids: Int32 array of the class index of every sample.
+    is_silence: Boolean array, true for silence samples. These are
+      synthesized and have no file, their path id is -1 and their path ''.
+
+  Indexing a partition still returns the old {'label': ..., 'file': ...}
+  dictionary for a single sample.
+  """
+
+  def __init__(self, samples, word_to_index):
+    """Builds the index.
+
+    Args:
+      samples: List of (label, file path) tuples, with None as the path of
+        silence samples.
+      word_to_index: Dictionary from label to class index.
+    """
+    self.words = sorted(set(word for word, _ in samples))
+    self.paths = sorted(set(wav_path for _, wav_path in samples
+                            if wav_path is not None))
+    word_ids = dict((word, i) for i, word in enumerate(self.words))
+    path_ids = dict((wav_path, i) for i, wav_path in enumerate(self.paths))
+    path_ids[None] = -1
+    self.word_ids = np.array([word_ids[word] for word, _ in samples],
+                             dtype=np.int32)
+    self.path_ids = np.array([path_ids[wav_path] for _, wav_path in samples],
+                             dtype=np.int32)
+    self.label_ids = np.array(
+        [word_to_index[word] for word in self.words], dtype=np.int32)[self.word_ids]
+    self.is_silence = self.word_ids == word_ids.get(SILENCE_LABEL, -1)
+
+  def __len__(self):
+    return len(self.word_ids)
+
+  def __getitem__(self, index):
+    return {
+        'label': self.words[self.word_ids[index]],
+        'file': self._path(self.path_ids[index])
+    }
+
+  def __iter__(self):
+    for index in xrange(len(self)):
+      yield self[index]
+
+  def _path(self, path_id):
+    return self.paths[path_id] if path_id >= 0 else ''
+
+  def files(self, indices=None):
+    """Returns the file paths of the samples at the given indices, or all."""
+    path_ids = self.path_ids if indices is None else self.path_ids[indices]
+    return [self._path(path_id) for path_id in path_ids]
+
+  def labels(self, indices=None):
+    """Returns the labels of the samples at the given indices, or all."""
+    word_ids = self.word_ids if indices is None else self.word_ids[indices]
+    return [self.words[word_id] for word_id in word_ids]
+
+
 class AudioProcessor(object):
   """Handles loading, partitioning, and preparing audio training data."""
 
   def __init__(self, data_url, data_dir, model_settings):
     self.data_dir = data_dir
+    self.batch_buffers = BatchBufferPool(
+        int(model_settings.get('batch_buffer_count', 2)))
     # self.maybe_download_and_extract_dataset(data_url, data_dir)
     self.prepare_data_index(model_settings['silence_percentage'],
                             model_settings['unknown_percentage'],
                             model_settings['wanted_words'],
-                            model_settings['validation_percentage'])
-    self.prepare_background_data()
+                            model_settings['validation_percentage'],
+                            model_settings.get(
+                                'data_index_manifest',
+                                os.path.join(data_dir,
+                                             DATA_INDEX_MANIFEST_FILE_NAME)))
+    self.prepare_background_data(model_settings)
     self.prepare_processing_graph(model_settings)
+    self.prepare_batch_processing_graph(model_settings)
+    self.prepare_clip_store(model_settings)
+    self.prepare_feature_cache(model_settings)
+    self.prepare_sampler(model_settings)
 
   def maybe_download_and_extract_dataset(self, data_url, dest_directory):
     """Download and extract data set tar file.
@@ -274,7 +900,8 @@ class AudioProcessor(object):
     tarfile.open(filepath, 'r:gz').extractall(dest_directory)
 
   def prepare_data_index(self, silence_percentage, unknown_percentage,
-                         wanted_words, validation_percentage):
+                         wanted_words, validation_percentage,
+                         manifest_path=None):
     """Prepares a list of the samples organized by set and label.
 
     The training loop needs a list of all the available data, organized by
@@ -290,6 +917,8 @@ class AudioProcessor(object):
       wanted_words: Labels of the classes we want to be able to recognize.
       validation_percentage: How much of the data set to use for validation.
       testing_percentage: How much of the data set to use for testing.
+      manifest_path: Where to cache the results of scanning `data_dir`, see
+        `scan_data_dir`.
 
     Returns:
       Dictionary containing a list of file information for each set partition,
@@ -306,23 +935,23 @@ class AudioProcessor(object):
     self.data_index = {'validation': [],  'training': []}
     unknown_index = {'validation': [],  'training': []}
     all_words = {}
-    # Look through all the subfolders to find audio samples
+    # Look through all the subfolders to find audio samples. The
+    # '_background_noise_' folder is skipped, since we expect it to contain
+    # long audio samples we mix in to improve training.
     search_path = os.path.join(self.data_dir, '*', '*.wav')
-    for wav_path in gfile.Glob(search_path):
-      _, word = os.path.split(os.path.dirname(wav_path))
+    # Size and mtime of every file, which tell the caches a clip has changed.
+    self.file_versions = {}
+    for wav_path, word, set_index, size, mtime in scan_data_dir(
+        self.data_dir, validation_percentage, manifest_path):
+      self.file_versions[wav_path] = [size, mtime]
       word = word.lower()
-      # Treat the '_background_noise_' folder as a special case, since we expect
-      # it to contain long audio samples we mix in to improve training.
-      if word == BACKGROUND_NOISE_DIR_NAME:
-        continue
       all_words[word] = True
-      set_index = which_set(wav_path, validation_percentage)
       # If it's a known class, store its detail, otherwise add it to the list
       # we'll use to train the unknown label.
       if word in wanted_words_index:
-        self.data_index[set_index].append({'label': word, 'file': wav_path})
+        self.data_index[set_index].append((word, wav_path))
       else:
-        unknown_index[set_index].append({'label': word, 'file': wav_path})
+        unknown_index[set_index].append((word, wav_path))
     if not all_words:
       raise Exception('No .wavs found at ' + search_path)
     for index, wanted_word in enumerate(wanted_words):
@@ -330,17 +959,13 @@ class AudioProcessor(object):
         raise Exception('Expected to find ' + wanted_word +
                         ' in labels but only found ' +
                         ', '.join(all_words.keys()))
-    # We need an arbitrary file to load as the input for the silence samples.
-    # It's multiplied by zero later, so the content doesn't matter.
-    silence_wav_path = self.data_index['training'][0]['file']
+    # Silence samples are synthesized from zeros and background noise, so they
+    # don't have a file.
     for set_index in ['validation', 'training']:
       set_size = len(self.data_index[set_index])
       silence_size = int(math.ceil(set_size * silence_percentage / 100))
       for _ in range(silence_size):
-        self.data_index[set_index].append({
-            'label': SILENCE_LABEL,
-            'file': silence_wav_path
-        })
+        self.data_index[set_index].append((SILENCE_LABEL, None))
       # Pick some unknowns to add to each partition of the data set.
       random.shuffle(unknown_index[set_index])
       unknown_size = int(math.ceil(set_size * unknown_percentage / 100))
@@ -357,6 +982,9 @@ class AudioProcessor(object):
       else:
         self.word_to_index[word] = UNKNOWN_WORD_INDEX
     self.word_to_index[SILENCE_LABEL] = SILENCE_INDEX
+    for set_index in ['validation', 'training']:
+      self.data_index[set_index] = DataPartition(self.data_index[set_index],
+                                                 self.word_to_index)
 
     # self.data_index['testing'] = np.random.permutation(self.data_index['testing'])
 
@@ -370,7 +998,7 @@ class AudioProcessor(object):
     # for f in fn:
     #   self.data_index['testing'].append({'label': 'left', 'file': l_path + f})
 
-  def prepare_background_data(self):
+  def prepare_background_data(self, model_settings):
     """Searches a folder for background noise audio, and loads it into memory.
 
     It's expected that the background audio samples will be in a subdirectory
@@ -382,30 +1010,210 @@ class AudioProcessor(object):
     be used. If the folder does exist, but it's empty, that's treated as an
     error.
 
-    Returns:
-      List of raw PCM-encoded audio samples of background noise.
+    All the noise is kept in one flat float32 array, `background_bank`, and
+    `background_data` holds views of it for each clip. If 'noise_bank_dir' is
+    set in the model settings the array is a memory map of a file in that
+    directory, packed on first use, so all processes on a machine share one
+    copy. `background_windows` views every `desired_samples` long window of
+    the bank without copying, so a batch of noise is a single gather.
+
+    Args:
+      model_settings: Information about the current model being trained.
 
     Raises:
       Exception: If files aren't found in the folder.
     """
     self.background_data = []
+    self.background_bank = np.zeros(0, np.float32)
+    self.background_starts = np.zeros(0, np.int64)
+    self.background_lengths = np.zeros(0, np.int64)
+    self.background_windows = None
     background_dir = os.path.join(self.data_dir, BACKGROUND_NOISE_DIR_NAME)
     if not os.path.exists(background_dir):
-      return self.background_data
-    with tf.Session(graph=tf.Graph()) as sess:
-      wav_filename_placeholder = tf.placeholder(tf.string, [])
-      wav_loader = io_ops.read_file(wav_filename_placeholder)
-      wav_decoder = contrib_audio.decode_wav(wav_loader, desired_channels=1)
-      search_path = os.path.join(self.data_dir, BACKGROUND_NOISE_DIR_NAME,
-                                 '*.wav')
-      for wav_path in gfile.Glob(search_path):
-        print(wav_path)
-        wav_data = sess.run(
-            wav_decoder,
-            feed_dict={wav_filename_placeholder: wav_path}).audio.flatten()
-        self.background_data.append(wav_data)
-      if not self.background_data:
-        raise Exception('No background wav files were found in ' + search_path)
+      return
+    search_path = os.path.join(self.data_dir, BACKGROUND_NOISE_DIR_NAME,
+                               '*.wav')
+    wav_paths = sorted(gfile.Glob(search_path))
+    if not wav_paths:
+      raise Exception('No background wav files were found in ' + search_path)
+    bank_dir = model_settings.get('noise_bank_dir')
+    if bank_dir:
+      bank, index = load_noise_bank(bank_dir)
+      if index is None or index['files'] != wav_paths:
+        pack_noise_bank(bank_dir, wav_paths)
+        bank, index = load_noise_bank(bank_dir)
+      starts = index['starts']
+      lengths = index['lengths']
+    else:
+      clips = [load_wav_file(wav_path).astype(np.float32)
+               for wav_path in wav_paths]
+      lengths = [len(clip) for clip in clips]
+      starts = np.cumsum([0] + lengths[:-1])
+      bank = np.concatenate(clips)
+    self.background_bank = bank
+    self.background_starts = np.array(starts, np.int64)
+    self.background_lengths = np.array(lengths, np.int64)
+    self.background_data = [
+        bank[start:start + length] for start, length in zip(starts, lengths)
+    ]
+    desired_samples = model_settings['desired_samples']
+    if len(bank) >= desired_samples:
+      self.background_windows = np.lib.stride_tricks.as_strided(
+          bank,
+          shape=(len(bank) - desired_samples + 1, desired_samples),
+          strides=(bank.strides[0], bank.strides[0]),
+          writeable=False)
+
+  def prepare_clip_store(self, model_settings):
+    """Opens the decoded clip store, packing it first if it's missing.
+
+    If 'clip_store_dir' is set in the model settings, every clip in the data
+    index is decoded once into a memory-mapped int16 store in that directory,
+    and `get_data` then slices samples straight out of it instead of reading
+    and decoding .wav files on every step. A store that doesn't cover the
+    current data index, or was packed for a different clip length, is packed
+    again, as is one holding an older version of any of the files. The data
+    index only has the validation and training partitions, so every clip
+    `get_clip` and `get_clips` are asked for is in the store.
+
+    Args:
+      model_settings: Information about the current model being trained.
+    """
+    self.clip_store = None
+    self.clip_store_offsets = {}
+    self.clip_store_rows = {}
+    store_dir = model_settings.get('clip_store_dir')
+    if not store_dir:
+      return
+    desired_samples = model_settings['desired_samples']
+    wav_files = {}
+    for set_index in ['validation', 'training']:
+      partition = self.data_index[set_index]
+      wav_files.update(
+          (wav_path, label)
+          for wav_path, label in zip(partition.files(), partition.labels())
+          if wav_path)
+    clips, index = load_clip_store(store_dir)
+    if index is not None:
+      offsets = dict((clip['file'], clip['offset']) for clip in index['clips'])
+      versions = dict(
+          (clip['file'], clip.get('version')) for clip in index['clips'])
+      if (index['desired_samples'] != desired_samples or
+          any(wav_path not in offsets or
+              versions[wav_path] != self.file_versions[wav_path]
+              for wav_path in wav_files)):
+        tf.logging.info('Clip store in %s is stale, repacking', store_dir)
+        clips = None
+    if clips is None:
+      wav_paths = sorted(wav_files)
+      pack_clip_store(store_dir, wav_paths,
+                      [wav_files[wav_path] for wav_path in wav_paths],
+                      desired_samples,
+                      [self.file_versions[wav_path] for wav_path in wav_paths])
+      clips, index = load_clip_store(store_dir)
+      offsets = dict((clip['file'], clip['offset']) for clip in index['clips'])
+    self.clip_store = clips
+    self.clip_store_offsets = offsets
+    self.clip_store_sample_rate = index['sample_rate']
+    # Store row of every path in each partition's path table.
+    for set_index in ['validation', 'training']:
+      self.clip_store_rows[set_index] = np.array(
+          [offsets[wav_path] for wav_path in self.data_index[set_index].paths],
+          dtype=np.int64)
+
+  def get_clip(self, wav_path):
+    """Returns the decoded float PCM samples of a clip from the clip store.
+
+    Args:
+      wav_path: Path of the original .wav file.
+
+    Returns:
+      Numpy float32 array of shape [desired_samples, 1], identical to what
+      decode_wav produces for the file.
+    """
+    clip = self.clip_store[self.clip_store_offsets[wav_path]]
+    return (clip.astype(np.float32) / 32768.0).reshape([-1, 1])
+
+  def get_clips(self, mode, sample_indices):
+    """Returns the decoded float PCM samples of several clips at once.
+
+    Args:
+      mode: Which partition the samples are in.
+      sample_indices: Int array of sample indices in the partition.
+
+    Returns:
+      Numpy float32 array of shape [len(sample_indices), desired_samples].
+    """
+    path_ids = self.data_index[mode].path_ids[sample_indices]
+    # Silence samples have no clip and stay zero.
+    has_clip = path_ids >= 0
+    clips = np.zeros((len(path_ids), self.clip_store.shape[1]), np.float32)
+    clips[has_clip] = self.clip_store[
+        self.clip_store_rows[mode][path_ids[has_clip]]] / 32768.0
+    return clips
+
+  def prepare_feature_cache(self, model_settings):
+    """Sets up the on-disk cache of non-augmented fingerprints.
+
+    If 'feature_cache_dir' is set in the model settings, fingerprints of the
+    validation and testing partitions are computed once and then read back
+    from memory-mapped shards by `get_data`. 'feature_cache_max_bytes'
+    optionally bounds the total size of the cache directory.
+
+    Args:
+      model_settings: Information about the current model being trained.
+    """
+    self.feature_cache_dir = model_settings.get('feature_cache_dir')
+    max_bytes = model_settings.get('feature_cache_max_bytes')
+    self.feature_cache_max_bytes = int(max_bytes) if max_bytes else None
+    self.feature_caches = {}
+    self.feature_cache_entries = {}
+
+  def get_feature_cache(self, model_settings, features):
+    """Returns the feature cache for a kind of features, or None."""
+    if not self.feature_cache_dir:
+      return None
+    if features not in self.feature_caches:
+      self.feature_caches[features] = FeatureCache(
+          self.feature_cache_dir, model_settings, features,
+          self.feature_cache_max_bytes)
+    return self.feature_caches[features]
+
+  def get_feature_cache_entries(self, mode):
+    """Lists strings identifying the clips of a partition, in order.
+
+    Files are identified by their path, size and mtime, so cached features of
+    a file that was replaced aren't reused.
+    """
+    if mode not in self.feature_cache_entries:
+      partition = self.data_index[mode]
+      self.feature_cache_entries[mode] = [
+          '%s:%d:%r' % tuple([wav_path] + self.file_versions[wav_path])
+          if wav_path else SILENCE_LABEL for wav_path in partition.files()
+      ]
+    return self.feature_cache_entries[mode]
+
+  def prepare_sampler(self, model_settings, seed=RANDOM_SEED):
+    """Creates the sampler that picks training samples.
+
+    Args:
+      model_settings: Information about the current model being trained,
+        'sampler' selects the strategy, see `samplers`.
+      seed: Seed of the sampler's random stream.
+    """
+    self.sampler = samplers.create_sampler(
+        model_settings.get('sampler', 'random'),
+        self.data_index['training'].label_ids, seed)
+    self.last_sample_indices = np.zeros(0, np.int64)
+
+  def update_sample_losses(self, losses):
+    """Feeds the losses of the last training batch back to the sampler.
+
+    Args:
+      losses: Per-sample losses, in the order of the last batch `get_data`
+        returned for the 'training' mode.
+    """
+    self.sampler.update(self.last_sample_indices, losses)
 
   def background_label_count(self):
       return len(self.background_data)
@@ -421,6 +1229,8 @@ class AudioProcessor(object):
     creates multiple placeholder inputs, and one output:
 
       - wav_filename_placeholder_: Filename of the WAV to load.
+      - wav_decoder_: Decoded audio and sample rate, feedable instead of the
+        filename.
       - foreground_volume_placeholder_: How loud the main clip should be.
       - time_shift_padding_placeholder_: Where to pad the clip.
       - time_shift_offset_placeholder_: How much to move the clip in time.
@@ -436,6 +1246,9 @@ class AudioProcessor(object):
     wav_loader = io_ops.read_file(self.wav_filename_placeholder_)
     wav_decoder = contrib_audio.decode_wav(
         wav_loader, desired_channels=1, desired_samples=desired_samples)
+    # Both outputs of the decoder can be fed directly with clips from the clip
+    # store, which skips reading and decoding the file.
+    self.wav_decoder_ = wav_decoder
     # Allow the audio sample's volume to be adjusted.
     self.foreground_volume_placeholder_ = tf.placeholder(tf.float32, [])
     scaled_foreground = tf.multiply(wav_decoder.audio,
@@ -469,6 +1282,168 @@ class AudioProcessor(object):
         wav_decoder.sample_rate,
         dct_coefficient_count=model_settings['dct_coefficient_count'])
 
+  def prepare_batch_processing_graph(self, model_settings):
+    """Builds a TensorFlow graph to apply the input distortions to a batch.
+
+    This does the same work as the graph from `prepare_processing_graph`, but
+    for a whole minibatch of clips at once, so producing a batch only takes a
+    single session call. Every placeholder has a leading batch dimension:
+
+      - batch_wav_filenames_placeholder_: Filenames of the WAVs to load, ''
+        for silence.
+      - batch_foreground_data_: Decoded clips, [batch, desired_samples]. Loaded
+        from the filenames unless it's fed directly.
+      - batch_foreground_volume_placeholder_: How loud each clip should be.
+      - batch_time_shift_placeholder_: How much to move each clip in time.
+      - batch_background_data_placeholder_: PCM background noise slices.
+      - batch_background_volume_placeholder_: Loudness of each background.
+      - batch_pcm_, batch_spectrogram_, batch_mfcc_: Processed audio of the
+        batch as raw samples, spectrograms and MFCCs.
+
+    Args:
+      model_settings: Information about the current model being trained.
+    """
+    desired_samples = model_settings['desired_samples']
+    self.batch_wav_filenames_placeholder_ = tf.placeholder(tf.string, [None])
+    decoded_foreground = tf.map_fn(
+        lambda wav_filename: decode_clip(wav_filename, desired_samples),
+        self.batch_wav_filenames_placeholder_, dtype=tf.float32,
+        back_prop=False)
+    self.batch_foreground_data_ = tf.placeholder_with_default(
+        decoded_foreground, [None, desired_samples])
+    self.batch_foreground_volume_placeholder_ = tf.placeholder(tf.float32,
+                                                               [None])
+    scaled_foreground = (self.batch_foreground_data_ *
+                         tf.expand_dims(self.batch_foreground_volume_placeholder_,
+                                        1))
+    self.batch_time_shift_placeholder_ = tf.placeholder(tf.int32, [None])
+    shifted_foreground = time_shift_batch(scaled_foreground,
+                                          self.batch_time_shift_placeholder_)
+    self.batch_background_data_placeholder_ = tf.placeholder(
+        tf.float32, [None, desired_samples])
+    self.batch_background_volume_placeholder_ = tf.placeholder(tf.float32,
+                                                               [None])
+    background_mul = (self.batch_background_data_placeholder_ *
+                      tf.expand_dims(self.batch_background_volume_placeholder_,
+                                     1))
+    self.batch_pcm_ = tf.clip_by_value(background_mul + shifted_foreground,
+                                       -1.0, 1.0)
+    self.batch_spectrogram_ = batch_spectrogram(self.batch_pcm_,
+                                                model_settings)
+    self.batch_mfcc_ = batch_mfcc(self.batch_spectrogram_, model_settings)
+
+  def get_dataset_iterator(self, batch_size, model_settings,
+                           background_frequency, background_volume_range,
+                           time_shift, mode, features='mfcc'):
+    """Builds a tf.data pipeline producing processed batches of a partition.
+
+    This is the in-graph equivalent of calling `get_data` in a loop: files of
+    the partition are decoded in parallel, batched, distorted with background
+    noise and time shifts, turned into fingerprints and prefetched, so the data
+    preparation overlaps with the training steps instead of blocking them. In
+    'training' mode the partition is shuffled and repeated forever, otherwise
+    it's read once in order.
+
+    The file list and the background noise are fed through placeholders when
+    the iterator is initialized, rather than being embedded in the graph as
+    constants, so the caller has to run:
+
+      sess.run(iterator.initializer, feed_dict=initializer_feed_dict)
+
+    Args:
+      batch_size: How many samples each batch should hold.
+      model_settings: Information about the current model being trained.
+      background_frequency: How many clips will have background noise, 0.0 to
+        1.0.
+      background_volume_range: How loud the background noise will be.
+      time_shift: How much to randomly shift the clips by in time.
+      mode: Which partition to use, must be 'training', 'validation', or
+        'testing'.
+      features: Which features to compute, 'raw', 'spectrogram' or 'mfcc'.
+
+    Returns:
+      Initializable iterator whose `get_next()` yields fingerprints, one-hot
+      labels and one-hot noise labels, and the feed dictionary to initialize
+      it with.
+    """
+    candidates = self.data_index[mode]
+    desired_samples = model_settings['desired_samples']
+    label_count = model_settings['label_count']
+    noise_label_count = self.background_label_count() + 1
+    num_parallel_calls = int(
+        model_settings.get('num_parallel_calls', multiprocessing.cpu_count()))
+    use_background = bool(self.background_data) and (mode == 'training')
+
+    wav_filenames_placeholder = tf.placeholder(tf.string, [None])
+    label_indices_placeholder = tf.placeholder(tf.int32, [None])
+    foreground_volumes_placeholder = tf.placeholder(tf.float32, [None])
+    initializer_feed_dict = {
+        wav_filenames_placeholder: candidates.files(),
+        label_indices_placeholder: candidates.label_ids,
+        # If we want silence, mute out the main sample but leave the background.
+        foreground_volumes_placeholder: np.where(candidates.is_silence, 0.0,
+                                                 1.0),
+    }
+    if use_background:
+      # Windows are cut out of the flat background bank by their start
+      # offsets.
+      background_placeholder = tf.placeholder(tf.float32, [None])
+      initializer_feed_dict[background_placeholder] = self.background_bank
+      background_starts = tf.constant(self.background_starts, tf.int32)
+      background_lengths = tf.constant(self.background_lengths, tf.int32)
+
+    def load(wav_filename, label_index, foreground_volume):
+      audio = decode_clip(wav_filename, desired_samples)
+      return audio * foreground_volume, label_index
+
+    def process(foreground, label_indices):
+      current_batch_size = tf.shape(foreground)[0]
+      if time_shift > 0:
+        foreground = time_shift_batch(
+            foreground,
+            tf.random_uniform([current_batch_size], -time_shift, time_shift,
+                              dtype=tf.int32))
+      if use_background:
+        background_index = tf.random_uniform(
+            [current_batch_size], 0, noise_label_count - 1, dtype=tf.int32)
+        background_offset = tf.cast(
+            tf.random_uniform([current_batch_size]) * tf.cast(
+                tf.gather(background_lengths, background_index) -
+                desired_samples, tf.float32), tf.int32)
+        positions = (tf.expand_dims(
+            tf.gather(background_starts, background_index) + background_offset,
+            1) + tf.expand_dims(tf.range(desired_samples), 0))
+        background = tf.gather(background_placeholder, positions)
+        use_noise = (tf.random_uniform([current_batch_size]) <
+                     background_frequency)
+        background_volume = tf.where(
+            use_noise,
+            tf.random_uniform([current_batch_size], 0.0,
+                              background_volume_range),
+            tf.zeros([current_batch_size]))
+        foreground += background * tf.expand_dims(background_volume, 1)
+        noise_labels = tf.one_hot(
+            tf.where(use_noise, background_index,
+                     tf.fill([current_batch_size], noise_label_count - 1)),
+            noise_label_count)
+      else:
+        noise_labels = tf.zeros([current_batch_size, noise_label_count])
+      pcm = tf.clip_by_value(foreground, -1.0, 1.0)
+      fingerprints = batch_fingerprint(pcm, model_settings, features)
+      return (fingerprints, tf.one_hot(label_indices, label_count),
+              noise_labels)
+
+    dataset = tf.data.Dataset.from_tensor_slices(
+        (wav_filenames_placeholder, label_indices_placeholder,
+         foreground_volumes_placeholder))
+    if mode == 'training':
+      dataset = dataset.shuffle(len(candidates)).repeat()
+    dataset = dataset.map(load, num_parallel_calls=num_parallel_calls)
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.map(process, num_parallel_calls=num_parallel_calls)
+    dataset = dataset.prefetch(int(model_settings.get('prefetch_batches', 4)))
+    return dataset.make_initializable_iterator(), initializer_feed_dict
+
   def set_size(self, mode):
     """Calculates the number of samples in the dataset partition.
 
@@ -480,6 +1455,60 @@ class AudioProcessor(object):
     """
     return len(self.data_index[mode])
 
+  def process_batch(self, mode, sample_indices, foreground_volumes,
+                    time_shift_amounts, background_data, background_volumes,
+                    model_settings, sess, features='mfcc'):
+    """Turns a batch of samples and their distortions into fingerprints.
+
+    Args:
+      mode: Which partition the samples are in.
+      sample_indices: Int array of sample indices in the partition.
+      foreground_volumes: How loud each clip should be.
+      time_shift_amounts: How much to move each clip in time.
+      background_data: Background noise for each clip, [batch,
+        desired_samples].
+      background_volumes: How loud each background should be.
+      model_settings: Information about the current model being trained.
+      sess: TensorFlow session that was active when processor was created.
+      features: Which features to compute, 'raw', 'spectrogram' or 'mfcc'.
+
+    Returns:
+      Float32 array of shape [batch, fingerprint_size].
+    """
+    foreground_data = None
+    if self.clip_store is not None:
+      foreground_data = self.get_clips(mode, sample_indices)
+    if (foreground_data is not None and
+        model_settings.get('feature_frontend') == 'numpy'):
+      # All the audio is already in memory, so the whole batch can be
+      # processed in numpy without a session call.
+      foreground = audio_features.time_shift(
+          foreground_data * foreground_volumes[:, np.newaxis],
+          time_shift_amounts)
+      pcm = np.clip(foreground + background_data *
+                    background_volumes[:, np.newaxis], -1.0, 1.0)
+      return audio_features.fingerprints(pcm, model_settings, features)
+    input_dict = {
+        self.batch_foreground_volume_placeholder_: foreground_volumes,
+        self.batch_time_shift_placeholder_: time_shift_amounts,
+        self.batch_background_data_placeholder_: background_data,
+        self.batch_background_volume_placeholder_: background_volumes,
+    }
+    if foreground_data is not None:
+      input_dict[self.batch_foreground_data_] = foreground_data
+    else:
+      input_dict[self.batch_wav_filenames_placeholder_] = (
+          self.data_index[mode].files(sample_indices))
+    # Run the graph to produce the output audio for the whole batch.
+    if features == "spectrogram":
+      data = sess.run(self.batch_spectrogram_, feed_dict=input_dict)
+    elif features == "raw":
+      data = sess.run(self.batch_pcm_, feed_dict=input_dict)
+    else:
+      data = sess.run(self.batch_mfcc_, feed_dict=input_dict)
+    return data.reshape((len(sample_indices),
+                         model_settings['fingerprint_size']))
+
   def get_data(self, how_many, offset, model_settings, background_frequency,
                background_volume_range, time_shift, mode, sess, features='mfcc'):
     """Gather samples from the data set, applying transformations as needed.
@@ -487,6 +1516,12 @@ class AudioProcessor(object):
     When the mode is 'training', a random selection of samples will be returned,
     otherwise the first N clips in the partition will be used. This ensures that
     validation always uses the same samples, reducing noise in the metrics.
+    Non-augmented fingerprints outside of training are read from the feature
+    cache when one is configured.
+
+    The returned arrays come from a small pool of buffers that is reused on
+    later calls, see `BatchBufferPool`, so they should be copied if they have
+    to outlive the next few batches.
 
     Args:
       how_many: Desired number of samples to return. -1 means the entire
@@ -500,167 +1535,159 @@ class AudioProcessor(object):
       mode: Which partition to use, must be 'training', 'validation', or
         'testing'.
       sess: TensorFlow session that was active when processor was created.
+      features: Which features to compute, 'raw', 'spectrogram' or 'mfcc'.
 
     Returns:
-      List of sample data for the transformed samples, and list of labels in
-      one-hot form.
+      List of sample data for the transformed samples in the type given by
+      `fingerprint_dtype`, list of labels in one-hot form, list of noise
+      labels in one-hot form and list of the file paths of the samples.
     """
     # Pick one of the partitions to choose samples from.
-    wav_files = []
     candidates = self.data_index[mode]
     if how_many == -1:
       sample_count = len(candidates)
     else:
       sample_count = max(0, min(how_many, len(candidates) - offset))
-
-    # Data and labels will be populated and returned.
-    data = np.zeros((sample_count, model_settings['fingerprint_size']))
-    labels = np.zeros((sample_count, model_settings['label_count']))
-    noise_labels = np.zeros((sample_count, self.background_label_count() + 1))
     desired_samples = model_settings['desired_samples']
     use_background = self.background_data and (mode == 'training')
     pick_deterministically = (mode != 'training')
-    # Use the processing graph we created earlier to repeatedly to generate the
-    # final output sample data we'll use in training.
-    for i in xrange(offset, offset + sample_count):
-      # Pick which audio sample to use.
-      if how_many == -1 or pick_deterministically:
-        sample_index = i
-      else:
-        sample_index = np.random.randint(len(candidates))
-      sample = candidates[sample_index]
-      wav_files.append(sample)
-      # If we're time shifting, set up the offset for this sample.
-      if time_shift > 0:
-        time_shift_amount = np.random.randint(-time_shift, time_shift)
-      else:
-        time_shift_amount = 0
-      if time_shift_amount > 0:
-        time_shift_padding = [[time_shift_amount, 0], [0, 0]]
-        time_shift_offset = [0, 0]
-      else:
-        time_shift_padding = [[0, -time_shift_amount], [0, 0]]
-        time_shift_offset = [-time_shift_amount, 0]
-      input_dict = {
-          self.wav_filename_placeholder_: sample['file'],
-          self.time_shift_padding_placeholder_: time_shift_padding,
-          self.time_shift_offset_placeholder_: time_shift_offset,
-      }
-      # Choose a section of background noise to mix in.
-      if use_background:
-        background_index = np.random.randint(len(self.background_data))
-        background_samples = self.background_data[background_index]
-        background_offset = np.random.randint(
-            0, len(background_samples) - model_settings['desired_samples'])
-        background_clipped = background_samples[background_offset:(
-            background_offset + desired_samples)]
-        background_reshaped = background_clipped.reshape([desired_samples, 1])
-        if np.random.uniform(0, 1) < background_frequency:
-          background_volume = np.random.uniform(0.0, background_volume_range)
-          noise_labels[i - offset, background_index] = 1
-        else:
-          background_volume = 0
-          noise_labels[i - offset, -1] = 1
-      else:
-        background_reshaped = np.zeros([desired_samples, 1])
-        background_volume = 0
-      input_dict[self.background_data_placeholder_] = background_reshaped
-      input_dict[self.background_volume_placeholder_] = background_volume
-      # If we want silence, mute out the main sample but leave the background.
-      if sample['label'] == SILENCE_LABEL:
-        input_dict[self.foreground_volume_placeholder_] = 0
-      else:
-        input_dict[self.foreground_volume_placeholder_] = 1
-      # Run the graph to produce the output audio.
-      if features == "spectrogram":
-        data[i - offset, :] = sess.run(self.spectrogram_, feed_dict=input_dict).flatten()
-      elif features == "raw":
-        data[i - offset, :] = sess.run(self.pcm_array_, feed_dict=input_dict).flatten()
-      else:
-        data[i - offset, :] = sess.run(self.mfcc_, feed_dict=input_dict).flatten()
-      label_index = self.word_to_index[sample['label']]
-      labels[i - offset, label_index] = 1
-      # print(sample)
+    # Pick which audio samples to use.
+    if how_many == -1 or pick_deterministically:
+      sample_indices = np.arange(offset, offset + sample_count)
+    else:
+      sample_indices = self.sampler.sample(sample_count)
+      self.last_sample_indices = sample_indices
+    wav_files = candidates.files(sample_indices)
+    # Data and labels will be populated and returned.
+    labels = self.batch_buffers.get(
+        'labels', (sample_count, model_settings['label_count']), np.float64)
+    labels.fill(0)
+    labels[np.arange(sample_count), candidates.label_ids[sample_indices]] = 1
+    noise_labels = self.batch_buffers.get(
+        'noise_labels', (sample_count, self.background_label_count() + 1),
+        np.float64)
+    noise_labels.fill(0)
+    data = self.batch_buffers.get(
+        'data', (sample_count, model_settings['fingerprint_size']),
+        fingerprint_dtype(model_settings, features))
+    if sample_count == 0:
+      return data, labels, noise_labels, wav_files
+    # Gather the settings for every clip in the batch, so the processing graph
+    # only has to be run once for all of them.
+    # If we want silence, mute out the main sample but leave the background.
+    foreground_volumes = np.where(candidates.is_silence[sample_indices], 0.0,
+                                  1.0).astype(np.float32)
+    # If we're time shifting, set up the offset for every sample.
+    if time_shift > 0:
+      time_shift_amounts = np.random.randint(-time_shift, time_shift,
+                                             size=sample_count).astype(np.int32)
+    else:
+      time_shift_amounts = np.zeros(sample_count, np.int32)
+    background_volumes = np.zeros(sample_count, np.float32)
+    # Choose sections of background noise to mix in.
+    if use_background:
+      background_indices = np.random.randint(len(self.background_data),
+                                             size=sample_count)
+      background_offsets = np.random.randint(
+          0, self.background_lengths[background_indices] - desired_samples)
+      background_data = self.background_windows[
+          self.background_starts[background_indices] + background_offsets]
+      use_noise = np.random.uniform(0, 1, sample_count) < background_frequency
+      background_volumes[use_noise] = np.random.uniform(
+          0.0, background_volume_range, np.count_nonzero(use_noise))
+      noise_labels[np.arange(sample_count),
+                   np.where(use_noise, background_indices, -1)] = 1
+    else:
+      background_data = np.zeros((sample_count, desired_samples), np.float32)
+    feature_cache = self.get_feature_cache(model_settings, features)
+    if (feature_cache is not None and pick_deterministically and
+        time_shift == 0):
+      def compute_fingerprints(start, end):
+        indices = np.arange(start, end)
+        return self.process_batch(
+            mode, indices,
+            np.where(candidates.is_silence[indices], 0.0, 1.0).astype(
+                np.float32),
+            np.zeros(end - start, np.int32),
+            np.zeros((end - start, desired_samples), np.float32),
+            np.zeros(end - start, np.float32), model_settings, sess, features)
+      fingerprints = feature_cache.get_rows(
+          mode, self.get_feature_cache_entries(mode), offset, sample_count,
+          compute_fingerprints)
+    else:
+      fingerprints = self.process_batch(
+          mode, sample_indices, foreground_volumes, time_shift_amounts,
+          background_data, background_volumes, model_settings, sess, features)
+    convert_fingerprints(fingerprints, data)
     return data, labels, noise_labels, wav_files
 
+  def process_files(self, wav_paths, model_settings, sess, features='mfcc'):
+    """Computes undistorted fingerprints for a batch of .wav files.
 
-  def get_test_data(self, how_many, offset, model_settings, background_frequency,
-               background_volume_range, time_shift, mode, test_path, sess, features='mfcc'):
-    candidates = []
-    for (dir_path, dir_names, file_names) in os.walk(test_path):
-      candidates.extend(file_names)
-      break
+    Args:
+      wav_paths: List of paths of the .wavs to load.
+      model_settings: Information about the current model being trained.
+      sess: TensorFlow session that was active when processor was created.
+      features: Which features to compute, 'raw', 'spectrogram' or 'mfcc'.
 
-    # candidates = self.data_index[mode]
-    # if how_many == -1:
-    #   sample_count = len(candidates)
-    # else:
-    sample_count = max(0, min(how_many, len(candidates) - offset))
-    # Data and labels will be populated and returned.
-    data = np.zeros((sample_count, model_settings['fingerprint_size']))
-    labels = np.zeros((sample_count, model_settings['label_count']))
-    desired_samples = model_settings['desired_samples']
-    use_background = self.background_data and (mode == 'training')
-    pick_deterministically = (mode != 'training')
-    # Use the processing graph we created earlier to repeatedly to generate the
-    # final output sample data we'll use in training.
-    for i in xrange(offset, offset + sample_count):
-      # Pick which audio sample to use.
-      if how_many == -1 or pick_deterministically:
-        sample_index = i
-      else:
-        sample_index = np.random.randint(len(candidates))
-      sample = candidates[sample_index]
-      # If we're time shifting, set up the offset for this sample.
-      if time_shift > 0:
-        time_shift_amount = np.random.randint(-time_shift, time_shift)
-      else:
-        time_shift_amount = 0
-      if time_shift_amount > 0:
-        time_shift_padding = [[time_shift_amount, 0], [0, 0]]
-        time_shift_offset = [0, 0]
-      else:
-        time_shift_padding = [[0, -time_shift_amount], [0, 0]]
-        time_shift_offset = [-time_shift_amount, 0]
-      input_dict = {
-          self.wav_filename_placeholder_: test_path + sample,
-          self.time_shift_padding_placeholder_: time_shift_padding,
-          self.time_shift_offset_placeholder_: time_shift_offset,
-      }
-      # Choose a section of background noise to mix in.
-      if use_background:
-        background_index = np.random.randint(len(self.background_data))
-        background_samples = self.background_data[background_index]
-        background_offset = np.random.randint(
-            0, len(background_samples) - model_settings['desired_samples'])
-        background_clipped = background_samples[background_offset:(
-            background_offset + desired_samples)]
-        background_reshaped = background_clipped.reshape([desired_samples, 1])
-        if np.random.uniform(0, 1) < background_frequency:
-          background_volume = np.random.uniform(0, background_volume_range)
-        else:
-          background_volume = 0
-      else:
-        background_reshaped = np.zeros([desired_samples, 1])
-        background_volume = 0
-      input_dict[self.background_data_placeholder_] = background_reshaped
-      input_dict[self.background_volume_placeholder_] = background_volume
-      # If we want silence, mute out the main sample but leave the background.
-
-      input_dict[self.foreground_volume_placeholder_] = 1
-      # Run the graph to produce the output audio.
-      if features == "spectrogram":
-        sc_f = sess.run(self.spectrogram_, feed_dict=input_dict)
-      elif features == "raw":
-        sc_f = sess.run(self.pcm_array_, feed_dict=input_dict)
-      else:
-        sc_f = sess.run(self.mfcc_, feed_dict=input_dict)
-      data[i - offset, :] = sc_f.flatten()
+    Returns:
+      Float32 array of shape [len(wav_paths), fingerprint_size].
+    """
+    sample_count = len(wav_paths)
+    input_dict = {
+        self.batch_wav_filenames_placeholder_: wav_paths,
+        self.batch_foreground_volume_placeholder_: np.ones(sample_count),
+        self.batch_time_shift_placeholder_: np.zeros(sample_count, np.int32),
+        self.batch_background_data_placeholder_: np.zeros(
+            (sample_count, model_settings['desired_samples'])),
+        self.batch_background_volume_placeholder_: np.zeros(sample_count),
+    }
+    if features == "spectrogram":
+      data = sess.run(self.batch_spectrogram_, feed_dict=input_dict)
+    elif features == "raw":
+      data = sess.run(self.batch_pcm_, feed_dict=input_dict)
+    else:
+      data = sess.run(self.batch_mfcc_, feed_dict=input_dict)
+    return data.reshape((sample_count,
+                         model_settings['fingerprint_size'])).astype(np.float32)
 
+  def iterate_test_data(self, test_path, batch_size, model_settings, sess,
+                        features='mfcc', manifest_path=None, prefetch=2):
+    """Streams fingerprints of a folder of unlabelled .wavs in batches.
 
-      label_index = self.word_to_index['left']
-      labels[i - offset, label_index] = 1
-    return data, labels
+    The folder is listed once (or its manifest read, see `list_audio_files`)
+    and the clips are decoded in batches on a thread pool ahead of the
+    consumer, so the whole set is never held in memory. The clips have no
+    labels, so none are returned.
+
+    Args:
+      test_path: Directory holding the .wavs.
+      batch_size: How many clips go in each batch.
+      model_settings: Information about the current model being trained.
+      sess: TensorFlow session that was active when processor was created.
+      features: Which features to compute, 'raw', 'spectrogram' or 'mfcc'.
+      manifest_path: Optional listing of the folder to read or write.
+      prefetch: How many batches to decode ahead.
+
+    Yields:
+      Tuples of fingerprints in the configured fingerprint type, and the list
+      of file names (relative to `test_path`) they were computed from. The
+      fingerprint arrays are reused, so copy them to keep them past the next
+      batch.
+    """
+    file_names = list_audio_files(test_path, manifest_path)
+    out_dtype = fingerprint_dtype(model_settings, features)
+
+    def load_fn(batch_names):
+      return self.process_files(
+          [os.path.join(test_path, name) for name in batch_names],
+          model_settings, sess, features)
+
+    for data, batch_names in iterate_batches(file_names, batch_size, load_fn,
+                                             prefetch):
+      yield convert_fingerprints(
+          data, self.batch_buffers.get('test_data', data.shape,
+                                       out_dtype)), batch_names
 
   def get_unprocessed_data(self, how_many, model_settings, mode):
     """Retrieve sample data for the given partition, with no transformations.
@@ -683,7 +1710,6 @@ class AudioProcessor(object):
     desired_samples = model_settings['desired_samples']
     words_list = self.words_list
     data = np.zeros((sample_count, desired_samples))
-    labels = []
     with tf.Session(graph=tf.Graph()) as sess:
       wav_filename_placeholder = tf.placeholder(tf.string, [])
       wav_loader = io_ops.read_file(wav_filename_placeholder)
@@ -692,22 +1718,25 @@ class AudioProcessor(object):
       foreground_volume_placeholder = tf.placeholder(tf.float32, [])
       scaled_foreground = tf.multiply(wav_decoder.audio,
                                       foreground_volume_placeholder)
-      for i in range(sample_count):
-        if how_many == -1:
-          sample_index = i
-        else:
-          sample_index = np.random.randint(len(candidates))
-        sample = candidates[sample_index]
-        input_dict = {wav_filename_placeholder: sample['file']}
-        if sample['label'] == SILENCE_LABEL:
-          input_dict[foreground_volume_placeholder] = 0
+      if how_many == -1:
+        sample_indices = np.arange(sample_count)
+      else:
+        sample_indices = np.random.randint(len(candidates), size=sample_count)
+      wav_files = candidates.files(sample_indices)
+      for i, sample_index in enumerate(sample_indices):
+        # Silence samples are left as zeros, without reading anything.
+        if candidates.is_silence[sample_index]:
+          continue
+        input_dict = {foreground_volume_placeholder: 1}
+        if self.clip_store is not None:
+          input_dict[wav_decoder.audio] = self.get_clip(wav_files[i])
         else:
-          input_dict[foreground_volume_placeholder] = 1
+          input_dict[wav_filename_placeholder] = wav_files[i]
 
         sc_f = sess.run(scaled_foreground, feed_dict=input_dict).flatten()
         # print(tf.shape(sc_f))
         data[i, :] = sc_f.flatten()
 
-        label_index = self.word_to_index[sample['label']]
-        labels.append(words_list[label_index])
+      labels = [words_list[label_index]
+                for label_index in candidates.label_ids[sample_indices]]
     return data, labels
@@ -58,8 +58,37 @@ class InputDataTest(test.TestCase):
         "window_size_samples": 100,
         "window_stride_samples": 100,
         "dct_coefficient_count": 40,
+        "sample_rate": 16000,
     }
 
+  def _processorSettings(self, features="mfcc"):
+    # Everything AudioProcessor reads, derived the way train.py does it.
+    config_path = os.path.join(self.get_temp_dir(), "processor.config")
+    with open(config_path, "w") as f:
+      f.write("\n".join([
+          "[vocabulary]",
+          "wanted_words = a,b",
+          "[data-processing-parameters]",
+          "features = " + features,
+          "fft_window_size = 128",
+          "background_volume = 0.1",
+          "background_frequency = 0.3",
+          "silence_percentage = 10.0",
+          "unknown_percentage = 10.0",
+          "time_shift_ms = 1.0",
+          "validation_percentage = 10",
+          "sample_rate = 16000",
+          "clip_duration_ms = 10",
+          "window_size_ms = 6",
+          "window_stride_ms = 6",
+          "dct_coefficient_count = 40",
+          "[train-parameters]",
+          "how_many_training_steps = 10",
+          "learning_rate = 0.001",
+          "batch_size = 4",
+      ]) + "\n")
+    return input_data.prepare_model_settings(config_path)
+
   def testPrepareWordsList(self):
     words_list = ["a", "b"]
     self.assertGreater(
@@ -101,6 +130,63 @@ class InputDataTest(test.TestCase):
                                     10, self._model_settings())
     self.assertTrue("Expected to find" in str(e.exception))
 
+  def testScanDataDir(self):
+    tmp_dir = os.path.join(self.get_temp_dir(), "scan_data_dir")
+    os.mkdir(tmp_dir)
+    self._saveWavFolders(tmp_dir, ["a", "b", "_background_noise_"], 3)
+    manifest_path = os.path.join(tmp_dir, "manifest.json")
+    wav_files = input_data.scan_data_dir(tmp_dir, 10, manifest_path)
+    self.assertEqual(6, len(wav_files))
+    self.assertEqual(sorted(wav_files), wav_files)
+    self.assertTrue(os.path.exists(manifest_path))
+    wav_path, word, set_index, size, mtime = wav_files[0]
+    self.assertEqual("a", word)
+    self.assertEqual(input_data.which_set(wav_path, 10), set_index)
+    self.assertEqual(os.path.getsize(wav_path), size)
+    self.assertEqual(os.path.getmtime(wav_path), mtime)
+    self.assertEqual(wav_files,
+                     input_data.scan_data_dir(tmp_dir, 10, manifest_path))
+    new_file = os.path.join(tmp_dir, "b", "other_audio.wav")
+    self._saveTestWavFile(new_file, self._getWavData())
+    os.utime(os.path.join(tmp_dir, "b"), (0, 0))
+    wav_files = input_data.scan_data_dir(tmp_dir, 10, manifest_path)
+    self.assertEqual(7, len(wav_files))
+    self.assertTrue(new_file in [wav_file[0] for wav_file in wav_files])
+
+  def testListAudioFiles(self):
+    tmp_dir = os.path.join(self.get_temp_dir(), "list_audio_files")
+    os.mkdir(tmp_dir)
+    for name in ["b.wav", "a.wav", "notes.txt"]:
+      self._saveTestWavFile(os.path.join(tmp_dir, name), self._getWavData())
+    manifest_path = os.path.join(self.get_temp_dir(), "test_files.txt")
+    self.assertEqual(["a.wav", "b.wav"],
+                     input_data.list_audio_files(tmp_dir, manifest_path))
+    os.remove(os.path.join(tmp_dir, "b.wav"))
+    self.assertEqual(["a.wav", "b.wav"],
+                     input_data.list_audio_files(tmp_dir, manifest_path))
+    self.assertEqual(["a.wav"], input_data.list_audio_files(tmp_dir))
+
+  def testIterateBatches(self):
+    batches = list(input_data.iterate_batches(
+        list(range(7)), 3, lambda items: [item * 2 for item in items]))
+    self.assertEqual([([0, 2, 4], [0, 1, 2]), ([6, 8, 10], [3, 4, 5]),
+                      ([12], [6])], batches)
+
+  def testDataPartition(self):
+    word_to_index = {"a": 2, "c": input_data.UNKNOWN_WORD_INDEX,
+                     input_data.SILENCE_LABEL: input_data.SILENCE_INDEX}
+    partition = input_data.DataPartition(
+        [("a", "a/0.wav"), (input_data.SILENCE_LABEL, None),
+         ("c", "c/1.wav")], word_to_index)
+    self.assertEqual(3, len(partition))
+    self.assertEqual(2, len(partition.paths))
+    self.assertEqual(["a/0.wav", "", "c/1.wav"], partition.files())
+    self.assertAllEqual([2, input_data.SILENCE_INDEX,
+                         input_data.UNKNOWN_WORD_INDEX], partition.label_ids)
+    self.assertAllEqual([False, True, False], partition.is_silence)
+    self.assertEqual(["c/1.wav", "a/0.wav"], partition.files([2, 0]))
+    self.assertEqual({"label": "c", "file": "c/1.wav"}, partition[2])
+
   def testPrepareBackgroundData(self):
     tmp_dir = self.get_temp_dir()
     background_dir = os.path.join(tmp_dir, "_background_noise_")
@@ -114,6 +200,24 @@ class InputDataTest(test.TestCase):
                                                 10, 10, self._model_settings())
     self.assertEqual(10, len(audio_processor.background_data))
 
+  def testPackNoiseBank(self):
+    tmp_dir = self.get_temp_dir()
+    wav_paths = []
+    for i in range(2):
+      file_path = os.path.join(tmp_dir, "noise_bank_%d.wav" % i)
+      self._saveTestWavFile(file_path, self._getWavData())
+      wav_paths.append(file_path)
+    bank_dir = os.path.join(tmp_dir, "noise_bank")
+    input_data.pack_noise_bank(bank_dir, wav_paths)
+    bank, index = input_data.load_noise_bank(bank_dir)
+    self.assertEqual(wav_paths, index["files"])
+    self.assertEqual([0, 1000], index["starts"])
+    self.assertEqual([1000, 1000], index["lengths"])
+    self.assertEqual((2000,), bank.shape)
+    self.assertEqual(np.float32, bank.dtype)
+    self.assertEqual((None, None),
+                     input_data.load_noise_bank(os.path.join(tmp_dir, "none")))
+
   def testLoadWavFile(self):
     tmp_dir = self.get_temp_dir()
     file_path = os.path.join(tmp_dir, "load_test.wav")
@@ -149,6 +253,7 @@ class InputDataTest(test.TestCase):
         "window_size_samples": 100,
         "window_stride_samples": 100,
         "dct_coefficient_count": 40,
+        "sample_rate": 16000,
     }
     audio_processor = input_data.AudioProcessor("", wav_dir, 10, 10, ["a", "b"],
                                                 10, 10, model_settings)
@@ -159,6 +264,30 @@ class InputDataTest(test.TestCase):
     self.assertIsNotNone(audio_processor.background_data_placeholder_)
     self.assertIsNotNone(audio_processor.background_volume_placeholder_)
     self.assertIsNotNone(audio_processor.mfcc_)
+    self.assertIsNotNone(audio_processor.batch_foreground_data_)
+    self.assertIsNotNone(audio_processor.batch_time_shift_placeholder_)
+    self.assertIsNotNone(audio_processor.batch_background_data_placeholder_)
+    self.assertIsNotNone(audio_processor.batch_mfcc_)
+
+  def testTimeShiftBatch(self):
+    with self.test_session() as sess:
+      audio = tf.constant([[1.0, 2.0, 3.0, 4.0], [1.0, 2.0, 3.0, 4.0]])
+      shifted = input_data.time_shift_batch(audio, tf.constant([1, -2]))
+      self.assertAllEqual([[0.0, 1.0, 2.0, 3.0], [3.0, 4.0, 0.0, 0.0]],
+                          sess.run(shifted))
+
+  def testExpandAndAverageCopies(self):
+    self.assertEqual([0, -1600, 1600],
+                     input_data.parse_time_shifts("0,-100,100", 16000))
+    with self.test_session() as sess:
+      audio = tf.constant([[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]])
+      copies = input_data.expand_copies(audio, [0, 1])
+      self.assertAllEqual([[1.0, 2.0, 3.0], [0.0, 1.0, 2.0],
+                           [4.0, 5.0, 6.0], [0.0, 4.0, 5.0]],
+                          sess.run(copies))
+      averaged = input_data.average_copies(
+          tf.constant([[1.0, 0.0], [0.0, 1.0], [1.0, 1.0], [3.0, 1.0]]), 2)
+      self.assertAllEqual([[0.5, 0.5], [2.0, 1.0]], sess.run(averaged))
 
   def testGetData(self):
     tmp_dir = self.get_temp_dir()
@@ -178,6 +307,7 @@ class InputDataTest(test.TestCase):
         "window_size_samples": 100,
         "window_stride_samples": 100,
         "dct_coefficient_count": 40,
+        "sample_rate": 16000,
     }
     audio_processor = input_data.AudioProcessor("", wav_dir, 10, 10, ["a", "b"],
                                                 10, 10, model_settings)
@@ -187,6 +317,154 @@ class InputDataTest(test.TestCase):
     self.assertEqual(10, len(result_data))
     self.assertEqual(10, len(result_labels))
 
+  def testIterateTestData(self):
+    tmp_dir = self.get_temp_dir()
+    wav_dir = os.path.join(tmp_dir, "wavs")
+    os.mkdir(wav_dir)
+    self._saveWavFolders(wav_dir, ["a", "b", "c"], 100)
+    test_dir = os.path.join(tmp_dir, "test")
+    os.mkdir(test_dir)
+    wav_data = self._getWavData()
+    for i in range(7):
+      self._saveTestWavFile(os.path.join(test_dir, "clip_%d.wav" % i),
+                            wav_data)
+    model_settings = self._processorSettings()
+    with self.test_session() as sess:
+      audio_processor = input_data.AudioProcessor(None, wav_dir,
+                                                  model_settings)
+      batches = [(np.array(data), names)
+                 for data, names in audio_processor.iterate_test_data(
+                     test_dir, 3, model_settings, sess)]
+      expected = audio_processor.process_files(
+          [os.path.join(test_dir, "clip_6.wav")], model_settings, sess)
+    self.assertEqual([["clip_0.wav", "clip_1.wav", "clip_2.wav"],
+                      ["clip_3.wav", "clip_4.wav", "clip_5.wav"],
+                      ["clip_6.wav"]], [names for _, names in batches])
+    fingerprint_size = model_settings["fingerprint_size"]
+    self.assertEqual([(3, fingerprint_size), (3, fingerprint_size),
+                      (1, fingerprint_size)],
+                     [data.shape for data, _ in batches])
+    self.assertAllClose(expected, batches[-1][0])
+
+  def testGetDatasetIterator(self):
+    tmp_dir = self.get_temp_dir()
+    wav_dir = os.path.join(tmp_dir, "wavs")
+    os.mkdir(wav_dir)
+    self._saveWavFolders(wav_dir, ["a", "b", "c"], 100)
+    background_dir = os.path.join(wav_dir, "_background_noise_")
+    os.mkdir(background_dir)
+    wav_data = self._getWavData()
+    for i in range(3):
+      self._saveTestWavFile(
+          os.path.join(background_dir, "background_audio_%d.wav" % i),
+          wav_data)
+    model_settings = self._processorSettings()
+    fingerprint_size = model_settings["fingerprint_size"]
+    with self.test_session() as sess:
+      audio_processor = input_data.AudioProcessor(None, wav_dir,
+                                                  model_settings)
+      noise_label_count = audio_processor.background_label_count() + 1
+      self.assertEqual(4, noise_label_count)
+      # Validation batches are the clips get_data returns, in order.
+      iterator, feed_dict = audio_processor.get_dataset_iterator(
+          4, model_settings, 0.0, 0.0, 0, "validation")
+      sess.run(iterator.initializer, feed_dict=feed_dict)
+      fingerprints, labels, noise_labels = sess.run(iterator.get_next())
+      expected = [np.array(values) for values in audio_processor.get_data(
+          4, 0, model_settings, 0.0, 0.0, 0, "validation", sess)[:3]]
+      self.assertEqual((4, fingerprint_size), fingerprints.shape)
+      self.assertAllClose(expected[0], fingerprints, atol=1e-4)
+      self.assertAllEqual(expected[1], labels)
+      self.assertAllEqual(expected[2], noise_labels)
+      # Training batches have one-hot labels and noise labels.
+      iterator, feed_dict = audio_processor.get_dataset_iterator(
+          8, model_settings, 0.5, 0.1, 16, "training")
+      sess.run(iterator.initializer, feed_dict=feed_dict)
+      fingerprints, labels, noise_labels = sess.run(iterator.get_next())
+    self.assertEqual((8, fingerprint_size), fingerprints.shape)
+    self.assertEqual((8, model_settings["label_count"]), labels.shape)
+    self.assertEqual((8, noise_label_count), noise_labels.shape)
+    self.assertAllEqual(np.ones(8), labels.sum(axis=1))
+    self.assertAllEqual(np.ones(8), noise_labels.sum(axis=1))
+
+  def testBatchBufferPool(self):
+    pool = input_data.BatchBufferPool(2)
+    first = pool.get("data", (3, 4), np.float32)
+    second = pool.get("data", (3, 4), np.float32)
+    self.assertFalse(first is second)
+    self.assertTrue(first is pool.get("data", (3, 4), np.float32))
+    self.assertFalse(first is pool.get("labels", (3, 4), np.float32))
+    self.assertEqual(np.int16, pool.get("data", (3, 4), np.int16).dtype)
+    unpooled = input_data.BatchBufferPool(0)
+    self.assertFalse(unpooled.get("data", (1,), np.float32) is
+                     unpooled.get("data", (1,), np.float32))
+
+  def testConvertFingerprints(self):
+    fingerprints = np.array([[-1.0, 0.5, 1.0]], dtype=np.float32)
+    self.assertAllEqual(
+        [[-32768, 16384, 32767]],
+        input_data.convert_fingerprints(fingerprints,
+                                        np.empty((1, 3), np.int16)))
+    self.assertAllEqual(
+        fingerprints,
+        input_data.convert_fingerprints(fingerprints,
+                                        np.empty((1, 3), np.float64)))
+    with self.assertRaises(Exception):
+      input_data.fingerprint_dtype({"fingerprint_dtype": "int16"}, "mfcc")
+    self.assertEqual(np.float32, input_data.fingerprint_dtype(
+        {"fingerprint_dtype": "float32"}, "mfcc"))
+
+  def testPackClipStore(self):
+    tmp_dir = self.get_temp_dir()
+    wav_dir = os.path.join(tmp_dir, "wavs")
+    os.mkdir(wav_dir)
+    self._saveWavFolders(wav_dir, ["a"], 3)
+    wav_paths = sorted(
+        os.path.join(wav_dir, "a", name)
+        for name in os.listdir(os.path.join(wav_dir, "a")))
+    store_dir = os.path.join(tmp_dir, "clip_store")
+    input_data.pack_clip_store(store_dir, wav_paths, ["a"] * 3, 1600)
+    clips, index = input_data.load_clip_store(store_dir)
+    self.assertEqual((3, 1600), clips.shape)
+    self.assertEqual(np.int16, clips.dtype)
+    self.assertEqual(16000, index["sample_rate"])
+    self.assertEqual(wav_paths, [clip["file"] for clip in index["clips"]])
+    loaded_data = input_data.load_wav_file(wav_paths[0])
+    self.assertAllClose(loaded_data, clips[0, :1000] / 32768.0)
+
+  def testClipStoreRepacksChangedFiles(self):
+    tmp_dir = self.get_temp_dir()
+    wav_dir = os.path.join(tmp_dir, "wavs")
+    os.mkdir(wav_dir)
+    self._saveWavFolders(wav_dir, ["a", "b", "c"], 10)
+    model_settings = self._processorSettings()
+    model_settings["clip_store_dir"] = os.path.join(tmp_dir, "clip_store")
+    with self.test_session(graph=tf.Graph()):
+      audio_processor = input_data.AudioProcessor(None, wav_dir,
+                                                  model_settings)
+    wav_path = audio_processor.data_index["training"].paths[0]
+    self.assertAllEqual(np.zeros((160, 1)), audio_processor.get_clip(wav_path))
+    entries = audio_processor.get_feature_cache_entries("training")
+    # Replace a clip, which changes its size, and mark its folder as changed.
+    with self.test_session(graph=tf.Graph()) as sess:
+      wav_data = sess.run(
+          contrib_audio.encode_wav(tf.fill([500, 1], 0.5), 16000))
+    self._saveTestWavFile(wav_path, wav_data)
+    os.utime(os.path.dirname(wav_path), (0, 0))
+    with self.test_session(graph=tf.Graph()):
+      audio_processor = input_data.AudioProcessor(None, wav_dir,
+                                                  model_settings)
+    self.assertAllClose(np.full((160, 1), 0.5),
+                        audio_processor.get_clip(wav_path))
+    new_entries = audio_processor.get_feature_cache_entries("training")
+    self.assertEqual(len(entries), len(new_entries))
+    self.assertNotEqual(entries, new_entries)
+
+  def testLoadClipStoreMissing(self):
+    clips, index = input_data.load_clip_store(self.get_temp_dir())
+    self.assertIsNone(clips)
+    self.assertIsNone(index)
+
   def testGetUnprocessedData(self):
     tmp_dir = self.get_temp_dir()
     wav_dir = os.path.join(tmp_dir, "wavs")
@@ -199,6 +477,7 @@ class InputDataTest(test.TestCase):
         "window_size_samples": 100,
         "window_stride_samples": 100,
         "dct_coefficient_count": 40,
+        "sample_rate": 16000,
     }
     audio_processor = input_data.AudioProcessor("", wav_dir, 10, 10, ["a", "b"],
                                                 10, 10, model_settings)
@@ -26,16 +26,30 @@ python tensorflow/examples/speech_commands/label_wav.py \
 --labels=/tmp/speech_commands_train/conv_labels.txt \
 --wav=/tmp/speech_dataset/left/a5d485dc_nohash_0.wav
 
+To label many files, pass a folder with --wav_dir or a file with one path per
+line with --wav_list instead of --wav. The graph is then loaded once, files are
+read and run on a thread pool sharing one session, and the top predictions of
+every file are written as TSV or JSON lines to --output (or stdout). With
+--result_cache_size or --result_cache_dir, files with the same contents as one
+labelled before aren't run again.
+
 """
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
 import argparse
+import json
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import os
 import sys
 
 import tensorflow as tf
 
+from result_cache import (ResultCache, file_identity, model_identity,
+                          predict_with_cache)
+
 # pylint: disable=unused-import
 from tensorflow.contrib.framework.python.ops import audio_ops as contrib_audio
 # pylint: enable=unused-import
@@ -56,6 +70,12 @@ def load_labels(filename):
   return [line.rstrip() for line in tf.gfile.GFile(filename)]
 
 
+def top_predictions(predictions, labels, num_top_predictions):
+  """Returns the (label, score) pairs of the best predictions, best first."""
+  top_k = predictions.argsort()[-num_top_predictions:][::-1]
+  return [(labels[node_id], float(predictions[node_id])) for node_id in top_k]
+
+
 def run_graph(wav_data, labels, input_layer_name, output_layer_name,
               num_top_predictions):
   """Runs the audio data through the graph and prints predictions."""
@@ -68,10 +88,8 @@ def run_graph(wav_data, labels, input_layer_name, output_layer_name,
     predictions, = sess.run(softmax_tensor, {input_layer_name: wav_data})
 
     # Sort to show labels in order of confidence
-    top_k = predictions.argsort()[-num_top_predictions:][::-1]
-    for node_id in top_k:
-      human_string = labels[node_id]
-      score = predictions[node_id]
+    for human_string, score in top_predictions(predictions, labels,
+                                               num_top_predictions):
       print('%s (score = %.5f)' % (human_string, score))
 
     return 0
@@ -99,10 +117,124 @@ def label_wav(wav, labels, graph, input_name, output_name, how_many_labels):
   run_graph(wav_data, labels_list, input_name, output_name, how_many_labels)
 
 
+def list_wavs(wav_dir=None, wav_list=None):
+  """Collects the files to label in batch mode.
+
+  Args:
+    wav_dir: Folder searched recursively for .wav files.
+    wav_list: Text file with one path per line.
+
+  Returns:
+    List of paths, sorted for a folder and in file order for a list.
+  """
+  if wav_list:
+    with tf.gfile.GFile(wav_list) as f:
+      return [line.strip() for line in f if line.strip()]
+  wavs = []
+  for dir_path, _, file_names in os.walk(wav_dir):
+    wavs.extend(os.path.join(dir_path, name) for name in file_names
+                if name.endswith('.wav'))
+  return sorted(wavs)
+
+
+def write_result(output_file, output_format, wav, predictions):
+  """Writes the top predictions of one file as a TSV or JSON line."""
+  if output_format == 'jsonl':
+    output_file.write(json.dumps({
+        'file': wav,
+        'predictions': [{'label': label, 'score': score}
+                        for label, score in predictions]
+    }) + '\n')
+  else:
+    output_file.write('\t'.join(
+        [wav] + ['%s\t%.5f' % (label, score)
+                 for label, score in predictions]) + '\n')
+
+
+def label_wavs(wavs, labels, graph, input_name, output_name, how_many_labels,
+               output_file, output_format='tsv', num_threads=None, cache=None):
+  """Labels many files with one loaded graph and session.
+
+  Every file is read and run through the graph on a thread pool, and the
+  results are written in input order as they come in.
+
+  Args:
+    wavs: List of .wav paths.
+    labels: Path of the labels file.
+    graph: Path of the frozen graph.
+    input_name: Name of the WAVE data input tensor.
+    output_name: Name of the output probabilities tensor.
+    how_many_labels: How many of the best labels to write per file.
+    output_file: File object the results are written to.
+    output_format: 'tsv' or 'jsonl'.
+    num_threads: How many files are in flight at once, defaults to the
+      number of CPUs.
+    cache: Optional `ResultCache` for the graph.
+
+  Returns:
+    How many files were labelled.
+  """
+  if not labels or not tf.gfile.Exists(labels):
+    tf.logging.fatal('Labels file does not exist %s', labels)
+
+  if not graph or not tf.gfile.Exists(graph):
+    tf.logging.fatal('Graph file does not exist %s', graph)
+
+  labels_list = load_labels(labels)
+  with tf.Graph().as_default() as model_graph:
+    load_graph(graph)
+  with tf.Session(graph=model_graph) as sess:
+    softmax_tensor = model_graph.get_tensor_by_name(output_name)
+
+    def run_one(wav_datas):
+      return sess.run(softmax_tensor, {input_name: wav_datas[0]})
+
+    def label_one(wav):
+      with open(wav, 'rb') as wav_file:
+        wav_data = wav_file.read()
+      predictions, = predict_with_cache(cache, [wav_data], [wav_data],
+                                        run_one)
+      return wav, top_predictions(predictions, labels_list, how_many_labels)
+
+    pool = ThreadPool(num_threads or multiprocessing.cpu_count())
+    try:
+      count = 0
+      for wav, predictions in pool.imap(label_one, wavs):
+        write_result(output_file, output_format, wav, predictions)
+        count += 1
+    finally:
+      pool.close()
+      pool.join()
+  if cache is not None:
+    tf.logging.info('Result cache: %s', cache.stats())
+  return count
+
+
 def main(_):
   """Entry point for script, converts flags to arguments."""
-  label_wav(FLAGS.wav, FLAGS.labels, FLAGS.graph, FLAGS.input_name,
-            FLAGS.output_name, FLAGS.how_many_labels)
+  if FLAGS.wav_dir or FLAGS.wav_list:
+    wavs = list_wavs(FLAGS.wav_dir, FLAGS.wav_list)
+    if FLAGS.output:
+      output_file = open(FLAGS.output, 'w')
+    else:
+      output_file = sys.stdout
+    cache = None
+    if FLAGS.result_cache_size or FLAGS.result_cache_dir:
+      cache = ResultCache(
+          model_identity(file_identity(FLAGS.graph), FLAGS.input_name,
+                         FLAGS.output_name),
+          FLAGS.result_cache_size or 100000, FLAGS.result_cache_dir or None)
+    try:
+      count = label_wavs(wavs, FLAGS.labels, FLAGS.graph, FLAGS.input_name,
+                         FLAGS.output_name, FLAGS.how_many_labels, output_file,
+                         FLAGS.output_format, FLAGS.num_threads, cache)
+    finally:
+      if output_file is not sys.stdout:
+        output_file.close()
+    tf.logging.info('Labelled %d files', count)
+  else:
+    label_wav(FLAGS.wav, FLAGS.labels, FLAGS.graph, FLAGS.input_name,
+              FLAGS.output_name, FLAGS.how_many_labels)
 
 
 if __name__ == '__main__':
@@ -128,6 +260,46 @@ if __name__ == '__main__':
       type=int,
       default=3,
       help='Number of results to show.')
+  parser.add_argument(
+      '--wav_dir',
+      type=str,
+      default='',
+      help='Folder of audio files to label in batch mode.')
+  parser.add_argument(
+      '--wav_list',
+      type=str,
+      default='',
+      help='File listing audio files to label in batch mode, one per line.')
+  parser.add_argument(
+      '--output',
+      type=str,
+      default='',
+      help='Where batch mode writes its results, stdout if empty.')
+  parser.add_argument(
+      '--output_format',
+      type=str,
+      default='tsv',
+      choices=['tsv', 'jsonl'],
+      help='Format of the batch mode results.')
+  parser.add_argument(
+      '--num_threads',
+      type=int,
+      default=0,
+      help='Files labelled in parallel in batch mode, 0 for one per CPU.')
+
+  parser.add_argument(
+      '--result_cache_size',
+      type=int,
+      default=0,
+      help="""\
+      How many results the batch mode keeps in memory to skip files with
+      contents seen before. 0 disables it unless --result_cache_dir is set.
+      """)
+  parser.add_argument(
+      '--result_cache_dir',
+      type=str,
+      default='',
+      help='Directory the result cache also keeps its results in.')
 
   FLAGS, unparsed = parser.parse_known_args()
   tf.app.run(main=main, argv=[sys.argv[0]] + unparsed)
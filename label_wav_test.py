@@ -59,6 +59,36 @@ class LabelWavTest(test.TestCase):
     label_wav.label_wav(wav_filename, labels_filename, graph_filename,
                         input_name + ":0", output_name + ":0", 3)
 
+  def testLabelWavs(self):
+    tmp_dir = os.path.join(self.get_temp_dir(), "label_wavs")
+    os.mkdir(tmp_dir)
+    wav_data = self._getWavData()
+    for name in ["b.wav", "a.wav"]:
+      self._saveTestWavFile(os.path.join(tmp_dir, name), wav_data)
+    input_name = "test_input"
+    output_name = "test_output"
+    graph_filename = os.path.join(self.get_temp_dir(), "test_graph.pb")
+    with tf.Session(graph=tf.Graph()) as sess:
+      tf.placeholder(tf.string, name=input_name)
+      tf.constant([[0.1, 0.7, 0.2]], name=output_name)
+      with open(graph_filename, "wb") as f:
+        f.write(sess.graph.as_graph_def().SerializeToString())
+    labels_filename = os.path.join(self.get_temp_dir(), "test_labels.txt")
+    with open(labels_filename, "w") as f:
+      f.write("a\nb\nc\n")
+    wavs = label_wav.list_wavs(wav_dir=tmp_dir)
+    self.assertEqual([os.path.join(tmp_dir, "a.wav"),
+                      os.path.join(tmp_dir, "b.wav")], wavs)
+    output_filename = os.path.join(self.get_temp_dir(), "labels.tsv")
+    with open(output_filename, "w") as output_file:
+      self.assertEqual(2, label_wav.label_wavs(
+          wavs, labels_filename, graph_filename, input_name + ":0",
+          output_name + ":0", 2, output_file, num_threads=2))
+    with open(output_filename) as f:
+      lines = f.read().splitlines()
+    self.assertEqual(wavs[0] + "\tb\t0.70000\tc\t0.20000", lines[0])
+    self.assertEqual(2, len(lines))
+
 
 if __name__ == "__main__":
   test.main()
@@ -0,0 +1,59 @@
+# Copyright 2017 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Per-label precision, recall and F1 tables from confusion matrices.
+
+`train.py` writes the table of the final validation run to `<arch>_metric.csv`,
+and other tools build the same table to compare models on equal terms.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import pandas as pd
+
+METRIC_COLUMNS = ['precision', 'recall', 'F1_score']
+
+
+def confusion_matrix(truth, predictions, label_count):
+  """Counts the predictions of every label, rows are the true labels."""
+  return np.bincount(
+      np.asarray(truth) * label_count + np.asarray(predictions),
+      minlength=label_count * label_count).reshape((label_count, label_count))
+
+
+def label_metrics(conf_matrix, labels):
+  """Computes the precision, recall and F1 score of every label.
+
+  Args:
+    conf_matrix: Confusion matrix with the true labels as rows.
+    labels: Names of the labels, in the order of the matrix.
+
+  Returns:
+    DataFrame indexed by label, with the `METRIC_COLUMNS`.
+  """
+  true_positives = np.diag(conf_matrix)
+  false_positives = np.sum(conf_matrix, axis=0) - true_positives
+  false_negatives = np.sum(conf_matrix, axis=1) - true_positives
+  precision = (true_positives / (true_positives + false_positives)).squeeze()
+  recall = (true_positives / (true_positives + false_negatives)).squeeze()
+  F1_score = (2 * (precision * recall) / (precision + recall)).squeeze()
+  final_statistics = np.stack([precision, recall, F1_score], axis=1)
+  return pd.DataFrame(final_statistics, index=labels, columns=METRIC_COLUMNS)
+
+
+def save_label_metrics(stat_df, path):
+  """Writes a table from `label_metrics` as tab separated values."""
+  stat_df.to_csv(path, index=True, header=True, sep='\t')
@@ -0,0 +1,43 @@
+# Copyright 2017 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for the per-label metric tables."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+from tensorflow.examples.speech_commands import metrics
+from tensorflow.python.platform import test
+
+
+class MetricsTest(test.TestCase):
+
+  def testLabelMetrics(self):
+    conf_matrix = metrics.confusion_matrix([0, 0, 1, 1, 2], [0, 1, 1, 1, 2], 3)
+    self.assertAllEqual([[1, 1, 0], [0, 2, 0], [0, 0, 1]], conf_matrix)
+    stat_df = metrics.label_metrics(conf_matrix, ["a", "b", "c"])
+    self.assertEqual(["a", "b", "c"], list(stat_df.index))
+    self.assertAllClose([1.0, 0.5, 2.0 / 3.0], stat_df.loc["a"].values)
+    self.assertAllClose([2.0 / 3.0, 1.0, 0.8], stat_df.loc["b"].values)
+    path = os.path.join(self.get_temp_dir(), "metric.csv")
+    metrics.save_label_metrics(stat_df, path)
+    with open(path) as f:
+      self.assertEqual("\tprecision\trecall\tF1_score", f.readline().rstrip())
+
+
+if __name__ == "__main__":
+  test.main()
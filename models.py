@@ -29,14 +29,36 @@ import tensorflow.contrib.slim as slim
 
 
 class Graph(object):
-    def __init__(self, model_settings):
+    def __init__(self, model_settings, inputs=None, inference_only=False):
+        """Builds the model, its loss and its training ops.
+
+        Args:
+          model_settings: Dictionary of information about the model.
+          inputs: Optional tuple of fingerprint, one-hot label and one-hot
+            noise label tensors, e.g. the output of an input pipeline iterator.
+            When given, the model reads from them unless the matching
+            placeholders are fed.
+          inference_only: Build only the forward pass, for freezing and
+            serving. There are no label placeholders, loss or training ops,
+            `is_training` and `dropout_prob` are constants so the training
+            branches of the model can be pruned, and only the first entry of
+            `inputs` is used, directly.
+        """
         self.model_settings = model_settings
         self.model_architecture = self.model_settings['arch']
-        self.prepare_placeholders()
+        self.inference_only = inference_only
+        self.prepare_placeholders(inputs)
+        existing_variables = set(tf.global_variables())
         output = self.create_model()
-        self.add_optimizer(output)
+        # Everything the forward pass needs, without the optimizer's slots.
+        self.model_variables = [v for v in tf.global_variables()
+                                if v not in existing_variables]
+        if inference_only:
+            self.add_inference_outputs(output)
+        else:
+            self.add_optimizer(output)
 
-    def prepare_placeholders(self):
+    def prepare_placeholders(self, inputs=None):
         if self.model_settings['features'] == 'mfcc':
           self.input_frequency_size = int(self.model_settings['dct_coefficient_count'])
         else:
@@ -44,14 +66,37 @@ class Graph(object):
         self.input_time_size = self.model_settings['spectrogram_length']
 
         self.fingerprint_size = self.model_settings['fingerprint_size']
-        self.fingerprint_input = tf.placeholder(
-            tf.float32, [None, self.fingerprint_size], name='fingerprint_input')
+        # Raw audio can be fed as int16 PCM, which is scaled back to floats
+        # here rather than in numpy.
+        int16_input = self.model_settings.get('fingerprint_dtype') == 'int16'
+        input_dtype = tf.int16 if int16_input else tf.float32
+        if self.inference_only and inputs is not None:
+            self.fingerprint_input = inputs[0]
+            int16_input = False
+        elif inputs is None:
+            self.fingerprint_input = tf.placeholder(
+                input_dtype, [None, self.fingerprint_size], name='fingerprint_input')
+        else:
+            default_input = inputs[0]
+            if int16_input:
+                default_input = tf.cast(tf.clip_by_value(
+                    tf.round(default_input * 32768.0), -32768.0, 32767.0), tf.int16)
+            self.fingerprint_input = tf.placeholder_with_default(
+                default_input, [None, self.fingerprint_size], name='fingerprint_input')
+        if int16_input:
+            self.fingerprints = tf.cast(self.fingerprint_input, tf.float32) / 32768.0
+        else:
+            self.fingerprints = self.fingerprint_input
 
-        self.fingerprint_4d = tf.reshape(self.fingerprint_input,
+        self.fingerprint_4d = tf.reshape(self.fingerprints,
                                          [-1, self.input_time_size, self.input_frequency_size, 1])
 
-        self.is_training = tf.placeholder(tf.bool, name='is_training')
-        self.dropout_prob = tf.placeholder(tf.float32, name='dropout_prob')
+        if self.inference_only:
+            self.is_training = tf.constant(False, name='is_training')
+            self.dropout_prob = tf.constant(1.0, name='dropout_prob')
+        else:
+            self.is_training = tf.placeholder(tf.bool, name='is_training')
+            self.dropout_prob = tf.placeholder(tf.float32, name='dropout_prob')
 
 
         self.w = {}
@@ -61,11 +106,24 @@ class Graph(object):
 
         if self.is_adversarial():
             self.noise_label_count = self.model_settings['noise_label_count']
-            self.noise_labels = tf.placeholder(
-                tf.float32, [None, self.noise_label_count], name='adversarial_groundtruth_input')
 
-        self.ground_truth_input = tf.placeholder(
-            tf.float32, [None, self.label_count], name='groundtruth_input')
+        if self.inference_only:
+            return
+
+        if self.is_adversarial():
+            if inputs is None:
+                self.noise_labels = tf.placeholder(
+                    tf.float32, [None, self.noise_label_count], name='adversarial_groundtruth_input')
+            else:
+                self.noise_labels = tf.placeholder_with_default(
+                    inputs[2], [None, self.noise_label_count], name='adversarial_groundtruth_input')
+
+        if inputs is None:
+            self.ground_truth_input = tf.placeholder(
+                tf.float32, [None, self.label_count], name='groundtruth_input')
+        else:
+            self.ground_truth_input = tf.placeholder_with_default(
+                inputs[1], [None, self.label_count], name='groundtruth_input')
 
 
     def create_model(self, runtime_settings=None):
@@ -149,9 +207,9 @@ class Graph(object):
         self.probabilities = tf.nn.softmax(net_output)
         if self.is_adversarial():
             with tf.name_scope('target_cross_entropy'):
-                self.cross_entropy_mean = tf.reduce_mean(
-                    tf.nn.softmax_cross_entropy_with_logits(
-                        labels=self.ground_truth_input, logits=net_output[0]))
+                self.cross_entropy = tf.nn.softmax_cross_entropy_with_logits(
+                    labels=self.ground_truth_input, logits=net_output[0])
+                self.cross_entropy_mean = tf.reduce_mean(self.cross_entropy)
             tf.summary.scalar('target_cross_entropy', self.cross_entropy_mean)
             with tf.name_scope('target_train'), tf.control_dependencies(control_dependencies):
                 self.learning_rate_input = tf.placeholder(
@@ -191,9 +249,10 @@ class Graph(object):
 
         else:
             with tf.name_scope('cross_entropy'):
-                self.cross_entropy_mean = tf.reduce_mean(
-                    tf.nn.softmax_cross_entropy_with_logits(
-                        labels=self.ground_truth_input, logits=net_output))
+                # Per-sample losses, fed back to loss-driven samplers.
+                self.cross_entropy = tf.nn.softmax_cross_entropy_with_logits(
+                    labels=self.ground_truth_input, logits=net_output)
+                self.cross_entropy_mean = tf.reduce_mean(self.cross_entropy)
             tf.summary.scalar('cross_entropy', self.cross_entropy_mean)
             with tf.name_scope('train'), tf.control_dependencies(control_dependencies):
                 self.learning_rate_input = tf.placeholder(
@@ -212,17 +271,34 @@ class Graph(object):
                                                         num_classes=self.label_count)
             self.evaluation_step = tf.reduce_mean(tf.cast(self.correct_prediction, tf.float32))
 
+    def add_inference_outputs(self, net_output):
+        """Adds the softmax and prediction outputs, without any training ops."""
+        if self.is_adversarial():
+            net_output = net_output[0]
+        self.final_fc = net_output
+        self.probabilities = tf.nn.softmax(net_output, name='labels_softmax')
+        self.predicted_indices = tf.argmax(net_output, 1)
+
     def get_arch_name(self):
       return self.model_architecture
 
-    def load_variables_from_checkpoint(self, sess, start_checkpoint):
+    def load_variables_from_checkpoint(self, sess, start_checkpoint, scope=None):
       """Utility function to centralize checkpoint restoration.
 
       Args:
         sess: TensorFlow session.
         start_checkpoint: Path to saved checkpoint on disk.
+        scope: Variable scope the model was built in, e.g. as an ensemble
+          member. Its model variables are then restored from the unscoped
+          names they were trained under.
       """
-      saver = tf.train.Saver()
+      if scope is None:
+          saver = tf.train.Saver()
+      else:
+          prefix = scope + '/'
+          saver = tf.train.Saver(var_list=dict(
+              (v.op.name[len(prefix):], v) for v in self.model_variables
+              if v.op.name.startswith(prefix)))
       saver.restore(sess, start_checkpoint)
 
     def is_adversarial(self):
@@ -265,7 +341,7 @@ class Graph(object):
       weights = tf.Variable(
           tf.truncated_normal([fingerprint_size, self.label_count], stddev=0.001))
       bias = tf.Variable(tf.zeros([self.label_count]))
-      self.logits = tf.matmul(self.fingerprint_input, weights) + bias
+      self.logits = tf.matmul(self.fingerprints, weights) + bias
 
       return self.logits
 
@@ -1115,9 +1191,6 @@ class Graph(object):
         return final_fc
 
     def create_crnn_model(self):
-      if self.is_training is not None:
-        self.dropout_prob = tf.placeholder(tf.float32, name='dropout_prob')
-
       filter_width = int(self.model_settings['filter_width'])
       filter_height = int(self.model_settings['filter_height'])
       filter_count = int(self.model_settings['filter_count'])
@@ -1200,7 +1273,7 @@ class Graph(object):
       num_blocks = int(self.model_settings['number_of_wave_net_blocks'])
       filter_size = int(self.model_settings['filter_size'])
       dilation_rates = list(map(int, self.model_settings['dilation_rates'].split(',')))
-      fingerprint_3d = tf.expand_dims(self.fingerprint_input, -1)
+      fingerprint_3d = tf.expand_dims(self.fingerprints, -1)
 
       def res_block(input, filter_length, num_of_filters, rate, block):
         with tf.variable_scope(name_or_scope='block_%d_%d' % (block, rate)):
@@ -1273,7 +1346,7 @@ class Graph(object):
       num_blocks = int(self.model_settings['number_of_wave_net_blocks'])
       filter_size = int(self.model_settings['filter_size'])
       dilation_rates = list(map(int, self.model_settings['dilation_rates'].split(',')))
-      fingerprint_3d = tf.expand_dims(self.fingerprint_input, -1)
+      fingerprint_3d = tf.expand_dims(self.fingerprints, -1)
 
       def res_block(input, filter_length, num_of_filters, rate, block):
         with tf.variable_scope(name_or_scope='block_%d_%d' % (block, rate)):
@@ -1425,7 +1498,7 @@ class Graph(object):
       return final_fc
 
     def create_conv1d_model(self):
-      fingerprint_3d = tf.reshape(self.fingerprint_input,
+      fingerprint_3d = tf.reshape(self.fingerprints,
                                   [-1, self.fingerprint_size, 1])  # [batch, in_width, in_channels]
 
       # conv blocks
@@ -1449,7 +1522,7 @@ class Graph(object):
         return self.final_fc
 
     def create_residual_conv1d(self):
-      fingerprint_3d = tf.reshape(self.fingerprint_input,
+      fingerprint_3d = tf.reshape(self.fingerprints,
                                   [-1, self.fingerprint_size, 1])  # [batch, in_width, in_channels]
 
       block_1 = stacked_conv_pooling(fingerprint_3d, 80, 4, 48, 1, self.is_training, self.dropout_prob, 'block_1',
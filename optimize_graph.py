@@ -0,0 +1,742 @@
+# Copyright 2017 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+r"""Folds batch norms and constants out of frozen inference graphs.
+
+A graph frozen by `freeze.py` still runs every batch norm as its own
+per-channel multiply and add, next to the Identity nodes and dropout masks
+left over from training. `optimize_graph_def` rewrites it so that:
+
+  - Subgraphs that only depend on constants, like the batch norm moving
+    statistics turned into a scale and a shift, are evaluated once.
+  - Identity nodes, multiplications by one and dropout with a keep
+    probability of one are removed.
+  - A per-channel scale after a convolution or matrix multiplication is folded
+    into its weights, and the shifts around it are merged into one bias.
+  - A per-channel scale and shift in front of a 1x1 convolution or matrix
+    multiplication is folded into its weights and a bias after it. This is
+    what catches the wave_net batch norms, which follow a tanh and so can't be
+    folded into the convolution before them.
+
+Every rewrite is exact up to float rounding, and `check_equivalence` runs the
+original and the optimized graph side by side to make sure of it. Here's how
+to optimize a graph that is already frozen:
+
+python tensorflow/examples/speech_commands/optimize_graph.py \
+--input_file=/tmp/my_frozen_graph.pb \
+--output_file=/tmp/my_optimized_graph.pb
+
+`freeze.py --optimize` does the same while freezing.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import collections
+import io
+import os.path
+import sys
+import time
+import wave
+
+import numpy as np
+import tensorflow as tf
+
+from tensorflow.python.framework import graph_util
+from tensorflow.python.framework import tensor_util
+
+FLAGS = None
+
+# Ops that can't be evaluated ahead of time even if their inputs are constant.
+UNFOLDABLE_OPS = set(['Placeholder', 'PlaceholderWithDefault'])
+# Ops whose weights, input 1, can absorb a per-channel scale.
+LINEAR_OPS = set(['Conv2D', 'DepthwiseConv2dNative', 'MatMul'])
+BIAS_OPS = set(['Add', 'AddV2', 'BiasAdd'])
+FUSED_BATCH_NORM_OPS = set(
+    ['FusedBatchNorm', 'FusedBatchNormV2', 'FusedBatchNormV3'])
+# Ops that move values around without mixing the channels on the last axis.
+CHANNEL_PRESERVING_OPS = set(
+    ['Identity', 'Squeeze', 'ExpandDims', 'SpaceToBatchND', 'BatchToSpaceND'])
+
+
+def _node_name(input_name):
+  """Returns the node an input refers to, without '^' or an output index."""
+  if input_name.startswith('^'):
+    input_name = input_name[1:]
+  return input_name.split(':')[0]
+
+
+def _is_first_output(input_name):
+  return not input_name.startswith('^') and (
+      ':' not in input_name or input_name.endswith(':0'))
+
+
+def _set_tensor(node, value):
+  """Sets the value of a Const node, keeping its dtype."""
+  dtype = tf.as_dtype(node.attr['dtype'].type)
+  node.attr['value'].tensor.CopyFrom(
+      tensor_util.make_tensor_proto(np.asarray(value).astype(
+          dtype.as_numpy_dtype), dtype=dtype))
+
+
+def _const_node(name, value, dtype):
+  node = tf.NodeDef()
+  node.name = name
+  node.op = 'Const'
+  node.attr['dtype'].type = dtype.as_datatype_enum
+  _set_tensor(node, value)
+  return node
+
+
+def _make_identity(node, input_name):
+  """Turns a node into an Identity of one of its inputs."""
+  node.op = 'Identity'
+  del node.input[:]
+  node.input.append(input_name)
+  for key in list(node.attr.keys()):
+    if key != 'T':
+      del node.attr[key]
+
+
+class _GraphIndex(object):
+  """Nodes of a GraphDef being rewritten, with their consumers and ranks."""
+
+  def __init__(self, graph_def, output_node_names, protected_nodes):
+    self.graph_def = graph_def
+    self.output_node_names = output_node_names
+    self.protected = set(protected_nodes) | set(output_node_names)
+    self.nodes = collections.OrderedDict(
+        (node.name, node) for node in graph_def.node)
+    with tf.Graph().as_default() as graph:
+      tf.import_graph_def(graph_def, name='')
+    # Rewrites keep the shapes of the nodes they touch, so the ranks of the
+    # original nodes stay valid.
+    self.ranks = {}
+    for op in graph.get_operations():
+      if op.outputs:
+        self.ranks[op.name] = op.outputs[0].shape.ndims
+    self.reindex()
+
+  def reindex(self):
+    """Drops the nodes no output depends on and recomputes the consumers."""
+    reachable = set()
+    pending = [name for name in self.output_node_names if name in self.nodes]
+    while pending:
+      name = pending.pop()
+      if name in reachable:
+        continue
+      reachable.add(name)
+      pending.extend(_node_name(input_name)
+                     for input_name in self.nodes[name].input)
+    for name in list(self.nodes):
+      if name not in reachable and name not in self.protected:
+        del self.nodes[name]
+    self.consumers = collections.defaultdict(list)
+    for node in self.nodes.values():
+      for input_name in node.input:
+        self.consumers[_node_name(input_name)].append(node)
+
+  def add(self, node, rank=None):
+    self.nodes[node.name] = node
+    self.ranks[node.name] = rank
+
+  def only_consumer(self, name):
+    """Returns the single consumer of a node's first output, or None."""
+    consumers = self.consumers[name]
+    if len(consumers) != 1 or name in self.protected:
+      return None
+    if not all(_is_first_output(input_name) for input_name in consumers[0].input
+               if _node_name(input_name) == name):
+      return None
+    return consumers[0]
+
+  def unique_name(self, name):
+    """Returns `name`, with a suffix if a node of that name already exists."""
+    unique = name
+    index = 0
+    while unique in self.nodes:
+      index += 1
+      unique = '%s_%d' % (name, index)
+    return unique
+
+  def const(self, input_name):
+    """Returns the value of an input if it is a Const node, or None."""
+    node = self.nodes.get(_node_name(input_name))
+    if node is None or node.op != 'Const' or not _is_first_output(input_name):
+      return None
+    return tensor_util.MakeNdarray(node.attr['value'].tensor)
+
+  def per_channel(self, input_name, rank):
+    """Returns a constant input that only varies along the last axis."""
+    value = self.const(input_name)
+    if value is None or not np.issubdtype(value.dtype, np.floating):
+      return None
+    if value.ndim == 0:
+      return value
+    if rank is None or value.ndim > rank or any(
+        dim != 1 for dim in value.shape[:-1]):
+      return None
+    return value
+
+  def split_const(self, node, rank=None):
+    """Splits a binary node into its data input and per-channel constant."""
+    if len(node.input) != 2:
+      return None, None
+    if rank is None:
+      rank = self.ranks.get(node.name)
+    for data, const in ((0, 1), (1, 0)):
+      if node.op == 'BiasAdd' and data != 0:
+        continue
+      value = self.per_channel(node.input[const], rank)
+      if value is not None and self.const(node.input[data]) is None:
+        return node.input[data], value
+    return None, None
+
+  def replace_input(self, name, new_input):
+    """Points every consumer of a node's first output at another input."""
+    for node in self.consumers[name]:
+      for i, input_name in enumerate(node.input):
+        if input_name == '^' + name:
+          node.input[i] = '^' + _node_name(new_input)
+        elif input_name in (name, name + ':0'):
+          node.input[i] = new_input
+
+  def keeps_last_axis(self, node):
+    """Whether a channel preserving op leaves the last axis where it was."""
+    if node.op == 'Squeeze':
+      rank = self.ranks.get(_node_name(node.input[0]))
+      dims = list(node.attr['squeeze_dims'].list.i)
+      return rank is not None and bool(dims) and (rank - 1) not in [
+          dim % rank for dim in dims]
+    if node.op == 'ExpandDims':
+      rank = self.ranks.get(node.name)
+      axis = self.const(node.input[1])
+      return (rank is not None and axis is not None and
+              int(axis) % rank != rank - 1)
+    return True
+
+  def to_graph_def(self):
+    graph_def = tf.GraphDef()
+    graph_def.versions.CopyFrom(self.graph_def.versions)
+    graph_def.library.CopyFrom(self.graph_def.library)
+    graph_def.node.extend(self.nodes.values())
+    return graph_def
+
+
+def fold_constants(graph_def, output_node_names, protected_nodes=()):
+  """Evaluates every part of the graph that only depends on constants.
+
+  Args:
+    graph_def: Frozen GraphDef.
+    output_node_names: Nodes the graph is run for.
+    protected_nodes: Other nodes that have to stay addressable.
+
+  Returns:
+    GraphDef where every such part is a single Const node.
+  """
+  with tf.Graph().as_default() as graph:
+    tf.import_graph_def(graph_def, name='')
+  constant = set()
+  for op in graph.get_operations():
+    if op.type == 'Const':
+      constant.add(op.name)
+    elif (op.type not in UNFOLDABLE_OPS and not op.op_def.is_stateful and
+          op.inputs and len(op.outputs) == 1 and
+          all(tensor.op.name in constant for tensor in op.inputs) and
+          all(input_op.name in constant for input_op in op.control_inputs)):
+      constant.add(op.name)
+  keep = set(output_node_names) | set(protected_nodes)
+  folded = []
+  for op in graph.get_operations():
+    if op.name not in constant or op.type == 'Const':
+      continue
+    if op.name in keep or any(consumer.name not in constant
+                              for consumer in op.outputs[0].consumers()):
+      folded.append(op.name)
+  values = []
+  if folded:
+    with tf.Session(graph=graph) as sess:
+      values = sess.run([name + ':0' for name in folded])
+  folded_values = dict(zip(folded, values))
+  output_graph_def = tf.GraphDef()
+  output_graph_def.versions.CopyFrom(graph_def.versions)
+  output_graph_def.library.CopyFrom(graph_def.library)
+  for node in graph_def.node:
+    if node.name in folded_values:
+      output_graph_def.node.extend([_const_node(
+          node.name, folded_values[node.name],
+          graph.get_operation_by_name(node.name).outputs[0].dtype)])
+    else:
+      output_graph_def.node.extend([node])
+  return graph_util.extract_sub_graph(
+      output_graph_def, sorted(set(output_node_names) | (
+          set(protected_nodes) & set(node.name for node in graph_def.node))))
+
+
+def _remove_identity(graph, node):
+  if (node.op not in ('Identity', 'CheckNumerics') or
+      node.name in graph.protected or len(node.input) != 1):
+    return False
+  graph.replace_input(node.name, node.input[0])
+  del graph.nodes[node.name]
+  return True
+
+
+def _remove_trivial_arithmetic(graph, node):
+  """Removes multiplications and divisions by one and additions of zero."""
+  if node.op in ('Mul', 'RealDiv'):
+    neutral = 1.0
+  elif node.op in ('Add', 'AddV2', 'Sub', 'BiasAdd'):
+    neutral = 0.0
+  else:
+    return False
+  data, value = graph.split_const(node)
+  if data is None or np.any(value != neutral) or value.size != 1:
+    return False
+  # Dividing or subtracting by a constant only works one way round.
+  if node.op in ('RealDiv', 'Sub') and data != node.input[0]:
+    return False
+  _make_identity(node, data)
+  return True
+
+
+def _remove_dropout(graph, node):
+  """Replaces the mask of a dropout with a keep probability of one by one.
+
+  The mask is floor(keep_prob + uniform[0, 1)), which is always one when the
+  keep probability is, and the division by it is removed as trivial.
+  """
+  if node.op != 'Floor':
+    return False
+  add = graph.nodes.get(_node_name(node.input[0]))
+  if add is None or add.op not in ('Add', 'AddV2'):
+    return False
+  data, value = graph.split_const(add)
+  if data is None or value.size != 1 or float(value) != 1.0:
+    return False
+  random = graph.nodes.get(_node_name(data))
+  if random is None or random.op != 'RandomUniform':
+    return False
+  graph.nodes[node.name] = _const_node(node.name, np.ones([]),
+                                       tf.as_dtype(node.attr['T'].type))
+  return True
+
+
+def _decompose_fused_batch_norm(graph, node):
+  """Turns an inference-mode fused batch norm into a multiply and a bias."""
+  if (node.op not in FUSED_BATCH_NORM_OPS or
+      'is_training' not in node.attr or node.attr['is_training'].b or
+      node.attr['data_format'].s not in (b'', b'NHWC')):
+    return False
+  params = [graph.const(input_name) for input_name in node.input[1:5]]
+  if any(param is None for param in params):
+    return False
+  if any(not _is_first_output(input_name)
+         for consumer in graph.consumers[node.name]
+         for input_name in consumer.input
+         if _node_name(input_name) == node.name):
+    return False
+  scale, offset, mean, variance = [
+      param.astype(np.float64) for param in params]
+  scale = scale / np.sqrt(variance + node.attr['epsilon'].f)
+  dtype = tf.as_dtype(node.attr['T'].type)
+  rank = graph.ranks.get(node.name)
+  scale_node = _const_node(graph.unique_name(node.name + '/folded_scale'),
+                           scale, dtype)
+  graph.add(scale_node)
+  offset_node = _const_node(graph.unique_name(node.name + '/folded_offset'),
+                            offset - mean * scale, dtype)
+  graph.add(offset_node)
+  mul = tf.NodeDef()
+  mul.name = graph.unique_name(node.name + '/folded_mul')
+  mul.op = 'Mul'
+  mul.input.extend([node.input[0], scale_node.name])
+  mul.attr['T'].type = dtype.as_datatype_enum
+  graph.add(mul, rank)
+  bias = tf.NodeDef()
+  bias.name = node.name
+  bias.op = 'BiasAdd'
+  bias.input.extend([mul.name, offset_node.name])
+  bias.attr['T'].type = dtype.as_datatype_enum
+  bias.attr['data_format'].s = b'NHWC'
+  graph.nodes[node.name] = bias
+  return True
+
+
+def _linear_channels(graph, node):
+  """Returns the weights of a linear op and their output channel count."""
+  if node.op not in LINEAR_OPS:
+    return None, None
+  if node.op != 'MatMul' and node.attr['data_format'].s not in (b'', b'NHWC'):
+    return None, None
+  weights = graph.const(node.input[1])
+  if weights is None or graph.only_consumer(_node_name(node.input[1])) is None:
+    return None, None
+  if node.op == 'Conv2D':
+    return weights, weights.shape[3]
+  if node.op == 'DepthwiseConv2dNative':
+    return weights, weights.shape[2] * weights.shape[3]
+  return weights, weights.shape[0 if node.attr['transpose_b'].b else 1]
+
+
+def _fold_scale_into_weights(graph, node):
+  """Folds mul(linear(x), scale) into linear(x) with scaled weights.
+
+  Channel preserving ops and constant biases between the linear op and the
+  multiplication are allowed, and the biases are scaled as well.
+  """
+  if node.op != 'Mul':
+    return False
+  data, scale = graph.split_const(node)
+  if data is None:
+    return False
+  chain = []
+  current = graph.nodes.get(_node_name(data))
+  while current is not None and current.name not in graph.protected:
+    if graph.only_consumer(current.name) is not (
+        chain[-1] if chain else node):
+      return False
+    if current.op in LINEAR_OPS:
+      break
+    if current.op in CHANNEL_PRESERVING_OPS and graph.keeps_last_axis(current):
+      chain.append(current)
+      current = graph.nodes.get(_node_name(current.input[0]))
+    elif current.op in BIAS_OPS and graph.split_const(current)[0] is not None:
+      chain.append(current)
+      current = graph.nodes.get(_node_name(graph.split_const(current)[0]))
+    else:
+      return False
+  else:
+    return False
+  weights, channels = _linear_channels(graph, current)
+  if weights is None or scale.size not in (1, channels):
+    return False
+  biases = [link for link in chain if link.op in BIAS_OPS]
+  if any(graph.split_const(link)[1].size not in (1, channels)
+         for link in biases):
+    return False
+  scale = np.broadcast_to(scale.reshape(-1), [channels]).astype(np.float64)
+  if current.op == 'Conv2D':
+    weights = weights * scale
+  elif current.op == 'DepthwiseConv2dNative':
+    weights = weights * scale.reshape(weights.shape[2:])
+  elif current.attr['transpose_b'].b:
+    weights = weights * scale[:, np.newaxis]
+  else:
+    weights = weights * scale
+  _set_tensor(graph.nodes[_node_name(current.input[1])], weights)
+  for link in biases:
+    data_input, bias = graph.split_const(link)
+    const_input = [input_name for input_name in link.input
+                   if input_name != data_input][0]
+    bias = bias * scale
+    if link.op == 'BiasAdd':
+      bias = bias.reshape(-1)
+    const_node = graph.nodes[_node_name(const_input)]
+    if len(graph.consumers[const_node.name]) > 1:
+      const_node = _const_node(graph.unique_name(link.name + '/folded_bias'),
+                               bias,
+                               tf.as_dtype(const_node.attr['dtype'].type))
+      graph.add(const_node)
+      link.input[list(link.input).index(const_input)] = const_node.name
+    else:
+      _set_tensor(const_node, bias)
+  _make_identity(node, data)
+  return True
+
+
+def _fold_affine_into_next_layer(graph, node):
+  """Folds x * scale + shift into the 1x1 convolution or matmul it feeds.
+
+  Identity, squeeze, expand dims and means over other axes than the channels
+  are allowed in between, as they commute with a per-channel affine map.
+  """
+  if node.op != 'Mul' or node.name in graph.protected:
+    return False
+  source, scale = graph.split_const(node)
+  if source is None:
+    return False
+  end = node
+  shift = np.zeros([])
+  consumer = graph.only_consumer(node.name)
+  if consumer is not None and consumer.op in BIAS_OPS:
+    data, bias = graph.split_const(consumer)
+    if data is not None and _node_name(data) == node.name:
+      end = consumer
+      shift = bias
+  current = graph.only_consumer(end.name)
+  previous = end
+  while current is not None and current.op not in LINEAR_OPS:
+    if current.name in graph.protected or _node_name(
+        current.input[0]) != previous.name:
+      return False
+    if current.op == 'Mean':
+      rank = graph.ranks.get(previous.name)
+      axes = graph.const(current.input[1])
+      if rank is None or axes is None or (rank - 1) in [
+          int(axis) % rank for axis in np.reshape(axes, [-1])]:
+        return False
+    elif (current.op not in ('Identity', 'Squeeze', 'ExpandDims') or
+          not graph.keeps_last_axis(current)):
+      return False
+    previous = current
+    current = graph.only_consumer(current.name)
+  if (current is None or current.name in graph.protected or
+      _node_name(current.input[0]) != previous.name):
+    return False
+  weights, _ = _linear_channels(graph, current)
+  if weights is None:
+    return False
+  if current.op == 'Conv2D':
+    if weights.shape[:2] != (1, 1):
+      return False
+    matrix = weights[0, 0].astype(np.float64)
+  elif current.op == 'MatMul' and not current.attr['transpose_a'].b:
+    matrix = weights.astype(np.float64)
+    if current.attr['transpose_b'].b:
+      matrix = matrix.T
+  else:
+    return False
+  in_channels = matrix.shape[0]
+  if scale.size not in (1, in_channels) or shift.size not in (1, in_channels):
+    return False
+  scale = np.broadcast_to(scale.reshape(-1), [in_channels])
+  shift = np.broadcast_to(shift.reshape(-1), [in_channels])
+  bias = shift.dot(matrix)
+  matrix = matrix * scale[:, np.newaxis]
+  if current.op == 'Conv2D':
+    weights = matrix[np.newaxis, np.newaxis]
+  elif current.attr['transpose_b'].b:
+    weights = matrix.T
+  else:
+    weights = matrix
+  _set_tensor(graph.nodes[_node_name(current.input[1])], weights)
+  graph.replace_input(end.name, source)
+  if np.any(bias):
+    dtype = tf.as_dtype(current.attr['T'].type)
+    bias_node = tf.NodeDef()
+    bias_node.name = graph.unique_name(current.name + '/folded_bias')
+    bias_node.op = 'BiasAdd'
+    bias_node.input.extend([current.name,
+                            graph.unique_name(bias_node.name + '/bias')])
+    bias_node.attr['T'].type = dtype.as_datatype_enum
+    bias_node.attr['data_format'].s = b'NHWC'
+    graph.replace_input(current.name, bias_node.name)
+    graph.add(_const_node(bias_node.input[1], bias, dtype))
+    graph.add(bias_node, graph.ranks.get(current.name))
+  return True
+
+
+def _merge_biases(graph, node):
+  """Merges two constant biases added one after the other."""
+  if node.op not in BIAS_OPS or node.name in graph.protected:
+    return False
+  data, outer = graph.split_const(node)
+  if data is None:
+    return False
+  inner_node = graph.nodes.get(_node_name(data))
+  if (inner_node is None or inner_node.op not in BIAS_OPS or
+      graph.only_consumer(inner_node.name) is not node):
+    return False
+  inner_data, inner = graph.split_const(inner_node)
+  if inner_data is None:
+    return False
+  bias = inner.astype(np.float64) + outer
+  if node.op == 'BiasAdd':
+    bias = bias.reshape(-1)
+  dtype = tf.as_dtype(node.attr['T'].type)
+  const_node = _const_node(graph.unique_name(node.name + '/merged_bias'), bias,
+                           dtype)
+  graph.add(const_node)
+  del node.input[:]
+  node.input.extend([inner_data, const_node.name])
+  return True
+
+
+REWRITES = [
+    _remove_identity,
+    _remove_trivial_arithmetic,
+    _remove_dropout,
+    _decompose_fused_batch_norm,
+    _fold_scale_into_weights,
+    _fold_affine_into_next_layer,
+    _merge_biases,
+]
+
+
+def optimize_graph_def(graph_def, input_node_names, output_node_names):
+  """Folds batch norms, dropout and constants out of a frozen graph.
+
+  Args:
+    graph_def: Frozen GraphDef, e.g. from `freeze.freeze_graph_def`.
+    input_node_names: Nodes that are fed and have to be kept.
+    output_node_names: Nodes the graph is run for.
+
+  Returns:
+    The optimized GraphDef, computing the same outputs.
+  """
+  graph_def = fold_constants(graph_def, output_node_names, input_node_names)
+  graph = _GraphIndex(graph_def, output_node_names, input_node_names)
+  changed = True
+  while changed:
+    changed = False
+    for rewrite in REWRITES:
+      for node in list(graph.nodes.values()):
+        if graph.nodes.get(node.name) is node and rewrite(graph, node):
+          graph.reindex()
+          changed = True
+  optimized_graph_def = fold_constants(
+      graph.to_graph_def(), output_node_names, input_node_names)
+  tf.logging.info('Optimized graph from %d to %d nodes', len(graph_def.node),
+                  len(optimized_graph_def.node))
+  return optimized_graph_def
+
+
+def encode_wav(pcm, sample_rate):
+  """Encodes float samples in [-1.0, 1.0] as a 16-bit mono WAV file."""
+  pcm = np.clip(np.asarray(pcm), -1.0, 1.0)
+  wav_file = io.BytesIO()
+  writer = wave.open(wav_file, 'wb')
+  writer.setnchannels(1)
+  writer.setsampwidth(2)
+  writer.setframerate(int(sample_rate))
+  writer.writeframes((pcm * 32767).astype('<i2').tobytes())
+  writer.close()
+  return wav_file.getvalue()
+
+
+def synthetic_wav_feeds(graph_def, count=8, sample_rate=16000,
+                        clip_samples=16000, seed=0):
+  """Returns feed dicts with noise clips for a graph with a 'wav_data' input.
+
+  The clips range from near silence to full scale, so every batch norm sees
+  inputs far from its moving statistics.
+  """
+  random = np.random.RandomState(seed)
+  wavs = [encode_wav(random.randn(int(clip_samples)) * 2.0**-(i % 12),
+                     sample_rate) for i in range(count)]
+  wav_data = [node for node in graph_def.node if node.name == 'wav_data']
+  if not wav_data:
+    raise Exception('Graph has no wav_data input')
+  if len(wav_data[0].attr['shape'].shape.dim) == 1:
+    return [{'wav_data:0': wavs}]
+  return [{'wav_data:0': wav} for wav in wavs]
+
+
+def check_equivalence(graph_def, optimized_graph_def, feed_dicts,
+                      output_node_names, tolerance=1e-4):
+  """Runs two graphs on the same inputs and compares their outputs.
+
+  Args:
+    graph_def: The original GraphDef.
+    optimized_graph_def: The GraphDef from `optimize_graph_def`.
+    feed_dicts: List of feed dicts, keyed by tensor name.
+    output_node_names: Nodes to compare.
+    tolerance: Largest absolute difference allowed between the outputs.
+
+  Returns:
+    The largest absolute difference found.
+
+  Raises:
+    Exception: If the outputs differ by more than the tolerance.
+  """
+  results = []
+  for label, current_graph_def in (('original', graph_def),
+                                   ('optimized', optimized_graph_def)):
+    with tf.Graph().as_default() as graph:
+      tf.import_graph_def(current_graph_def, name='')
+      fetches = [name + ':0' for name in output_node_names]
+      with tf.Session(graph=graph) as sess:
+        sess.run(fetches, feed_dict=feed_dicts[0])
+        start = time.time()
+        results.append([sess.run(fetches, feed_dict=feed_dict)
+                        for feed_dict in feed_dicts])
+        tf.logging.info('%s graph: %.2fms per run', label,
+                        (time.time() - start) * 1000.0 / len(feed_dicts))
+  max_difference = 0.0
+  for original, optimized in zip(*results):
+    for original_output, optimized_output in zip(original, optimized):
+      max_difference = max(max_difference, float(np.max(np.abs(
+          np.asarray(original_output, np.float64) - optimized_output))))
+  if max_difference > tolerance:
+    raise Exception('Optimized graph differs from the original by %g, more '
+                    'than the tolerance of %g' % (max_difference, tolerance))
+  tf.logging.info('Optimized graph matches the original within %g',
+                  max_difference)
+  return max_difference
+
+
+def main(_):
+  tf.logging.set_verbosity(tf.logging.INFO)
+  graph_def = tf.GraphDef()
+  with tf.gfile.GFile(FLAGS.input_file, 'rb') as f:
+    graph_def.ParseFromString(f.read())
+  node_names = set(node.name for node in graph_def.node)
+  input_node_names = [name for name in FLAGS.input_names.split(',')
+                      if name in node_names]
+  output_node_names = FLAGS.output_names.split(',')
+  optimized_graph_def = optimize_graph_def(graph_def, input_node_names,
+                                           output_node_names)
+  check_equivalence(
+      graph_def, optimized_graph_def,
+      synthetic_wav_feeds(graph_def, FLAGS.check_clips, FLAGS.sample_rate,
+                          FLAGS.clip_samples), output_node_names,
+      FLAGS.tolerance)
+  tf.train.write_graph(
+      optimized_graph_def,
+      os.path.dirname(FLAGS.output_file),
+      os.path.basename(FLAGS.output_file),
+      as_text=False)
+  tf.logging.info('Saved optimized graph to %s', FLAGS.output_file)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--input_file', type=str, default='', help='Frozen graph to optimize.')
+  parser.add_argument(
+      '--output_file', type=str, help='Where to save the optimized graph.')
+  parser.add_argument(
+      '--input_names',
+      type=str,
+      default='wav_data,decoded_sample_data',
+      help='Nodes that are fed and must be kept, if they exist.')
+  parser.add_argument(
+      '--output_names',
+      type=str,
+      default='labels_softmax',
+      help='Nodes the graph is run for.')
+  parser.add_argument(
+      '--check_clips',
+      type=int,
+      default=8,
+      help='How many synthetic clips to compare the graphs on.')
+  parser.add_argument(
+      '--sample_rate',
+      type=int,
+      default=16000,
+      help='Sample rate of the synthetic clips.')
+  parser.add_argument(
+      '--clip_samples',
+      type=int,
+      default=16000,
+      help='Length of the synthetic clips in samples.')
+  parser.add_argument(
+      '--tolerance',
+      type=float,
+      default=1e-4,
+      help='Largest difference allowed between the outputs of the graphs.')
+  FLAGS, unparsed = parser.parse_known_args()
+  tf.app.run(main=main, argv=[sys.argv[0]] + unparsed)
@@ -0,0 +1,81 @@
+# Copyright 2017 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for the frozen graph optimizations."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+import tensorflow.contrib.slim as slim
+
+from tensorflow.examples.speech_commands import optimize_graph
+from tensorflow.python.framework import graph_util
+from tensorflow.python.platform import test
+
+
+class OptimizeGraphTest(test.TestCase):
+
+  def _freeze(self, sess):
+    sess.run(tf.global_variables_initializer())
+    # Move the batch norm statistics away from the identity transform.
+    random = np.random.RandomState(1)
+    for variable in tf.global_variables():
+      sess.run(variable.assign(
+          np.abs(random.randn(*variable.shape.as_list())) + 0.5))
+    return graph_util.convert_variables_to_constants(
+        sess, sess.graph_def, ["labels_softmax"])
+
+  def testFoldsBatchNorms(self):
+    with self.test_session(graph=tf.Graph()) as sess:
+      x = tf.placeholder(tf.float32, [None, 8, 3], name="x")
+      weights = tf.get_variable("w_filter", [3, 3, 4])
+      conv = tf.nn.convolution(x, weights, "SAME")
+      conv = slim.batch_norm(conv, is_training=False, scope="conv_bn")
+      pool = tf.reduce_mean(tf.tanh(conv), axis=1)
+      pool = slim.batch_norm(pool, is_training=False, scope="pool_bn")
+      final_weights = tf.get_variable("w_softmax", [4, 2])
+      tf.nn.softmax(tf.matmul(pool, final_weights), name="labels_softmax")
+      graph_def = self._freeze(sess)
+    optimized_graph_def = optimize_graph.optimize_graph_def(
+        graph_def, ["x"], ["labels_softmax"])
+    ops = [node.op for node in optimized_graph_def.node]
+    self.assertFalse("Mul" in ops)
+    self.assertFalse("Rsqrt" in ops)
+    self.assertFalse("Identity" in ops)
+    feed_dicts = [{"x:0": np.random.RandomState(2).randn(5, 8, 3)}]
+    self.assertLess(optimize_graph.check_equivalence(
+        graph_def, optimized_graph_def, feed_dicts, ["labels_softmax"]), 1e-4)
+    with self.assertRaises(Exception):
+      optimize_graph.check_equivalence(graph_def, graph_def, feed_dicts,
+                                       ["labels_softmax"], tolerance=-1.0)
+
+  def testRemovesDropout(self):
+    with self.test_session(graph=tf.Graph()) as sess:
+      x = tf.placeholder(tf.float32, [None, 3], name="x")
+      dropout_prob = tf.constant(1.0, name="dropout_prob")
+      weights = tf.get_variable("w_softmax", [3, 2])
+      tf.nn.softmax(tf.matmul(tf.nn.dropout(x, dropout_prob), weights),
+                    name="labels_softmax")
+      graph_def = self._freeze(sess)
+    optimized_graph_def = optimize_graph.optimize_graph_def(
+        graph_def, ["x"], ["labels_softmax"])
+    self.assertEqual(["Const", "MatMul", "Placeholder", "Softmax"],
+                     sorted(node.op for node in optimized_graph_def.node))
+
+
+if __name__ == "__main__":
+  test.main()
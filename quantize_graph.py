@@ -0,0 +1,618 @@
+# Copyright 2017 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+r"""Post-training 8-bit quantization of frozen models, with a comparison report.
+
+Takes a graph frozen by `freeze.py`, preferably with --optimize so that the
+batch norms are already folded into the weights, and rewrites the weights of
+its convolutions and matrix multiplications to 8 bits. There are two modes:
+
+  - weights: The weights are stored as int8 with a float scale per output
+    channel and turned back into floats when the graph is loaded. This makes
+    the graph about four times smaller and leaves the arithmetic in float.
+  - full: The layers run as QuantizedConv2D and QuantizedMatMul, with their
+    inputs quantized on the fly to a range calibrated beforehand. The ranges
+    come from running the float graph over a sample of the validation
+    partition, either the extremes seen (minmax) or percentiles of the values,
+    which ignore rare outliers and keep more resolution for the rest.
+
+Depthwise convolutions and layers smaller than --min_weights stay in float.
+
+Both graphs are then run clip by clip on the CPU over the validation clips not
+used for calibration, or another partition with --eval_partition, and the tool
+logs their size, latency per clip and accuracy. The precision, recall and F1
+score of every label are written for both graphs and their difference, in the
+same format as the `<arch>_metric.csv` of `train.py`.
+
+python tensorflow/examples/speech_commands/quantize_graph.py \
+--arch_config_file=model_configs/wave_net.config \
+--data_dir=/tmp/speech_dataset \
+--input_file=/tmp/my_frozen_graph.pb \
+--output_file=/tmp/my_quantized_graph.pb
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import collections
+import os.path
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+
+from input_data import AudioProcessor, prepare_model_settings
+from metrics import confusion_matrix, label_metrics, save_label_metrics
+from optimize_graph import encode_wav
+from tensorflow.python.framework import graph_util
+from tensorflow.python.framework import tensor_util
+
+FLAGS = None
+
+QUANTIZABLE_OPS = set(['Conv2D', 'MatMul'])
+QUANTIZATION_MODES = ['weights', 'full']
+CALIBRATION_METHODS = ['minmax', 'percentile']
+# How many values of every tensor and run are kept for percentile calibration.
+PERCENTILE_SAMPLES_PER_RUN = 4096
+OUTPUT_NODE_NAME = 'labels_softmax'
+
+
+def _node_name(input_name):
+  return input_name.lstrip('^').split(':')[0]
+
+
+def _tensor_name(input_name):
+  return input_name if ':' in input_name else input_name + ':0'
+
+
+def _const_node(name, value, dtype):
+  node = tf.NodeDef()
+  node.name = name
+  node.op = 'Const'
+  node.attr['dtype'].type = dtype.as_datatype_enum
+  node.attr['value'].tensor.CopyFrom(
+      tensor_util.make_tensor_proto(value, dtype=dtype))
+  return node
+
+
+def _op_node(name, op, inputs, **attrs):
+  """Creates a node, with dtype attributes given as tf.DType."""
+  node = tf.NodeDef()
+  node.name = name
+  node.op = op
+  node.input.extend(inputs)
+  for key, value in attrs.items():
+    if isinstance(value, tf.DType):
+      node.attr[key].type = value.as_datatype_enum
+    else:
+      node.attr[key].s = value
+  return node
+
+
+def load_graph_def(path):
+  graph_def = tf.GraphDef()
+  with tf.gfile.GFile(path, 'rb') as f:
+    graph_def.ParseFromString(f.read())
+  return graph_def
+
+
+def is_batched(graph_def):
+  """Whether the 'wav_data' input of a graph takes a vector of files."""
+  for node in graph_def.node:
+    if node.name == 'wav_data':
+      return len(node.attr['shape'].shape.dim) == 1
+  raise Exception('Graph has no wav_data input')
+
+
+def quantizable_nodes(graph_def, min_weights=1024):
+  """Returns the layers whose weights are worth quantizing.
+
+  Args:
+    graph_def: Frozen GraphDef.
+    min_weights: Layers with fewer weights than this stay in float.
+
+  Returns:
+    List of the Conv2D and MatMul nodes with constant float weights that the
+    quantized kernels support.
+  """
+  consts = dict(
+      (node.name, node) for node in graph_def.node if node.op == 'Const')
+  nodes = []
+  for node in graph_def.node:
+    if node.op not in QUANTIZABLE_OPS:
+      continue
+    weights = consts.get(_node_name(node.input[1]))
+    if (weights is None or
+        weights.attr['dtype'].type != tf.float32.as_datatype_enum or
+        np.prod(tensor_util.TensorShapeProtoToList(
+            weights.attr['value'].tensor.tensor_shape)) < min_weights):
+      continue
+    if node.op == 'Conv2D':
+      if node.attr['data_format'].s not in (b'', b'NHWC'):
+        continue
+      if 'dilations' in node.attr and any(
+          dilation != 1 for dilation in node.attr['dilations'].list.i):
+        continue
+    elif node.attr['transpose_a'].b:
+      continue
+    nodes.append(node)
+  return nodes
+
+
+class RangeCalibrator(object):
+  """Tracks the range of values of tensors over calibration runs."""
+
+  def __init__(self, method='minmax', percentile=99.99, seed=0):
+    """Sets up the calibrator.
+
+    Args:
+      method: One of `CALIBRATION_METHODS`.
+      percentile: For the percentile method, the share of values in percent
+        the range has to hold on each side.
+      seed: Seed for sampling the values kept for the percentile method.
+
+    Raises:
+      Exception: If the method isn't recognized.
+    """
+    if method not in CALIBRATION_METHODS:
+      raise Exception('calibration "' + method + '" not recognized, should be '
+                      'one of ' + ', '.join(CALIBRATION_METHODS))
+    self.method = method
+    self.percentile = percentile
+    self.random = np.random.RandomState(seed)
+    self.minimum = {}
+    self.maximum = {}
+    self.samples = collections.defaultdict(list)
+
+  def update(self, name, values):
+    """Records the values a tensor took in one run."""
+    values = np.asarray(values, np.float32).reshape(-1)
+    if values.size == 0:
+      return
+    if self.method == 'minmax':
+      self.minimum[name] = min(self.minimum.get(name, 0.0), values.min())
+      self.maximum[name] = max(self.maximum.get(name, 0.0), values.max())
+    else:
+      if values.size > PERCENTILE_SAMPLES_PER_RUN:
+        values = values[self.random.randint(values.size,
+                                            size=PERCENTILE_SAMPLES_PER_RUN)]
+      self.samples[name].append(values)
+
+  def ranges(self):
+    """Returns a dictionary from tensor name to its (minimum, maximum).
+
+    Ranges always hold zero, which quantized values have to represent
+    exactly.
+    """
+    ranges = {}
+    if self.method == 'minmax':
+      for name in self.minimum:
+        ranges[name] = (float(self.minimum[name]), float(self.maximum[name]))
+    else:
+      for name, samples in self.samples.items():
+        low, high = np.percentile(np.concatenate(samples),
+                                  [100.0 - self.percentile, self.percentile])
+        ranges[name] = (min(float(low), 0.0), max(float(high), 0.0))
+    for name, (low, high) in ranges.items():
+      if high - low < 1e-6:
+        ranges[name] = (low, low + 1e-6)
+    return ranges
+
+
+def run_clips(graph_def, wav_datas, fetches, session_config=None):
+  """Runs a graph on one clip at a time.
+
+  Args:
+    graph_def: GraphDef with a 'wav_data' input.
+    wav_datas: List of WAV-encoded clips.
+    fetches: Names of the tensors to fetch.
+    session_config: Optional `tf.ConfigProto` of the session.
+
+  Yields:
+    The fetched values of each clip, and the seconds the run took.
+  """
+  batched = is_batched(graph_def)
+  with tf.Graph().as_default() as graph:
+    tf.import_graph_def(graph_def, name='')
+    with tf.Session(graph=graph, config=session_config) as sess:
+      if wav_datas:
+        # The first run also prepares the graph, which isn't part of the
+        # latency of a clip.
+        sess.run(fetches, feed_dict={
+            'wav_data:0': wav_datas[:1] if batched else wav_datas[0]})
+      for wav_data in wav_datas:
+        feed_dict = {'wav_data:0': [wav_data] if batched else wav_data}
+        start = time.time()
+        values = sess.run(fetches, feed_dict=feed_dict)
+        yield values, time.time() - start
+
+
+def calibrate(graph_def, nodes, wav_datas, calibrator, session_config=None):
+  """Measures the input ranges of the layers over the calibration clips.
+
+  Returns:
+    Dictionary from layer name to the (minimum, maximum) of its input.
+  """
+  fetches = [_tensor_name(node.input[0]) for node in nodes]
+  for values, _ in run_clips(graph_def, wav_datas, fetches, session_config):
+    for node, value in zip(nodes, values):
+      calibrator.update(node.name, value)
+  return calibrator.ranges()
+
+
+def _to_quint8(values, minimum, maximum):
+  """Quantizes floats like QuantizeV2 in MIN_FIRST mode."""
+  scale = 255.0 / (maximum - minimum)
+  return np.clip(np.round(values * scale) - np.round(minimum * scale), 0,
+                 255).astype(np.uint8)
+
+
+def _weights_only_nodes(node, weights):
+  """Stores the weights of a layer as int8, with a scale per output channel."""
+  # Transposed MatMul weights are [output, input], the others end with the
+  # output channels.
+  if node.op == 'MatMul' and node.attr['transpose_b'].b:
+    channel_weights = weights.reshape([weights.shape[0], -1])
+    scale = np.max(np.abs(channel_weights), axis=1, keepdims=True)
+  else:
+    channel_weights = weights.reshape([-1, weights.shape[-1]])
+    scale = np.max(np.abs(channel_weights), axis=0)
+  scale = np.where(scale > 0, scale / 127.0, 1.0).astype(np.float32)
+  quantized = np.clip(np.round(weights / scale), -127, 127).astype(np.int8)
+  layer = tf.NodeDef()
+  layer.CopyFrom(node)
+  layer.input[1] = node.name + '/weights'
+  return [
+      _const_node(node.name + '/weights_int8', quantized, tf.int8),
+      _const_node(node.name + '/weights_scale', scale, tf.float32),
+      _op_node(node.name + '/weights_float', 'Cast',
+               [node.name + '/weights_int8'], SrcT=tf.int8, DstT=tf.float32),
+      _op_node(node.name + '/weights', 'Mul',
+               [node.name + '/weights_float', node.name + '/weights_scale'],
+               T=tf.float32),
+      layer,
+  ]
+
+
+def _full_nodes(node, weights, input_range):
+  """Runs a layer on quantized inputs and weights, dequantizing its output."""
+  weights_min = min(float(weights.min()), 0.0)
+  weights_max = max(float(weights.max()), weights_min + 1e-6)
+  quantize_input = node.name + '/quantize_input'
+  quantized = node.name + '/quantized'
+  nodes = [
+      _const_node(node.name + '/input_min', input_range[0], tf.float32),
+      _const_node(node.name + '/input_max', input_range[1], tf.float32),
+      _op_node(quantize_input, 'QuantizeV2',
+               [node.input[0], node.name + '/input_min',
+                node.name + '/input_max'], T=tf.quint8, mode=b'MIN_FIRST'),
+      _const_node(node.name + '/weights_quint8',
+                  _to_quint8(weights, weights_min, weights_max), tf.quint8),
+      _const_node(node.name + '/weights_min', weights_min, tf.float32),
+      _const_node(node.name + '/weights_max', weights_max, tf.float32),
+  ]
+  inputs = [quantize_input + ':0', node.name + '/weights_quint8',
+            quantize_input + ':1', quantize_input + ':2',
+            node.name + '/weights_min', node.name + '/weights_max']
+  if node.op == 'Conv2D':
+    layer = _op_node(quantized, 'QuantizedConv2D', inputs, Tinput=tf.quint8,
+                     Tfilter=tf.quint8, out_type=tf.qint32)
+    layer.attr['strides'].CopyFrom(node.attr['strides'])
+    layer.attr['padding'].CopyFrom(node.attr['padding'])
+    if 'dilations' in node.attr:
+      layer.attr['dilations'].CopyFrom(node.attr['dilations'])
+  else:
+    layer = _op_node(quantized, 'QuantizedMatMul', inputs, T1=tf.quint8,
+                     T2=tf.quint8, Toutput=tf.qint32)
+    layer.attr['transpose_a'].b = False
+    layer.attr['transpose_b'].b = node.attr['transpose_b'].b
+  nodes.append(layer)
+  # The dequantized output keeps the name of the layer, so its consumers
+  # don't change.
+  nodes.append(_op_node(node.name, 'Dequantize',
+                        [quantized + ':0', quantized + ':1', quantized + ':2'],
+                        T=tf.qint32, mode=b'MIN_FIRST'))
+  return nodes
+
+
+def quantize_graph_def(graph_def, nodes, mode='full', input_ranges=None,
+                       output_node_names=(OUTPUT_NODE_NAME,)):
+  """Rewrites layers of a frozen graph to 8 bits.
+
+  Args:
+    graph_def: Frozen GraphDef.
+    nodes: Layers to quantize, from `quantizable_nodes`.
+    mode: One of `QUANTIZATION_MODES`.
+    input_ranges: For the full mode, dictionary from layer name to the
+      (minimum, maximum) of its input, from `calibrate`.
+    output_node_names: Nodes the graph is run for.
+
+  Returns:
+    The quantized GraphDef.
+
+  Raises:
+    Exception: If the mode isn't recognized.
+  """
+  if mode not in QUANTIZATION_MODES:
+    raise Exception('quantization mode "' + mode + '" not recognized, should '
+                    'be one of ' + ', '.join(QUANTIZATION_MODES))
+  consts = dict(
+      (node.name, node) for node in graph_def.node if node.op == 'Const')
+  targets = set(node.name for node in nodes)
+  quantized_graph_def = tf.GraphDef()
+  quantized_graph_def.versions.CopyFrom(graph_def.versions)
+  quantized_graph_def.library.CopyFrom(graph_def.library)
+  for node in graph_def.node:
+    if node.name not in targets:
+      quantized_graph_def.node.extend([node])
+      continue
+    weights = tensor_util.MakeNdarray(
+        consts[_node_name(node.input[1])].attr['value'].tensor)
+    if mode == 'weights':
+      quantized_graph_def.node.extend(_weights_only_nodes(node, weights))
+    else:
+      quantized_graph_def.node.extend(
+          _full_nodes(node, weights, input_ranges[node.name]))
+  return graph_util.extract_sub_graph(quantized_graph_def,
+                                      list(output_node_names))
+
+
+def sample_indices(size, count, seed=0, exclude=None):
+  """Returns a sorted random sample of the indices of a partition.
+
+  Args:
+    size: Number of samples in the partition.
+    count: How many indices to sample, or 0 for all of them.
+    seed: Seed of the sample.
+    exclude: Optional indices that must not be sampled, e.g. the calibration
+      clips when evaluating on the same partition.
+
+  Returns:
+    Int array of indices.
+  """
+  indices = np.arange(size)
+  if exclude is not None:
+    indices = np.setdiff1d(indices, exclude)
+  if 0 < count < len(indices):
+    indices = np.sort(np.random.RandomState(seed).choice(
+        indices, count, replace=False))
+  return indices
+
+
+def partition_clips(audio_processor, partition_name, indices, model_settings):
+  """Reads samples of a partition as WAV-encoded clips.
+
+  Args:
+    audio_processor: `AudioProcessor` holding the data index.
+    partition_name: Key of the partition in `audio_processor.data_index`.
+    indices: Indices of the samples to read, from `sample_indices`.
+    model_settings: Information about the model.
+
+  Returns:
+    List of the WAV contents of the clips, and array of their label indices.
+  """
+  partition = audio_processor.data_index[partition_name]
+  silence = encode_wav(np.zeros(model_settings['desired_samples']),
+                       model_settings['sample_rate'])
+  wav_datas = []
+  for wav_path, is_silence in zip(partition.files(indices),
+                                  partition.is_silence[indices]):
+    if is_silence:
+      wav_datas.append(silence)
+    else:
+      with tf.gfile.GFile(wav_path, 'rb') as f:
+        wav_datas.append(f.read())
+  return wav_datas, partition.label_ids[indices]
+
+
+def evaluate_graph(graph_def, wav_datas, truth, label_count,
+                   session_config=None):
+  """Runs a graph over labelled clips, one at a time.
+
+  Returns:
+    The confusion matrix and an array of the seconds each clip took.
+  """
+  predictions = []
+  latencies = []
+  for (probabilities,), seconds in run_clips(
+      graph_def, wav_datas, [OUTPUT_NODE_NAME + ':0'], session_config):
+    predictions.append(np.argmax(np.reshape(probabilities, [-1])))
+    latencies.append(seconds)
+  return (confusion_matrix(truth, predictions, label_count),
+          np.array(latencies))
+
+
+def quantization_report(graph_def, quantized_graph_def, wav_datas, truth,
+                        labels, session_config=None):
+  """Compares a float graph with its quantized version.
+
+  Args:
+    graph_def: The float GraphDef.
+    quantized_graph_def: The GraphDef from `quantize_graph_def`.
+    wav_datas: List of WAV-encoded evaluation clips.
+    truth: Array of the label index of every clip.
+    labels: Names of the labels.
+    session_config: Optional `tf.ConfigProto`, e.g. restricted to the CPU.
+
+  Returns:
+    Dictionary with the size in bytes, mean and median latency per clip in
+    milliseconds and accuracy of both graphs, and a DataFrame indexed by label
+    with the precision, recall and F1 score of the float graph, the quantized
+    graph and their difference.
+  """
+  summary = {}
+  tables = []
+  for name, current_graph_def in (('float', graph_def),
+                                  ('int8', quantized_graph_def)):
+    conf_matrix, latencies = evaluate_graph(
+        current_graph_def, wav_datas, truth, len(labels), session_config)
+    summary[name + '_bytes'] = len(current_graph_def.SerializeToString())
+    summary[name + '_latency_ms'] = float(np.mean(latencies)) * 1000.0
+    summary[name + '_median_latency_ms'] = float(np.median(latencies)) * 1000.0
+    summary[name + '_accuracy'] = float(
+        np.trace(conf_matrix)) / max(np.sum(conf_matrix), 1)
+    tables.append(label_metrics(conf_matrix, labels))
+  stat_df = pd.concat([tables[0], tables[1], tables[1] - tables[0]], axis=1,
+                      keys=['float', 'int8', 'delta'])
+  stat_df.columns = ['%s_%s' % column for column in stat_df.columns]
+  return summary, stat_df
+
+
+def main(_):
+  tf.logging.set_verbosity(tf.logging.INFO)
+  model_settings = prepare_model_settings(FLAGS.arch_config_file)
+  audio_processor = AudioProcessor(None, FLAGS.data_dir, model_settings)
+  if FLAGS.eval_partition not in audio_processor.data_index:
+    raise Exception('eval_partition "' + FLAGS.eval_partition + '" not found, '
+                    'should be one of ' +
+                    ', '.join(sorted(audio_processor.data_index.keys())))
+  if FLAGS.mode not in QUANTIZATION_MODES:
+    raise Exception('quantization mode "' + FLAGS.mode + '" not recognized, '
+                    'should be one of ' + ', '.join(QUANTIZATION_MODES))
+  # Calibration clips come from the validation partition, and are kept out
+  # of the evaluation so the accuracy isn't measured on the data the ranges
+  # were fitted to.
+  calibration_indices = None
+  if FLAGS.mode == 'full':
+    calibration_indices = sample_indices(
+        audio_processor.set_size('validation'), FLAGS.calibration_size)
+  eval_indices = sample_indices(
+      audio_processor.set_size(FLAGS.eval_partition), FLAGS.eval_size, seed=1,
+      exclude=(calibration_indices
+               if FLAGS.eval_partition == 'validation' else None))
+  if len(eval_indices) == 0:
+    raise Exception('No clips of ' + FLAGS.eval_partition + ' left to '
+                    'evaluate on, lower --calibration_size')
+  # Edge boxes have no GPU, and measure the latency on a fixed thread count.
+  session_config = tf.ConfigProto(
+      device_count={'GPU': 0},
+      intra_op_parallelism_threads=FLAGS.num_threads,
+      inter_op_parallelism_threads=FLAGS.num_threads)
+
+  graph_def = load_graph_def(FLAGS.input_file)
+  nodes = quantizable_nodes(graph_def, FLAGS.min_weights)
+  if not nodes:
+    raise Exception('No layer of ' + FLAGS.input_file + ' can be quantized')
+  tf.logging.info('Quantizing %d layers: %s', len(nodes),
+                  ', '.join(node.name for node in nodes))
+  input_ranges = None
+  if FLAGS.mode == 'full':
+    wav_datas, _ = partition_clips(audio_processor, 'validation',
+                                   calibration_indices, model_settings)
+    input_ranges = calibrate(
+        graph_def, nodes, wav_datas,
+        RangeCalibrator(FLAGS.calibration, FLAGS.percentile), session_config)
+  quantized_graph_def = quantize_graph_def(graph_def, nodes, FLAGS.mode,
+                                           input_ranges)
+  tf.train.write_graph(
+      quantized_graph_def,
+      os.path.dirname(FLAGS.output_file),
+      os.path.basename(FLAGS.output_file),
+      as_text=False)
+  tf.logging.info('Saved quantized graph to %s', FLAGS.output_file)
+
+  wav_datas, truth = partition_clips(audio_processor, FLAGS.eval_partition,
+                                     eval_indices, model_settings)
+  summary, stat_df = quantization_report(
+      graph_def, quantized_graph_def, wav_datas, truth,
+      audio_processor.words_list, session_config)
+  tf.logging.info('Graph size: %d bytes float, %d bytes int8 (%.1f%%)',
+                  summary['float_bytes'], summary['int8_bytes'],
+                  100.0 * summary['int8_bytes'] / summary['float_bytes'])
+  tf.logging.info('CPU latency per clip: %.2fms float, %.2fms int8 '
+                  '(median %.2fms, %.2fms)', summary['float_latency_ms'],
+                  summary['int8_latency_ms'],
+                  summary['float_median_latency_ms'],
+                  summary['int8_median_latency_ms'])
+  tf.logging.info('Accuracy: %.2f%% float, %.2f%% int8 (N=%d)',
+                  summary['float_accuracy'] * 100,
+                  summary['int8_accuracy'] * 100, len(wav_datas))
+  tf.logging.info('Per label metrics:\n%s', stat_df)
+  report_file = FLAGS.report_file or (
+      model_settings['arch'] + '_quantization_metric.csv')
+  save_label_metrics(stat_df, report_file)
+  tf.logging.info('Saved the report to %s', report_file)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--arch_config_file',
+      type=str,
+      default='',
+      help='File containing the parameters the model was trained with.')
+  parser.add_argument(
+      '--data_dir',
+      type=str,
+      default='/tmp/speech_dataset/',
+      help='Where the speech training data is.')
+  parser.add_argument(
+      '--input_file', type=str, default='', help='Frozen graph to quantize.')
+  parser.add_argument(
+      '--output_file', type=str, help='Where to save the quantized graph.')
+  parser.add_argument(
+      '--mode',
+      type=str,
+      default='full',
+      help='Quantize only the stored weights, or run the layers quantized '
+      '(%s).' % ', '.join(QUANTIZATION_MODES))
+  parser.add_argument(
+      '--calibration',
+      type=str,
+      default='minmax',
+      help='How input ranges are calibrated in the full mode (%s).' %
+      ', '.join(CALIBRATION_METHODS))
+  parser.add_argument(
+      '--percentile',
+      type=float,
+      default=99.99,
+      help='Share of values in percent the ranges hold with percentile '
+      'calibration.')
+  parser.add_argument(
+      '--calibration_size',
+      type=int,
+      default=500,
+      help='How many validation clips to calibrate on, 0 for all.')
+  parser.add_argument(
+      '--min_weights',
+      type=int,
+      default=1024,
+      help='Layers with fewer weights stay in float.')
+  parser.add_argument(
+      '--eval_partition',
+      type=str,
+      default='validation',
+      help='Partition the graphs are compared on, without the calibration '
+      'clips.')
+  parser.add_argument(
+      '--eval_size',
+      type=int,
+      default=0,
+      help='How many clips of the partition to compare on, 0 for all.')
+  parser.add_argument(
+      '--num_threads',
+      type=int,
+      default=1,
+      help='CPU threads the graphs are run with.')
+  parser.add_argument(
+      '--report_file',
+      type=str,
+      default='',
+      help='Where to write the per label metrics, defaults to '
+      '<arch>_quantization_metric.csv.')
+  FLAGS, unparsed = parser.parse_known_args()
+  tf.app.run(main=main, argv=[sys.argv[0]] + unparsed)
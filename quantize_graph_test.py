@@ -0,0 +1,122 @@
+# Copyright 2017 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for the post-training quantization."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+
+from tensorflow.examples.speech_commands import quantize_graph
+from tensorflow.python.framework import graph_util
+from tensorflow.python.platform import test
+
+
+class QuantizeGraphTest(test.TestCase):
+
+  def _frozen_graph_def(self, layer="matmul"):
+    with self.test_session(graph=tf.Graph()) as sess:
+      x = tf.placeholder(tf.float32, [None, 40], name="x")
+      random = np.random.RandomState(1)
+      if layer == "conv":
+        weights = tf.Variable(random.randn(1, 3, 4, 6).astype(np.float32))
+        logits = tf.reshape(
+            tf.nn.conv2d(tf.reshape(x, [-1, 1, 10, 4]), weights, [1, 1, 1, 1],
+                         "SAME"), [-1, 60])
+      elif layer == "transposed":
+        weights = tf.Variable(random.randn(3, 40).astype(np.float32))
+        logits = tf.matmul(x, weights, transpose_b=True)
+      else:
+        weights = tf.Variable(random.randn(40, 3).astype(np.float32))
+        logits = tf.matmul(x, weights)
+      tf.nn.softmax(logits, name="labels_softmax")
+      sess.run(tf.global_variables_initializer())
+      return graph_util.convert_variables_to_constants(
+          sess, sess.graph_def, ["labels_softmax"])
+
+  def _run(self, graph_def, x):
+    with tf.Graph().as_default() as graph:
+      tf.import_graph_def(graph_def, name="")
+      with tf.Session(graph=graph) as sess:
+        return sess.run("labels_softmax:0", feed_dict={"x:0": x})
+
+  def testRangeCalibrator(self):
+    calibrator = quantize_graph.RangeCalibrator("minmax")
+    calibrator.update("a", [1.0, 3.0])
+    calibrator.update("a", [-1.0, 0.5])
+    self.assertEqual({"a": (-1.0, 3.0)}, calibrator.ranges())
+    calibrator = quantize_graph.RangeCalibrator("percentile", 99.0)
+    calibrator.update("a", np.append(np.linspace(-1.0, 1.0, 1000), 100.0))
+    low, high = calibrator.ranges()["a"]
+    self.assertLess(high, 1.0)
+    self.assertLess(low, -0.9)
+    with self.assertRaises(Exception):
+      quantize_graph.RangeCalibrator("unknown")
+
+  def testSampleIndices(self):
+    self.assertAllEqual(np.arange(5), quantize_graph.sample_indices(5, 0))
+    calibration = quantize_graph.sample_indices(10, 4)
+    self.assertEqual(4, len(calibration))
+    evaluation = quantize_graph.sample_indices(10, 0, exclude=calibration)
+    self.assertEqual(6, len(evaluation))
+    self.assertEqual(0, len(np.intersect1d(calibration, evaluation)))
+
+  def testQuantizeGraphDef(self):
+    graph_def = self._frozen_graph_def()
+    nodes = quantize_graph.quantizable_nodes(graph_def, min_weights=100)
+    self.assertEqual(["MatMul"], [node.name for node in nodes])
+    self.assertEqual([], quantize_graph.quantizable_nodes(graph_def))
+    x = np.random.RandomState(2).uniform(-1.0, 1.0, [8, 40])
+    expected = self._run(graph_def, x)
+    for mode in quantize_graph.QUANTIZATION_MODES:
+      quantized_graph_def = quantize_graph.quantize_graph_def(
+          graph_def, nodes, mode, {"MatMul": (-1.0, 1.0)})
+      ops = [node.op for node in quantized_graph_def.node]
+      if mode == "full":
+        self.assertTrue("QuantizedMatMul" in ops)
+      else:
+        self.assertTrue("Cast" in ops)
+      self.assertAllClose(expected, self._run(quantized_graph_def, x),
+                          atol=0.05)
+
+  def _check_layer(self, layer, name, output_channels):
+    graph_def = self._frozen_graph_def(layer)
+    nodes = quantize_graph.quantizable_nodes(graph_def, min_weights=60)
+    self.assertEqual([name], [node.name for node in nodes])
+    x = np.random.RandomState(2).uniform(-1.0, 1.0, [8, 40])
+    expected = self._run(graph_def, x)
+    for mode in quantize_graph.QUANTIZATION_MODES:
+      quantized_graph_def = quantize_graph.quantize_graph_def(
+          graph_def, nodes, mode, {name: (-1.0, 1.0)})
+      if mode == "weights":
+        # One scale per output channel.
+        scale = [node for node in quantized_graph_def.node
+                 if node.name == name + "/weights_scale"][0]
+        self.assertEqual(output_channels, np.prod(
+            tf.make_ndarray(scale.attr["value"].tensor).shape))
+      self.assertAllClose(expected, self._run(quantized_graph_def, x),
+                          atol=0.05)
+
+  def testQuantizeConv2D(self):
+    self._check_layer("conv", "Conv2D", 6)
+
+  def testQuantizeTransposedMatMul(self):
+    self._check_layer("transposed", "MatMul", 3)
+
+
+if __name__ == "__main__":
+  test.main()
@@ -0,0 +1,186 @@
+# Copyright 2017 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Cache of model outputs keyed by the contents of the input clips.
+
+Many clips that get labelled are byte-for-byte copies of each other, like
+retried requests and duplicate files in the Kaggle test set. `ResultCache`
+remembers the scores computed for the hash of a clip's WAV bytes, in a bounded
+LRU dictionary and optionally in a directory of .npy files shared by every
+process using the same model, so a repeated clip never reaches the session.
+The hashes are salted with an identity of the model, so results of different
+models or checkpoints are never mixed up.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+
+def file_identity(path):
+  """Identifies a file by its path, size and modification time."""
+  stat = os.stat(path)
+  return '%s:%d:%d' % (os.path.abspath(path), stat.st_size,
+                       int(stat.st_mtime))
+
+
+def model_identity(*parts):
+  """Hashes everything that determines a model's outputs into a key.
+
+  Args:
+    *parts: JSON serializable values, e.g. checkpoint paths, settings and
+      `file_identity` strings.
+
+  Returns:
+    Hex string identifying the model.
+  """
+  return hashlib.sha1(
+      json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class ResultCache(object):
+  """Two-tier LRU cache of model scores for WAV-encoded clips."""
+
+  def __init__(self, model_key, max_entries=100000, cache_dir=None):
+    """Opens the cache.
+
+    Args:
+      model_key: String from `model_identity` for the model being run.
+      max_entries: How many results are kept in memory.
+      cache_dir: Optional directory results are also stored in, so they
+        outlive the process.
+    """
+    self.model_key = model_key
+    self.max_entries = max_entries
+    self.entries = collections.OrderedDict()
+    self.lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+    self.model_dir = None
+    if cache_dir:
+      self.model_dir = os.path.join(cache_dir, model_key)
+      if not os.path.exists(self.model_dir):
+        os.makedirs(self.model_dir)
+
+  def key(self, wav_data):
+    """Returns the cache key of a clip's WAV bytes."""
+    return hashlib.blake2b(wav_data, digest_size=16,
+                           key=self.model_key.encode('utf-8')[:64]).hexdigest()
+
+  def _path(self, key):
+    return os.path.join(self.model_dir, key[:2], key + '.npy')
+
+  def get(self, key):
+    """Returns the cached scores for a key, or None, counting hits and misses."""
+    with self.lock:
+      scores = self.entries.get(key)
+      if scores is not None:
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return scores
+    if self.model_dir is not None and os.path.exists(self._path(key)):
+      try:
+        scores = np.load(self._path(key))
+      except (IOError, ValueError):
+        scores = None
+      if scores is not None:
+        self._remember(key, scores)
+        with self.lock:
+          self.hits += 1
+        return scores
+    with self.lock:
+      self.misses += 1
+    return None
+
+  def put(self, key, scores):
+    """Stores the scores computed for a key."""
+    scores = np.array(scores)
+    self._remember(key, scores)
+    if self.model_dir is not None:
+      path = self._path(key)
+      if not os.path.exists(os.path.dirname(path)):
+        try:
+          os.makedirs(os.path.dirname(path))
+        except OSError:
+          # Another process created it first.
+          pass
+      # Unique temporary names, since several processes can share the tier.
+      tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(),
+                                   threading.current_thread().ident)
+      with open(tmp_path, 'wb') as f:
+        np.save(f, scores)
+      os.rename(tmp_path, path)
+
+  def _remember(self, key, scores):
+    with self.lock:
+      self.entries[key] = scores
+      self.entries.move_to_end(key)
+      while len(self.entries) > self.max_entries:
+        self.entries.popitem(last=False)
+
+  def stats(self):
+    """Returns the hit and miss counters."""
+    with self.lock:
+      lookups = self.hits + self.misses
+      return {
+          'hits': self.hits,
+          'misses': self.misses,
+          'hit_rate': self.hits / lookups if lookups else 0.0,
+          'entries': len(self.entries),
+      }
+
+
+def predict_with_cache(cache, wavs, wav_datas, predict_fn):
+  """Scores a batch of clips, running the model only on unseen contents.
+
+  Clips with the same contents within the batch are run once, and count as
+  cache hits after the first.
+
+  Args:
+    cache: `ResultCache` of the model, or None to always run it.
+    wavs: List of whatever `predict_fn` takes for each clip, e.g. paths.
+    wav_datas: List of the WAV bytes of every clip, used as the cache key.
+    predict_fn: Function taking a list of entries of `wavs` and returning
+      their scores as a [batch, labels] array.
+
+  Returns:
+    Array of scores of every clip, [batch, labels].
+  """
+  if cache is None:
+    return predict_fn(wavs)
+  keys = [cache.key(wav_data) for wav_data in wav_datas]
+  results = {}
+  missing = []
+  for key, wav in zip(keys, wavs):
+    if key in results:
+      with cache.lock:
+        cache.hits += 1
+      continue
+    scores = cache.get(key)
+    results[key] = scores
+    if scores is None:
+      missing.append((key, wav))
+  if missing:
+    scores = predict_fn([wav for _, wav in missing])
+    for (key, _), key_scores in zip(missing, scores):
+      cache.put(key, key_scores)
+      results[key] = key_scores
+  return np.stack([results[key] for key in keys])
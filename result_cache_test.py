@@ -0,0 +1,75 @@
+# Copyright 2017 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for the inference result cache."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import numpy as np
+
+from tensorflow.examples.speech_commands import result_cache
+from tensorflow.python.platform import test
+
+
+class ResultCacheTest(test.TestCase):
+
+  def testModelIdentity(self):
+    self.assertEqual(result_cache.model_identity("a", {"b": 1}),
+                     result_cache.model_identity("a", {"b": 1}))
+    self.assertNotEqual(result_cache.model_identity("a", {"b": 1}),
+                        result_cache.model_identity("a", {"b": 2}))
+
+  def testLru(self):
+    cache = result_cache.ResultCache("model", max_entries=2)
+    cache.put("a", [1.0])
+    cache.put("b", [2.0])
+    self.assertAllEqual([1.0], cache.get("a"))
+    cache.put("c", [3.0])
+    self.assertIsNone(cache.get("b"))
+    self.assertAllEqual([1.0], cache.get("a"))
+    self.assertEqual({"hits": 2, "misses": 1, "hit_rate": 2.0 / 3.0,
+                      "entries": 2}, cache.stats())
+    self.assertNotEqual(
+        cache.key(b"wav"),
+        result_cache.ResultCache("other model").key(b"wav"))
+
+  def testPredictWithCache(self):
+    cache_dir = os.path.join(self.get_temp_dir(), "result_cache")
+    cache = result_cache.ResultCache("model", cache_dir=cache_dir)
+    runs = []
+
+    def predict_fn(wavs):
+      runs.append(list(wavs))
+      return np.array([[len(wav), 0.0] for wav in wavs])
+
+    scores = result_cache.predict_with_cache(
+        cache, ["x", "yy", "x2"], [b"x", b"yy", b"x"], predict_fn)
+    self.assertAllEqual([[1, 0], [2, 0], [1, 0]], scores)
+    self.assertEqual([["x", "yy"]], runs)
+    self.assertEqual(1, cache.stats()["hits"])
+    self.assertEqual(2, cache.stats()["misses"])
+    # A new process only has the on-disk tier.
+    cache = result_cache.ResultCache("model", cache_dir=cache_dir)
+    scores = result_cache.predict_with_cache(
+        cache, ["yy", "zzz"], [b"yy", b"zzz"], predict_fn)
+    self.assertAllEqual([[2, 0], [3, 0]], scores)
+    self.assertEqual([["x", "yy"], ["zzz"]], runs)
+
+
+if __name__ == "__main__":
+  test.main()
@@ -3,6 +3,7 @@ from __future__ import division
 from __future__ import print_function
 
 import argparse
+import multiprocessing
 import os.path
 import sys
 import csv
@@ -11,6 +12,10 @@ import numpy as np
 from six.moves import xrange  # pylint: disable=redefined-builtin
 import tensorflow as tf
 
+from ensemble import ENSEMBLE_AVERAGES, Ensemble, load_ensemble_config
+from feature_cache import DEFAULT_SHARD_SIZE
+from result_cache import (ResultCache, file_identity, model_identity,
+                          predict_with_cache)
 from input_data import *
 import submission_processor
 from models import *
@@ -18,44 +23,280 @@ from tensorflow.python.platform import gfile
 
 FLAGS = None
 
+# Identity of the model a parts folder holds the predictions of.
+PARTS_STAMP_FILE_NAME = 'MODEL'
+
 
 def load_labels(filename):
   """Read in labels, one label per line."""
   return [line.rstrip() for line in tf.gfile.GFile(filename)]
 
 
-def main(_):
-  # We want to see all the logging messages for this tutorial.
-  tf.logging.set_verbosity(tf.logging.INFO)
+def shard_ranges(sample_count, shard_size):
+  """Splits the submission files into (start, end) ranges of `shard_size`."""
+  return [(start, min(start + shard_size, sample_count))
+          for start in xrange(0, sample_count, shard_size)]
 
-  # Start a new TensorFlow session.
-  sess = tf.InteractiveSession()
 
-  model_settings = prepare_model_settings(FLAGS.arch_config_file)
-  audio_processor = submission_processor.SubmissionProcessor(FLAGS)
+def part_path(parts_dir, shard):
+  """Path of the finished predictions of a shard.
+
+  While the shard is being worked on its rows are appended to the same path
+  with '.partial' added, which is renamed once the shard is complete.
+  """
+  return os.path.join(parts_dir, 'part-%05d.csv' % shard)
+
+
+def resume_part(partial_path):
+  """Counts the complete rows of a partial part file.
+
+  A row cut off by a crash is dropped from the file, so it's predicted again.
+
+  Returns:
+    How many files of the shard already have predictions.
+  """
+  if not os.path.exists(partial_path):
+    return 0
+  with open(partial_path, 'rb+') as f:
+    content = f.read()
+    complete_length = content.rfind(b'\n') + 1
+    f.seek(complete_length)
+    f.truncate()
+  return content[:complete_length].count(b'\n')
+
+
+def submission_name():
+  """Name of the submission, used for its CSV and default parts folder."""
+  if FLAGS.ensemble_config:
+    return os.path.splitext(os.path.basename(FLAGS.ensemble_config))[0]
+  return prepare_model_settings(FLAGS.arch_config_file)['arch']
+
+
+def load_members():
+  """Returns the (name, settings, checkpoint, weight) of the models to run.
+
+  Without --ensemble_config this is the single model of --arch_config_file.
+  """
+  if FLAGS.ensemble_config:
+    members = load_ensemble_config(FLAGS.ensemble_config)
+  else:
+    model_settings = prepare_model_settings(FLAGS.arch_config_file)
+    members = [(model_settings['arch'], model_settings,
+                FLAGS.start_checkpoint, 1.0)]
+  for _, member_settings, _, _ in members:
+    member_settings['noise_label_count'] = FLAGS.noise_label_count
+  return members
+
+
+def predictions_identity(members):
+  """Key of everything that determines the predicted scores of the files."""
+  identity = []
+  for name, member_settings, checkpoint, weight in members:
+    checkpoint_files = [checkpoint + '.index', checkpoint]
+    identity.append([name, sorted(member_settings.items()), weight] + [
+        file_identity(path) for path in checkpoint_files
+        if os.path.exists(path)])
+  return model_identity(identity, FLAGS.ensemble_average,
+                        FLAGS.tta_time_shifts_ms, FLAGS.tta_noise)
+
+
+def create_result_cache(members):
+  """Opens the result cache of an ensemble if one is configured, else None."""
+  if not (FLAGS.result_cache_size or FLAGS.result_cache_dir):
+    return None
+  return ResultCache(predictions_identity(members),
+                     FLAGS.result_cache_size or 100000,
+                     FLAGS.result_cache_dir or None)
+
+
+def check_parts_dir(parts_dir, identity):
+  """Makes sure the part files in a folder come from the same predictions.
 
-  model_settings['noise_label_count'] = 11
+  A new folder is stamped with the identity of the model, labels and shards.
+  Finished shards are reused on later runs, so the folder is refused if it
+  was filled by another model.
 
+  Raises:
+    Exception: If the folder holds parts of a different model, or parts
+      without a stamp.
+  """
+  stamp_path = os.path.join(parts_dir, PARTS_STAMP_FILE_NAME)
+  if not os.path.exists(parts_dir):
+    os.makedirs(parts_dir)
+  if os.path.exists(stamp_path):
+    with open(stamp_path) as f:
+      stamp = f.read().strip()
+    if stamp != identity:
+      raise Exception('%s holds predictions of another model, checkpoint or '
+                      'shard size, delete it or choose another --parts_dir' %
+                      parts_dir)
+    return
+  if os.listdir(parts_dir):
+    raise Exception('%s holds predictions of an unknown model, delete it or '
+                    'choose another --parts_dir' % parts_dir)
+  with open(stamp_path, 'w') as f:
+    f.write(identity + '\n')
+
+
+def build_predictor(sess, audio_processor):
+  """Builds the model or ensemble and restores its weights.
+
+  Returns:
+    Function taking (offset, count) and returning the predicted label indices
+    of that range of submission files, the batch size to call it with, and
+    the result cache it uses or None.
+  """
+  if (FLAGS.ensemble_config or FLAGS.tta_time_shifts_ms or
+      FLAGS.result_cache_size or FLAGS.result_cache_dir):
+    # A single model runs as a one member ensemble for test-time augmentation,
+    # which builds the features in the graph where the copies are made, and
+    # for the result cache, which only sends the clips it hasn't seen.
+    members = load_members()
+    cache = create_result_cache(members)
+    # With the cache the files are read once for their keys, and the model
+    # is fed the same bytes instead of reading them again.
+    ensemble = Ensemble(
+        members, FLAGS.ensemble_average,
+        parse_time_shifts(FLAGS.tta_time_shifts_ms,
+                          members[0][1]['sample_rate']), FLAGS.tta_noise,
+        wav_data_input=cache is not None)
+    sess.run(tf.global_variables_initializer())
+    ensemble.load_variables_from_checkpoints(sess)
+
+    def predict_scores(wavs):
+      return sess.run(ensemble.scores, feed_dict=ensemble.feed_dict(wavs))
+
+    def predict_ensemble(offset, count):
+      wav_paths = audio_processor.data_index[offset:offset + count]
+      if cache is None:
+        return np.argmax(predict_scores(wav_paths), 1)
+      wav_datas = []
+      for wav_path in wav_paths:
+        with open(wav_path, 'rb') as f:
+          wav_datas.append(f.read())
+      return np.argmax(
+          predict_with_cache(cache, wav_datas, wav_datas, predict_scores), 1)
+    return predict_ensemble, FLAGS.batch_size, cache
+
+  model_settings = prepare_model_settings(FLAGS.arch_config_file)
+  model_settings['noise_label_count'] = FLAGS.noise_label_count
   graph = Graph(model_settings)
-  tf.global_variables_initializer().run()
+  sess.run(tf.global_variables_initializer())
   graph.load_variables_from_checkpoint(sess, FLAGS.start_checkpoint)
 
-  path_to_labels = FLAGS.labels
-  labels = np.array(load_labels(path_to_labels))
-
-  indices = []
-  sample_num = 158538
-  for i in xrange(0, sample_num, int(model_settings['batch_size'])):
-    tf.logging.info('Progress: %.2f%%', float(100 * i)/float(sample_num))
-    print(i)
-    test_fingerprints = audio_processor.get_test_data(int(model_settings['batch_size']), i, model_settings, sess, features=model_settings['features'])
-    batch_indices = sess.run(graph.predicted_indices, feed_dict={graph.fingerprint_input: test_fingerprints,
-                                                                   graph.is_training: False})
-    indices.extend(batch_indices)
+  def predict(offset, count):
+    test_fingerprints = audio_processor.get_test_data(
+        count, offset, model_settings, sess,
+        features=model_settings['features'])
+    return sess.run(graph.predicted_indices, feed_dict={
+        graph.fingerprint_input: test_fingerprints,
+        graph.is_training: False})
+  return predict, int(model_settings['batch_size']), None
+
+
+def run_worker(worker_id, num_workers, parts_dir):
+  """Predicts every unfinished shard assigned to this worker.
+
+  Shards are dealt out round robin, and each one's predictions are flushed to
+  its part file after every batch.
+  """
+  tf.logging.set_verbosity(tf.logging.INFO)
+  audio_processor = submission_processor.SubmissionProcessor(FLAGS)
+  shards = shard_ranges(len(audio_processor.data_index), FLAGS.shard_size)
+  pending = [shard for shard in xrange(worker_id, len(shards), num_workers)
+             if not os.path.exists(part_path(parts_dir, shard))]
+  if not pending:
+    return
+
+  labels = np.array(load_labels(FLAGS.labels))
+
+  # Workers share the GPU, so none of them may claim all of its memory.
+  config = tf.ConfigProto(gpu_options=tf.GPUOptions(allow_growth=True))
+  with tf.Graph().as_default(), tf.Session(config=config) as sess:
+    predict, batch_size, cache = build_predictor(sess, audio_processor)
+    for shard in pending:
+      start, end = shards[shard]
+      partial_path = part_path(parts_dir, shard) + '.partial'
+      done = resume_part(partial_path)
+      if done:
+        tf.logging.info('Worker %d resuming shard %d after %d files',
+                        worker_id, shard, done)
+      with open(partial_path, 'a') as f:
+        writer = csv.writer(f)
+        for offset in xrange(start + done, end, batch_size):
+          batch_indices = predict(offset, min(batch_size, end - offset))
+          for i, index in enumerate(batch_indices):
+            writer.writerow([
+                audio_processor.data_index[offset + i].rsplit('/', 1)[1],
+                labels[index]])
+          f.flush()
+      os.rename(partial_path, part_path(parts_dir, shard))
+      tf.logging.info('Worker %d finished shard %d (%d/%d done)', worker_id,
+                      shard, len([s for s in xrange(len(shards)) if
+                                  os.path.exists(part_path(parts_dir, s))]),
+                      len(shards))
+      if cache is not None:
+        tf.logging.info('Worker %d result cache: %s', worker_id,
+                        cache.stats())
+
+
+def merge_parts(audio_processor, parts_dir, target_file_name):
+  """Writes the submission CSV from the finished part files.
+
+  Raises:
+    Exception: If a shard isn't finished or doesn't match the file list.
+  """
+  shards = shard_ranges(len(audio_processor.data_index), FLAGS.shard_size)
   human_string = []
-  for i in indices:
-    human_string.append(labels[i])
-  audio_processor.write_to_csv(human_string, target_file_name=graph.get_arch_name())
+  for shard, (start, end) in enumerate(shards):
+    if not os.path.exists(part_path(parts_dir, shard)):
+      raise Exception('Shard %d in %s is not finished' % (shard, parts_dir))
+    with open(part_path(parts_dir, shard)) as f:
+      rows = list(csv.reader(f))
+    expected = [path.rsplit('/', 1)[1]
+                for path in audio_processor.data_index[start:end]]
+    if [row[0] for row in rows] != expected:
+      raise Exception('Part file %s does not match the submission files, '
+                      'delete it to predict the shard again' %
+                      part_path(parts_dir, shard))
+    human_string.extend(row[1] for row in rows)
+  audio_processor.write_to_csv(human_string, target_file_name=target_file_name)
+
+
+def run_worker_process(flags, worker_id, num_workers, parts_dir):
+  """Entry point of a spawned worker, which doesn't inherit the flags."""
+  global FLAGS
+  FLAGS = flags
+  run_worker(worker_id, num_workers, parts_dir)
+
+
+def main(_):
+  # We want to see all the logging messages for this tutorial.
+  tf.logging.set_verbosity(tf.logging.INFO)
+
+  name = submission_name()
+  parts_dir = FLAGS.parts_dir or name + '_parts'
+  check_parts_dir(parts_dir, model_identity(
+      predictions_identity(load_members()), file_identity(FLAGS.labels),
+      FLAGS.shard_size))
+
+  # Shards that were finished by an earlier run are skipped by the workers.
+  if FLAGS.num_workers > 1:
+    # Each worker builds its own graph and session in a fresh process.
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=run_worker_process,
+                               args=(FLAGS, worker_id, FLAGS.num_workers,
+                                     parts_dir))
+               for worker_id in xrange(FLAGS.num_workers)]
+    for worker in workers:
+      worker.start()
+    for worker in workers:
+      worker.join()
+  else:
+    run_worker(0, 1, parts_dir)
+
+  merge_parts(submission_processor.SubmissionProcessor(FLAGS), parts_dir,
+              name)
 
 
 if __name__ == '__main__':
@@ -207,5 +448,77 @@ if __name__ == '__main__':
       default=False,
       help='Whether to check for invalid numbers during processing')
 
+  parser.add_argument(
+      '--num_workers',
+      type=int,
+      default=1,
+      help='How many processes predict submission shards in parallel.')
+  parser.add_argument(
+      '--shard_size',
+      type=int,
+      default=2 * DEFAULT_SHARD_SIZE,
+      help="""\
+      How many files each submission shard holds. Keep it a multiple of the
+      feature cache shard size so workers never write the same cache shard.
+      """)
+  parser.add_argument(
+      '--parts_dir',
+      type=str,
+      default='',
+      help="""\
+      Where the per-shard prediction files are kept between runs, defaults to
+      <arch>_parts. The folder is stamped with the model it was filled by, and
+      refused by runs of another model.
+      """)
+
+  parser.add_argument(
+      '--ensemble_config',
+      type=str,
+      default='',
+      help="""\
+      File listing the models of an ensemble, see ensemble.py. When set, the
+      submission averages those models instead of using --arch_config_file.
+      """)
+  parser.add_argument(
+      '--ensemble_average',
+      type=str,
+      default='probabilities',
+      choices=ENSEMBLE_AVERAGES,
+      help='Whether the ensemble averages probabilities or logits.')
+  parser.add_argument(
+      '--noise_label_count',
+      type=int,
+      default=11,
+      help='Number of noise labels, only used by adversarial models.')
+
+  parser.add_argument(
+      '--tta_time_shifts_ms',
+      type=str,
+      default='',
+      help="""\
+      Comma separated time shifts for test-time augmentation, e.g.
+      '0,-100,100'. Predictions are averaged over one copy per shift.
+      """)
+  parser.add_argument(
+      '--tta_noise',
+      type=float,
+      default=0.0,
+      help='Standard deviation of noise added to the test-time copies.')
+
+  parser.add_argument(
+      '--result_cache_size',
+      type=int,
+      default=0,
+      help="""\
+      How many results per worker are kept in memory by the result cache,
+      which skips the model for clips with contents seen before. 0 disables
+      it unless --result_cache_dir is set.
+      """)
+  parser.add_argument(
+      '--result_cache_dir',
+      type=str,
+      default='',
+      help='Directory the result cache also keeps its results in.')
+
   FLAGS, unparsed = parser.parse_known_args()
-tf.app.run(main=main, argv=[sys.argv[0]] + unparsed)
\ No newline at end of file
+  tf.app.run(main=main, argv=[sys.argv[0]] + unparsed)
\ No newline at end of file
@@ -0,0 +1,166 @@
+# Copyright 2017 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for the sharded, resumable submission predictions."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import os
+
+from tensorflow.examples.speech_commands import run_network
+from tensorflow.python.platform import test
+
+
+class _FakeSubmissionProcessor(object):
+  """Stands in for the submission files and their CSV."""
+
+  def __init__(self, file_count):
+    self.data_index = ["/data/clip_%d.wav" % i for i in range(file_count)]
+    self.written = None
+
+  def write_to_csv(self, human_string, target_file_name):
+    self.written = (list(human_string), target_file_name)
+
+
+class RunNetworkTest(test.TestCase):
+
+  def setUp(self):
+    labels_path = os.path.join(self.get_temp_dir(), "labels.txt")
+    with open(labels_path, "w") as f:
+      f.write("yes\nno\n")
+    self._setModuleAttr(run_network, "FLAGS",
+                        argparse.Namespace(shard_size=2, labels=labels_path))
+
+  def _setModuleAttr(self, module, name, value):
+    self.addCleanup(setattr, module, name, getattr(module, name))
+    setattr(module, name, value)
+
+  def _partsDir(self, name):
+    parts_dir = os.path.join(self.get_temp_dir(), name)
+    os.makedirs(parts_dir)
+    return parts_dir
+
+  def _writePart(self, parts_dir, shard, rows, suffix=""):
+    with open(run_network.part_path(parts_dir, shard) + suffix, "w") as f:
+      for file_name, label in rows:
+        f.write("%s,%s\n" % (file_name, label))
+
+  def testShardRanges(self):
+    self.assertEqual([(0, 2), (2, 4), (4, 5)], run_network.shard_ranges(5, 2))
+    self.assertEqual([(0, 2), (2, 4)], run_network.shard_ranges(4, 2))
+    self.assertEqual([], run_network.shard_ranges(0, 2))
+
+  def testResumePart(self):
+    partial_path = os.path.join(self.get_temp_dir(), "part-00000.csv.partial")
+    self.assertEqual(0, run_network.resume_part(partial_path))
+    with open(partial_path, "w") as f:
+      f.write("clip_0.wav,yes\nclip_1.wav,no\nclip_2.w")
+    self.assertEqual(2, run_network.resume_part(partial_path))
+    # The row cut off by the crash is dropped from the file.
+    with open(partial_path) as f:
+      self.assertEqual("clip_0.wav,yes\nclip_1.wav,no\n", f.read())
+    self.assertEqual(2, run_network.resume_part(partial_path))
+
+  def testCheckPartsDir(self):
+    parts_dir = os.path.join(self.get_temp_dir(), "stamped_parts")
+    run_network.check_parts_dir(parts_dir, "model_a")
+    with open(os.path.join(parts_dir, run_network.PARTS_STAMP_FILE_NAME)) as f:
+      self.assertEqual("model_a\n", f.read())
+    self._writePart(parts_dir, 0, [("clip_0.wav", "yes")])
+    run_network.check_parts_dir(parts_dir, "model_a")
+    with self.assertRaises(Exception) as e:
+      run_network.check_parts_dir(parts_dir, "model_b")
+    self.assertTrue("another model" in str(e.exception))
+
+  def testCheckPartsDirUnstamped(self):
+    parts_dir = self._partsDir("unstamped_parts")
+    self._writePart(parts_dir, 0, [("clip_0.wav", "yes")])
+    with self.assertRaises(Exception) as e:
+      run_network.check_parts_dir(parts_dir, "model_a")
+    self.assertTrue("unknown model" in str(e.exception))
+
+  def testMergeParts(self):
+    processor = _FakeSubmissionProcessor(3)
+    parts_dir = self._partsDir("merged_parts")
+    # Parts are merged in shard order, whichever finished first.
+    self._writePart(parts_dir, 1, [("clip_2.wav", "yes")])
+    self._writePart(parts_dir, 0, [("clip_0.wav", "no"), ("clip_1.wav", "yes")])
+    run_network.merge_parts(processor, parts_dir, "submission")
+    self.assertEqual((["no", "yes", "yes"], "submission"), processor.written)
+
+  def testMergePartsUnfinished(self):
+    processor = _FakeSubmissionProcessor(3)
+    parts_dir = self._partsDir("unfinished_parts")
+    self._writePart(parts_dir, 0, [("clip_0.wav", "no"), ("clip_1.wav", "yes")])
+    self._writePart(parts_dir, 1, [("clip_2.wav", "yes")], suffix=".partial")
+    with self.assertRaises(Exception) as e:
+      run_network.merge_parts(processor, parts_dir, "submission")
+    self.assertTrue("Shard 1" in str(e.exception))
+    self.assertEqual(None, processor.written)
+
+  def testMergePartsMismatch(self):
+    processor = _FakeSubmissionProcessor(3)
+    parts_dir = self._partsDir("mismatched_parts")
+    self._writePart(parts_dir, 0, [("clip_1.wav", "no"), ("clip_0.wav", "yes")])
+    self._writePart(parts_dir, 1, [("clip_2.wav", "yes")])
+    with self.assertRaises(Exception) as e:
+      run_network.merge_parts(processor, parts_dir, "submission")
+    self.assertTrue("does not match" in str(e.exception))
+    self.assertEqual(None, processor.written)
+
+  def testResumeAfterCrash(self):
+    processor = _FakeSubmissionProcessor(5)
+    parts_dir = self._partsDir("resumed_parts")
+    predicted = []
+
+    def predict(offset, how_many):
+      if crash_at is not None and offset == crash_at:
+        raise RuntimeError("worker crashed")
+      predicted.extend(range(offset, offset + how_many))
+      return [offset % 2] * how_many
+
+    self._setModuleAttr(run_network.submission_processor,
+                        "SubmissionProcessor", lambda flags: processor)
+    self._setModuleAttr(run_network, "build_predictor",
+                        lambda sess, audio_processor: (predict, 1, None))
+
+    # The worker dies halfway through the second shard, in the middle of
+    # writing a row.
+    crash_at = 3
+    with self.assertRaises(RuntimeError):
+      run_network.run_worker(0, 1, parts_dir)
+    self.assertEqual([0, 1, 2], predicted)
+    self.assertTrue(os.path.exists(run_network.part_path(parts_dir, 0)))
+    partial_path = run_network.part_path(parts_dir, 1) + ".partial"
+    with open(partial_path, "a") as f:
+      f.write("clip_3.w")
+    with self.assertRaises(Exception):
+      run_network.merge_parts(processor, parts_dir, "submission")
+
+    # The rerun skips the finished shard and the files already predicted.
+    crash_at = None
+    del predicted[:]
+    run_network.run_worker(0, 1, parts_dir)
+    self.assertEqual([3, 4], predicted)
+    self.assertFalse(os.path.exists(partial_path))
+    run_network.merge_parts(processor, parts_dir, "submission")
+    self.assertEqual((["yes", "no", "yes", "no", "yes"], "submission"),
+                     processor.written)
+
+
+if __name__ == "__main__":
+  test.main()
@@ -0,0 +1,288 @@
+# Copyright 2017 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Strategies for picking training samples from a data partition.
+
+`AudioProcessor.get_data` asks its sampler for the indices of every training
+batch. The sampler is chosen with 'sampler' in the model settings:
+
+  - random: Every sample is drawn independently and uniformly, which is the
+    default and the original behavior.
+  - epoch: The partition is walked in a fresh random permutation each epoch,
+    so every clip is seen exactly once per epoch.
+  - balanced: Every class is equally likely, whatever its share of the
+    partition, and clips are drawn uniformly within the class.
+  - prioritized: Clips are drawn in proportion to their last training loss,
+    so hard and confusable examples come up more often. `train.py` feeds the
+    per-sample losses back through `update`.
+
+Samplers can save their position with `get_state` and continue from it with
+`set_state`, which `train.py` uses to resume the sample stream together with
+a checkpoint.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+
+import numpy as np
+import tensorflow as tf
+
+# Appended to a checkpoint path to get the path of the sampler state.
+SAMPLER_STATE_SUFFIX = '.sampler.json'
+# Priorities of the prioritized sampler are (loss + epsilon) ** exponent.
+PRIORITY_EPSILON = 0.01
+PRIORITY_EXPONENT = 0.6
+
+
+class RandomSampler(object):
+  """Draws samples uniformly with replacement.
+
+  This is also the base of the other samplers, and defines the interface
+  `AudioProcessor` uses.
+  """
+
+  # Whether `update` has to be called with the training losses.
+  uses_losses = False
+
+  def __init__(self, label_ids, seed=None):
+    """Sets up the sampler.
+
+    Args:
+      label_ids: Int array with the class index of every sample.
+      seed: Seed of the sampler's random stream. The random sampler uses the
+        global numpy generator, like the original sampling did.
+    """
+    self.size = len(label_ids)
+
+  def sample(self, count):
+    """Returns `count` sample indices."""
+    return np.random.randint(self.size, size=count)
+
+  def update(self, indices, losses):
+    """Reports the training losses of the samples at `indices`."""
+    pass
+
+  def get_state(self):
+    return {'sampler': 'random'}
+
+  def set_state(self, state):
+    pass
+
+
+class EpochSampler(RandomSampler):
+  """Draws samples without replacement, one shuffled epoch after another.
+
+  The permutation of an epoch is derived from the seed and the epoch number,
+  so the whole position in the stream is captured by (seed, epoch, cursor).
+  """
+
+  def __init__(self, label_ids, seed):
+    self.size = len(label_ids)
+    self.seed = seed
+    self.epoch = 0
+    self.cursor = 0
+    self.permutation = self._permutation(self.epoch)
+
+  def _permutation(self, epoch):
+    return np.random.RandomState([self.seed, epoch]).permutation(self.size)
+
+  def sample(self, count):
+    """Returns the next `count` sample indices, crossing epochs if needed."""
+    batches = []
+    while count > 0 and self.size > 0:
+      if self.cursor == self.size:
+        self.epoch += 1
+        self.cursor = 0
+        self.permutation = self._permutation(self.epoch)
+      take = min(count, self.size - self.cursor)
+      batches.append(self.permutation[self.cursor:self.cursor + take])
+      self.cursor += take
+      count -= take
+    if not batches:
+      return np.zeros(0, np.int64)
+    return np.concatenate(batches)
+
+  def get_state(self):
+    return {
+        'sampler': 'epoch',
+        'seed': self.seed,
+        'epoch': self.epoch,
+        'cursor': self.cursor,
+        'size': self.size
+    }
+
+  def set_state(self, state):
+    if state.get('sampler') != 'epoch' or state.get('size') != self.size:
+      tf.logging.warning('Sampler state %s doesn\'t match the partition, '
+                         'starting a new stream', state)
+      return
+    self.seed = state['seed']
+    self.epoch = state['epoch']
+    self.cursor = state['cursor']
+    self.permutation = self._permutation(self.epoch)
+
+
+class ClassBalancedSampler(RandomSampler):
+  """Draws every class equally often, and samples uniformly within a class."""
+
+  def __init__(self, label_ids, seed):
+    self.size = len(label_ids)
+    self.random = np.random.RandomState(seed)
+    # Sample indices grouped by class, with each class's start and length.
+    self.order = np.argsort(label_ids, kind='mergesort')
+    _, self.class_starts, self.class_counts = np.unique(
+        np.asarray(label_ids)[self.order], return_index=True,
+        return_counts=True)
+
+  def sample(self, count):
+    classes = self.random.randint(len(self.class_counts), size=count)
+    offsets = (self.random.random_sample(count) *
+               self.class_counts[classes]).astype(np.int64)
+    return self.order[self.class_starts[classes] + offsets]
+
+  def get_state(self):
+    return {'sampler': 'balanced'}
+
+
+class SumTree(object):
+  """Binary tree of priority sums for O(log n) proportional sampling.
+
+  The leaves hold the priority of every sample and each inner node the sum of
+  its children, so the root is the total. Both updates and lookups work on
+  whole batches, one tree level at a time.
+  """
+
+  def __init__(self, size, priority=1.0):
+    self.size = size
+    self.capacity = 1
+    while self.capacity < size:
+      self.capacity *= 2
+    self.tree = np.zeros(2 * self.capacity)
+    self.tree[self.capacity:self.capacity + size] = priority
+    for node in range(self.capacity - 1, 0, -1):
+      self.tree[node] = self.tree[2 * node] + self.tree[2 * node + 1]
+
+  def total(self):
+    return self.tree[1]
+
+  def update(self, indices, priorities):
+    """Sets the priorities of the samples at `indices`."""
+    nodes = np.asarray(indices) + self.capacity
+    self.tree[nodes] = priorities
+    while nodes[0] > 1:
+      nodes = np.unique(nodes // 2)
+      self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+  def find(self, values):
+    """Returns the samples whose cumulative priority ranges hold `values`."""
+    values = np.array(values, dtype=np.float64)
+    nodes = np.ones(len(values), dtype=np.int64)
+    while nodes[0] < self.capacity:
+      left = 2 * nodes
+      go_right = values >= self.tree[left]
+      values -= np.where(go_right, self.tree[left], 0.0)
+      nodes = np.where(go_right, left + 1, left)
+    # Rounding can step past the last sample when values are near the total.
+    return np.minimum(nodes - self.capacity, self.size - 1)
+
+
+class PrioritizedSampler(RandomSampler):
+  """Draws samples in proportion to their last training loss.
+
+  New samples start with the highest priority seen so far, so every clip is
+  tried before its loss is known. The draws are deliberately biased towards
+  hard examples and the loss isn't reweighted to correct for it.
+  """
+
+  uses_losses = True
+
+  def __init__(self, label_ids, seed):
+    self.size = len(label_ids)
+    self.random = np.random.RandomState(seed)
+    self.max_priority = 1.0
+    self.tree = SumTree(self.size, self.max_priority)
+    self.seen = np.zeros(self.size, dtype=bool)
+
+  def sample(self, count):
+    if self.size == 0:
+      return np.zeros(0, np.int64)
+    values = self.random.random_sample(count) * self.tree.total()
+    return self.tree.find(values)
+
+  def update(self, indices, losses):
+    if len(indices) == 0:
+      return
+    priorities = (np.asarray(losses, dtype=np.float64) +
+                  PRIORITY_EPSILON)**PRIORITY_EXPONENT
+    self.seen[indices] = True
+    if priorities.max() > self.max_priority:
+      self.max_priority = priorities.max()
+      unseen = np.flatnonzero(~self.seen)
+      if len(unseen):
+        self.tree.update(unseen, np.full(len(unseen), self.max_priority))
+    self.tree.update(indices, priorities)
+
+  def get_state(self):
+    return {'sampler': 'prioritized'}
+
+
+SAMPLERS = {
+    'random': RandomSampler,
+    'epoch': EpochSampler,
+    'balanced': ClassBalancedSampler,
+    'prioritized': PrioritizedSampler,
+}
+
+
+def create_sampler(name, label_ids, seed):
+  """Builds a sampler by name.
+
+  Args:
+    name: One of the keys of `SAMPLERS`.
+    label_ids: Int array with the class index of every sample.
+    seed: Seed of the sampler's random stream.
+
+  Returns:
+    The sampler.
+
+  Raises:
+    Exception: If the name isn't recognized.
+  """
+  if name not in SAMPLERS:
+    raise Exception('sampler "' + name + '" not recognized, should be one of ' +
+                    ', '.join(sorted(SAMPLERS)))
+  return SAMPLERS[name](label_ids, seed)
+
+
+def save_sampler_state(path, sampler):
+  """Writes the sampler's state as JSON."""
+  with open(path + '.tmp', 'w') as f:
+    json.dump(sampler.get_state(), f)
+  os.rename(path + '.tmp', path)
+
+
+def load_sampler_state(path, sampler):
+  """Restores the sampler's state from `save_sampler_state`, if present.
+
+  Returns:
+    Whether a state was found and loaded.
+  """
+  if not os.path.exists(path):
+    return False
+  with open(path) as f:
+    sampler.set_state(json.load(f))
+  return True
@@ -0,0 +1,90 @@
+# Copyright 2017 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for the training samplers."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import numpy as np
+
+from tensorflow.examples.speech_commands import samplers
+from tensorflow.python.platform import test
+
+
+class SamplersTest(test.TestCase):
+
+  def testEpochSamplerCoversEveryEpoch(self):
+    sampler = samplers.EpochSampler(np.zeros(10), 1)
+    first_epoch = np.concatenate([sampler.sample(4), sampler.sample(4),
+                                  sampler.sample(2)])
+    self.assertAllEqual(np.arange(10), np.sort(first_epoch))
+    self.assertEqual(0, sampler.epoch)
+    crossing = sampler.sample(15)
+    self.assertEqual(2, sampler.epoch)
+    self.assertAllEqual(np.arange(10), np.sort(crossing[:10]))
+
+  def testEpochSamplerResumes(self):
+    sampler = samplers.EpochSampler(np.zeros(10), 1)
+    sampler.sample(13)
+    state_path = os.path.join(self.get_temp_dir(), "sampler.json")
+    samplers.save_sampler_state(state_path, sampler)
+    expected = sampler.sample(9)
+    resumed = samplers.EpochSampler(np.zeros(10), 2)
+    self.assertTrue(samplers.load_sampler_state(state_path, resumed))
+    self.assertAllEqual(expected, resumed.sample(9))
+    self.assertFalse(samplers.load_sampler_state(state_path + ".missing",
+                                                 resumed))
+
+  def testClassBalancedSampler(self):
+    label_ids = np.array([0] * 90 + [1] * 9 + [2])
+    sampler = samplers.ClassBalancedSampler(label_ids, 1)
+    counts = np.bincount(label_ids[sampler.sample(3000)], minlength=3)
+    self.assertTrue(np.all(counts > 900))
+    self.assertTrue(np.all(counts < 1100))
+
+  def testSumTree(self):
+    tree = samplers.SumTree(5)
+    tree.update([1, 3], [0.0, 6.0])
+    self.assertEqual(9.0, tree.total())
+    self.assertAllEqual([0, 2, 3, 3, 4], tree.find([0.5, 1.5, 2.0, 7.9, 8.5]))
+
+  def testPrioritizedSampler(self):
+    sampler = samplers.PrioritizedSampler(np.zeros(4), 1)
+    sampler.update([0, 1, 2, 3], [0.0, 0.0, 100.0, 10.0])
+    counts = np.bincount(sampler.sample(1000), minlength=4)
+    self.assertTrue(counts[2] > counts[3] > counts[0])
+
+  def testPrioritizedSamplerUnseenKeepMaxPriority(self):
+    sampler = samplers.PrioritizedSampler(np.zeros(4), 1)
+    sampler.update([0, 1, 2], [5.0, 5.0, 5.0])
+    leaves = sampler.tree.tree[sampler.tree.capacity:][:4]
+    self.assertGreaterEqual(leaves[3], sampler.max_priority)
+    self.assertAllClose(leaves[:3], [sampler.max_priority] * 3)
+    sampler.update([0], [0.0])
+    self.assertGreaterEqual(sampler.tree.tree[sampler.tree.capacity + 3],
+                            sampler.max_priority)
+
+  def testCreateSampler(self):
+    self.assertTrue(isinstance(samplers.create_sampler("random", np.zeros(5), 0),
+                               samplers.RandomSampler))
+    with self.assertRaises(Exception):
+      samplers.create_sampler("unknown", np.zeros(5), 0)
+
+
+if __name__ == "__main__":
+  test.main()
@@ -9,9 +9,14 @@ from six.moves import xrange  # pylint: disable=redefined-builtin
 import tensorflow as tf
 import csv
 import os
+import time
 
-from tensorflow.contrib.framework.python.ops import audio_ops as contrib_audio
-from tensorflow.python.ops import io_ops
+from feature_cache import FeatureCache
+from input_data import (batch_fingerprint, convert_fingerprints, decode_clip,
+                        fingerprint_dtype)
+
+# How many files are processed between throughput log lines.
+THROUGHPUT_LOG_INTERVAL = 10000
 
 
 class SubmissionProcessor(object):
@@ -19,6 +24,11 @@ class SubmissionProcessor(object):
   def __init__(self, FLAGS):
     self.data_dir = FLAGS.data_dir
     self.prepare_data_index()
+    self.feature_caches = {}
+    self.feature_graphs = {}
+    self.files_processed = 0
+    self.processing_seconds = 0.0
+    self.next_throughput_log = THROUGHPUT_LOG_INTERVAL
 
   def prepare_data_index(self):
     self.data_index = []
@@ -36,38 +46,86 @@ class SubmissionProcessor(object):
             writer.writerow([self.data_index[i].rsplit('/', 1)[1]] + [human_string[i]])
 
 
+  def get_feature_cache(self, model_settings, features):
+    """Returns the feature cache configured in the model settings, or None."""
+    if not model_settings.get('feature_cache_dir'):
+      return None
+    if features not in self.feature_caches:
+      max_bytes = model_settings.get('feature_cache_max_bytes')
+      self.feature_caches[features] = FeatureCache(
+          model_settings['feature_cache_dir'], model_settings, features,
+          int(max_bytes) if max_bytes else None)
+    return self.feature_caches[features]
+
   def get_test_data(self, how_many, offset, model_settings, sess, features='mfcc'):
+    feature_cache = self.get_feature_cache(model_settings, features)
+    if feature_cache is None:
+      data = self.compute_test_data(how_many, offset, model_settings, sess,
+                                    features)
+    else:
+      if how_many == -1:
+        sample_count = len(self.data_index)
+      else:
+        sample_count = max(0, min(how_many, len(self.data_index) - offset))
+
+      def compute_fingerprints(start, end):
+        return self.compute_test_data(end - start, start, model_settings, sess,
+                                      features)
+      data = feature_cache.get_rows('submission', self.data_index, offset,
+                                    sample_count, compute_fingerprints)
+    return convert_fingerprints(
+        data, np.empty(data.shape, fingerprint_dtype(model_settings, features)))
+
+  def get_feature_graph(self, model_settings, features):
+    """Returns the batched feature ops, building them on first use.
+
+    The ops are added to the default graph once per feature type, so repeated
+    calls don't grow the graph and slow down every later session call.
+
+    Returns:
+      Tuple of the [batch] filenames placeholder and the [batch,
+      fingerprint_size] fingerprints tensor.
+    """
+    if features not in self.feature_graphs:
+      desired_samples = model_settings['desired_samples']
+      with tf.name_scope('submission_features'):
+        wav_filenames = tf.placeholder(tf.string, [None],
+                                       name='wav_file_names')
+        pcm = tf.map_fn(
+            lambda wav_filename: decode_clip(wav_filename, desired_samples),
+            wav_filenames, dtype=tf.float32, back_prop=False)
+        self.feature_graphs[features] = (
+            wav_filenames, batch_fingerprint(pcm, model_settings, features))
+    return self.feature_graphs[features]
+
+  def log_throughput(self, file_count, seconds):
+    """Accumulates processing time and periodically logs files per second."""
+    self.files_processed += file_count
+    self.processing_seconds += seconds
+    if self.files_processed >= self.next_throughput_log:
+      tf.logging.info('Processed %d files at %.1f files/sec',
+                      self.files_processed,
+                      self.files_processed / max(self.processing_seconds, 1e-6))
+      self.next_throughput_log += THROUGHPUT_LOG_INTERVAL
 
+  def compute_test_data(self, how_many, offset, model_settings, sess, features='mfcc'):
     candidates = self.data_index
     if how_many == -1:
       sample_count = len(candidates)
     else:
-        sample_count = max(0, min(how_many, len(candidates) - offset))
-    desired_samples = model_settings['desired_samples']
-    data = np.zeros((sample_count, model_settings['fingerprint_size']))
-
-    wav_filename_placeholder = tf.placeholder(tf.string, [], name='wav_file_names')
-    wav_loader = io_ops.read_file(wav_filename_placeholder)
-    wav_decoder = contrib_audio.decode_wav(
-      wav_loader, desired_channels=1, desired_samples=desired_samples)
-    spectrogram = contrib_audio.audio_spectrogram(
-      wav_decoder.audio,
-      window_size=model_settings['window_size_samples'],
-      stride=model_settings['window_stride_samples'],
-      magnitude_squared=True)
-    mfcc = contrib_audio.mfcc(
-      spectrogram,
-      wav_decoder.sample_rate,
-      dct_coefficient_count=model_settings['dct_coefficient_count'])
-
-
-    for i in range(offset, offset + sample_count):
-        input_dict = {wav_filename_placeholder : candidates[i]}
-        if features == "spectrogram":
-          data[i - offset, :] = sess.run(spectrogram, feed_dict=input_dict).flatten()
-        elif features == "raw":
-          data[i - offset, :] = sess.run(wav_decoder.audio, feed_dict=input_dict).flatten()
-        else:
-          data[i - offset, :] = sess.run(mfcc, feed_dict=input_dict).flatten()
-
-    return data
\ No newline at end of file
+      sample_count = max(0, min(how_many, len(candidates) - offset))
+    data = np.zeros((sample_count, model_settings['fingerprint_size']),
+                    np.float32)
+    wav_filenames, fingerprints = self.get_feature_graph(model_settings,
+                                                         features)
+    # Feature cache shards are larger than a model batch, so they're decoded
+    # a batch at a time to bound the memory of the decoded audio.
+    batch_size = int(model_settings.get('batch_size', 100))
+    start_time = time.time()
+    for start in xrange(0, sample_count, batch_size):
+      end = min(start + batch_size, sample_count)
+      data[start:end] = sess.run(
+          fingerprints,
+          feed_dict={wav_filenames: candidates[offset + start:offset + end]})
+    self.log_throughput(sample_count, time.time() - start_time)
+    return data
@@ -86,6 +86,7 @@ from tensorflow.python.platform import gfile
 
 from input_data import *
 import submission_processor
+from metrics import confusion_matrix
 from models import *
 
 FLAGS = None
@@ -106,6 +107,9 @@ def write_outputs_to_file(predictions, final_fc, probs, wav_files, model_setting
   path_to_labels = model_settings['path_to_labels']
   labels = load_labels(path_to_labels)
   for id_x, value in enumerate(predictions):
+    # Silence samples are synthesized and have no file to name the output by.
+    if not wav_files[id_x]:
+      continue
     if truth is None:
       target_folder = 'features'
     else:
@@ -133,8 +137,30 @@ def main(_):
   model_settings = prepare_model_settings(FLAGS.arch_config_file)
   audio_processor = AudioProcessor(FLAGS.data_url, FLAGS.data_dir, model_settings)
   model_settings['noise_label_count'] = audio_processor.background_label_count() + 1
-
-  graph = Graph(model_settings)
+  label_count = int(model_settings['label_count'])
+
+  tta_shifts = parse_time_shifts(FLAGS.tta_time_shifts_ms,
+                                 model_settings['sample_rate'])
+  if tta_shifts:
+    # The test-time copies are made from the decoded clips, so the model reads
+    # features built in the graph instead of fed fingerprints.
+    desired_samples = model_settings['desired_samples']
+    wav_filenames = tf.placeholder(tf.string, [None], name='wav_file_names')
+    clips = tf.map_fn(
+        lambda wav_filename: decode_clip(wav_filename, desired_samples),
+        wav_filenames, dtype=tf.float32, back_prop=False)
+    tta_fingerprints = batch_fingerprint(
+        expand_copies(clips, tta_shifts, FLAGS.tta_noise), model_settings,
+        model_settings['features'])
+    copy_count = tf.shape(tta_fingerprints)[0]
+    graph = Graph(model_settings, (
+        tta_fingerprints, tf.zeros([copy_count, label_count]),
+        tf.zeros([copy_count, int(model_settings['noise_label_count'])])))
+    logits = graph.final_fc[0] if graph.is_adversarial() else graph.final_fc
+    tta_final_fc = average_copies(logits, len(tta_shifts))
+    tta_probabilities = average_copies(tf.nn.softmax(logits), len(tta_shifts))
+  else:
+    graph = Graph(model_settings)
   tf.summary.scalar('accuracy', graph.evaluation_step)
 
   global_step = tf.contrib.framework.get_or_create_global_step()
@@ -157,23 +183,36 @@ def main(_):
   tf.logging.info('set_size=%d', set_size)
   total_accuracy = 0
   total_conf_matrix = None
+  partition = audio_processor.data_index['validation']
   for i in xrange(0, set_size, batch_size):
-    test_fingerprints, test_ground_truth, noise_labels, wav_files = audio_processor.get_data(
-        batch_size, i, model_settings, 0.0, 0.0, 0, 'validation', sess, features=model_settings['features'])
-
-    test_accuracy, conf_matrix, final_fc, probs, predictions, truth = sess.run(
-        [graph.evaluation_step, graph.confusion_matrix,
-         graph.final_fc, graph.probabilities, graph.predicted_indices, graph.expected_indices],
-        feed_dict={
-            graph.fingerprint_input: test_fingerprints,
-            graph.ground_truth_input: test_ground_truth,
-            graph.is_training: 0,
-            graph.dropout_prob: 1.0
-        })
-    wav_paths = []
-    for file_dict in wav_files:
-      wav_paths.append(file_dict['file'])
-    write_outputs_to_file(predictions, final_fc, probs, wav_paths, model_settings, truth)
+    if tta_shifts:
+      sample_indices = np.arange(i, min(i + batch_size, set_size))
+      wav_files = partition.files(sample_indices)
+      truth = partition.label_ids[sample_indices]
+      final_fc, probs = sess.run(
+          [tta_final_fc, tta_probabilities],
+          feed_dict={
+              wav_filenames: wav_files,
+              graph.is_training: 0,
+              graph.dropout_prob: 1.0
+          })
+      predictions = np.argmax(probs, 1)
+      test_accuracy = np.mean(predictions == truth)
+      conf_matrix = confusion_matrix(truth, predictions, label_count)
+    else:
+      test_fingerprints, test_ground_truth, noise_labels, wav_files = audio_processor.get_data(
+          batch_size, i, model_settings, 0.0, 0.0, 0, 'validation', sess, features=model_settings['features'])
+
+      test_accuracy, conf_matrix, final_fc, probs, predictions, truth = sess.run(
+          [graph.evaluation_step, graph.confusion_matrix,
+           graph.final_fc, graph.probabilities, graph.predicted_indices, graph.expected_indices],
+          feed_dict={
+              graph.fingerprint_input: test_fingerprints,
+              graph.ground_truth_input: test_ground_truth,
+              graph.is_training: 0,
+              graph.dropout_prob: 1.0
+          })
+    write_outputs_to_file(predictions, final_fc, probs, wav_files, model_settings, truth)
 
     bs = min(batch_size, set_size - i)
     total_accuracy += (test_accuracy * bs) / set_size
@@ -229,5 +268,18 @@ if __name__ == '__main__':
         default=False,
         help='Whether to check for invalid numbers during processing')
 
+    parser.add_argument(
+        '--tta_time_shifts_ms',
+        type=str,
+        default='',
+        help="""\
+        Comma separated time shifts for test-time augmentation, e.g.
+        '0,-100,100'. Predictions are averaged over one copy per shift.
+        """)
+    parser.add_argument(
+        '--tta_noise',
+        type=float,
+        default=0.0,
+        help='Standard deviation of noise added to the test-time copies.')
     FLAGS, unparsed = parser.parse_known_args()
     tf.app.run(main=main, argv=[sys.argv[0]] + unparsed)
@@ -71,17 +71,21 @@ from __future__ import division
 from __future__ import print_function
 
 import argparse
+import contextlib
 import os.path
 import sys
+import threading
 
 import numpy as np
-import pandas as pd
 from six.moves import xrange  # pylint: disable=redefined-builtin
 import tensorflow as tf
 
 #import input_data
 from input_data import *
 from models import *
+from batch_producer import BatchProducerPool
+from metrics import label_metrics, save_label_metrics
+from samplers import SAMPLER_STATE_SUFFIX, load_sampler_state, save_sampler_state
 from tensorflow.python.platform import gfile
 
 FLAGS = None
@@ -90,7 +94,144 @@ def load_labels(filename):
   """Read in labels, one label per line."""
   return [line.rstrip() for line in tf.gfile.GFile(filename)]
 
+def load_validation_set(audio_processor, model_settings, batch_size, sess):
+  """Computes the fingerprints and labels of the whole validation partition.
+
+  Validation uses no augmentation, so this only has to be done once per run.
+  """
+  fingerprints = []
+  ground_truth = []
+  for i in xrange(0, audio_processor.set_size('validation'), batch_size):
+    batch_fingerprints, batch_ground_truth, _, _ = audio_processor.get_data(
+        batch_size, i, model_settings, 0.0, 0.0, 0, 'validation', sess,
+        features=model_settings['features'])
+    # get_data reuses its buffers, so the batches have to be copied.
+    fingerprints.append(batch_fingerprints.copy())
+    ground_truth.append(batch_ground_truth.copy())
+  return np.concatenate(fingerprints), np.concatenate(ground_truth)
+
+
+def evaluate(sess, graph, fingerprints, ground_truth, batch_size,
+             summary_op=None, summary_writer=None, training_step=None):
+  """Runs the model over a set of fingerprints in batches.
+
+  Args:
+    sess: Session holding the model variables.
+    graph: Model `Graph` to evaluate.
+    fingerprints: Array of shape [set_size, fingerprint_size].
+    ground_truth: One-hot labels of shape [set_size, label_count].
+    batch_size: How many samples to run per session call.
+    summary_op: Optional summary op, written for every batch.
+    summary_writer: Writer for `summary_op`.
+    training_step: Step the summaries are recorded for.
+
+  Returns:
+    Accuracy over the whole set and the summed confusion matrix.
+  """
+  set_size = fingerprints.shape[0]
+  total_accuracy = 0
+  total_conf_matrix = None
+  fetches = [graph.evaluation_step, graph.confusion_matrix]
+  if summary_op is not None:
+    fetches.append(summary_op)
+  for i in xrange(0, set_size, batch_size):
+    results = sess.run(
+        fetches,
+        feed_dict={
+            graph.fingerprint_input: fingerprints[i:i + batch_size],
+            graph.ground_truth_input: ground_truth[i:i + batch_size],
+            graph.is_training: 0,
+            graph.dropout_prob: 1.0
+        })
+    accuracy, conf_matrix = results[:2]
+    if summary_op is not None:
+      summary_writer.add_summary(results[2], training_step)
+    bs = min(batch_size, set_size - i)
+    total_accuracy += (accuracy * bs) / set_size
+    if total_conf_matrix is None:
+      total_conf_matrix = conf_matrix
+    else:
+      total_conf_matrix += conf_matrix
+  return total_accuracy, total_conf_matrix
+
+
+class BackgroundEvaluator(object):
+  """Evaluates snapshots of the model weights on a separate thread.
+
+  The model is rebuilt in its own TensorFlow graph and session, so validation
+  can run while the training loop keeps going.
+  """
+
+  def __init__(self, model_settings, fingerprints, ground_truth, batch_size,
+               summary_writer):
+    self.fingerprints = fingerprints
+    self.ground_truth = ground_truth
+    self.batch_size = batch_size
+    self.summary_writer = summary_writer
+    self.tf_graph = tf.Graph()
+    with self.tf_graph.as_default():
+      self.graph = Graph(model_settings)
+      self.sess = tf.Session(graph=self.tf_graph)
+      self.sess.run(tf.global_variables_initializer())
+    self.variables = dict(
+        (v.op.name, v) for v in self.graph.model_variables)
+    self.thread = None
+    self.total_conf_matrix = None
+
+  def evaluate(self, snapshot, training_step):
+    """Starts evaluating a snapshot, after the previous evaluation finishes.
+
+    Args:
+      snapshot: Dictionary from variable name to value, for every model
+        variable.
+      training_step: Step the snapshot was taken at.
+    """
+    self.wait()
+    self.thread = threading.Thread(
+        target=self._evaluate, args=(snapshot, training_step))
+    self.thread.daemon = True
+    self.thread.start()
+
+  def _evaluate(self, snapshot, training_step):
+    for name, value in snapshot.items():
+      self.variables[name].load(value, self.sess)
+    total_accuracy, self.total_conf_matrix = evaluate(
+        self.sess, self.graph, self.fingerprints, self.ground_truth,
+        self.batch_size)
+    self.summary_writer.add_summary(
+        tf.Summary(value=[tf.Summary.Value(tag='accuracy',
+                                           simple_value=total_accuracy)]),
+        training_step)
+    tf.logging.info('Confusion Matrix:\n %s' % (self.total_conf_matrix))
+    tf.logging.info('Step %d: Validation accuracy = %.1f%% (N=%d)' %
+                    (training_step, total_accuracy * 100,
+                     self.fingerprints.shape[0]))
+
+  def wait(self):
+    """Blocks until the running evaluation, if any, is done."""
+    if self.thread is not None:
+      self.thread.join()
+      self.thread = None
+
+  def close(self):
+    self.wait()
+    self.sess.close()
+
+
 def main(_):
+  # The batch producer processes and the background evaluator's session are
+  # released even if training fails.
+  with contextlib.ExitStack() as cleanup:
+    run_training(cleanup)
+
+
+def run_training(cleanup):
+  """Trains the model configured by the flags.
+
+  Args:
+    cleanup: `contextlib.ExitStack` the helpers that need closing are added
+      to.
+  """
   # We want to see all the logging messages for this tutorial.
   tf.logging.set_verbosity(tf.logging.INFO)
 
@@ -105,9 +246,32 @@ def main(_):
   audio_processor = AudioProcessor(FLAGS.data_url, FLAGS.data_dir, model_settings)
   model_settings['noise_label_count'] = audio_processor.background_label_count() + 1
 
-  graph = Graph(model_settings)
-
   time_shift_samples = int((model_settings['time_shift_ms'] * model_settings['sample_rate']) / 1000)
+  batch_size = int(model_settings['batch_size'])
+
+  # With 'input_pipeline = dataset' the training batches come from a tf.data
+  # iterator wired straight into the graph, instead of being fed from numpy.
+  use_dataset = model_settings.get('input_pipeline') == 'dataset'
+  if use_dataset:
+    training_iterator, training_iterator_feed = audio_processor.get_dataset_iterator(
+        batch_size, model_settings, model_settings['background_frequency'],
+        model_settings['background_volume'], time_shift_samples, 'training',
+        features=model_settings['features'])
+    graph = Graph(model_settings, inputs=training_iterator.get_next())
+  else:
+    graph = Graph(model_settings)
+
+  # With 'num_batch_workers' set, training batches are produced by a pool of
+  # worker processes instead of on the training thread.
+  batch_producer = None
+  num_batch_workers = int(model_settings.get('num_batch_workers', 0))
+  if num_batch_workers > 0 and not use_dataset:
+    batch_producer = cleanup.enter_context(BatchProducerPool(
+        FLAGS.data_url, FLAGS.data_dir, model_settings, num_batch_workers,
+        batch_size, model_settings['background_frequency'],
+        model_settings['background_volume'], time_shift_samples,
+        features=model_settings['features']))
+
   # Figure out the learning rates for each training phase. Since it's often
   # effective to have high learning rates at the start of training, followed by
   # lower levels towards the end, the number of steps and learning rates can be
@@ -137,12 +301,34 @@ def main(_):
   validation_writer = tf.summary.FileWriter(FLAGS.summaries_dir + '/validation')
 
   tf.global_variables_initializer().run()
+  if use_dataset:
+    sess.run(training_iterator.initializer, feed_dict=training_iterator_feed)
 
   start_step = 1
 
+  # The sampler only drives the training batches when they're produced on
+  # this thread, so only then is its position saved with the checkpoints.
+  save_sampler = batch_producer is None and not use_dataset
+  # Loss-driven samplers get the per-sample losses of every batch they drew.
+  feed_losses = save_sampler and audio_processor.sampler.uses_losses
+  sampler_name = model_settings.get('sampler', 'random')
+  if sampler_name != 'random' and use_dataset:
+    tf.logging.warning('The %s sampler is ignored by the dataset input '
+                       'pipeline, which shuffles the training set itself',
+                       sampler_name)
+  elif sampler_name != 'random' and batch_producer is not None:
+    tf.logging.warning('Every batch producer worker runs its own %s sampler, '
+                       'so their epochs overlap, they get no losses, and '
+                       'their state is not saved with the checkpoints',
+                       sampler_name)
+
   if FLAGS.start_checkpoint:
     graph.load_variables_from_checkpoint(sess, FLAGS.start_checkpoint)
     start_step = global_step.eval(session=sess)
+    if save_sampler and load_sampler_state(
+        FLAGS.start_checkpoint + SAMPLER_STATE_SUFFIX, audio_processor.sampler):
+      tf.logging.info('Resuming the training sample stream from %s',
+                      FLAGS.start_checkpoint + SAMPLER_STATE_SUFFIX)
 
   tf.logging.info('Training from step: %d ', start_step)
 
@@ -156,7 +342,12 @@ def main(_):
       'w') as f:
     f.write('\n'.join(audio_processor.words_list))
 
-  batch_size = int(model_settings['batch_size'])
+  # With 'background_eval' set, validation runs on a snapshot of the weights
+  # in a separate thread while training continues.
+  background_eval = int(model_settings.get('background_eval', 0))
+  background_evaluator = None
+  validation_fingerprints = None
+  validation_ground_truth = None
 
   # Training loop.
   training_steps_max = np.sum(training_steps_list)
@@ -168,23 +359,49 @@ def main(_):
       if training_step <= training_steps_sum:
         learning_rate_value = learning_rates_list[i]
         break
-    # Pull the audio samples we'll use for training.
-    train_fingerprints, train_ground_truth, train_noise_labels, _ = audio_processor.get_data(
-        batch_size, 0, model_settings, model_settings['background_frequency'],
-        model_settings['background_volume'], time_shift_samples, 'training', sess, features=model_settings['features'])
+    train_feed_dict = {
+        graph.learning_rate_input: learning_rate_value,
+        graph.is_training: 1,
+        graph.dropout_prob: 0.5
+    }
+    adv_train_feed_dict = {
+        graph.is_training: 1,
+        graph.dropout_prob: 0.5
+    }
+    if graph.is_adversarial():
+      adv_train_feed_dict[graph.adv_learning_rate_input] = learning_rate_value
+    if batch_producer is not None:
+      train_fingerprints, train_ground_truth, train_noise_labels = batch_producer.get_batch()
+    elif not use_dataset:
+      # Pull the audio samples we'll use for training.
+      train_fingerprints, train_ground_truth, train_noise_labels, _ = audio_processor.get_data(
+          batch_size, 0, model_settings, model_settings['background_frequency'],
+          model_settings['background_volume'], time_shift_samples, 'training', sess, features=model_settings['features'])
+    if not use_dataset:
+      train_feed_dict[graph.fingerprint_input] = train_fingerprints
+      train_feed_dict[graph.ground_truth_input] = train_ground_truth
+      adv_train_feed_dict[graph.fingerprint_input] = train_fingerprints
+      if graph.is_adversarial():
+        adv_train_feed_dict[graph.noise_labels] = train_noise_labels
+    # The adversarial step has to train on the batch the iterator gave the main
+    # step, so that batch is fetched with it.
+    batch_fetches = []
+    if use_dataset and graph.is_adversarial():
+      batch_fetches = [graph.fingerprint_input, graph.noise_labels]
     # Run the graph with this batch of training data.
-    train_summary, train_accuracy, cross_entropy_value, _, _ = sess.run(
-        [
-            merged_summaries, graph.evaluation_step, graph.cross_entropy_mean, graph.train_step,
-            increment_global_step
-        ],
-        feed_dict={
-            graph.fingerprint_input: train_fingerprints,
-            graph.ground_truth_input: train_ground_truth,
-            graph.learning_rate_input: learning_rate_value,
-            graph.is_training: 1,
-            graph.dropout_prob: 0.5
-        })
+    (train_summary, train_accuracy, cross_entropy_value, sample_losses, _,
+     _), batch_values = sess.run(
+        [[
+            merged_summaries, graph.evaluation_step, graph.cross_entropy_mean,
+            graph.cross_entropy if feed_losses else graph.cross_entropy_mean,
+            graph.train_step, increment_global_step
+        ], batch_fetches],
+        feed_dict=train_feed_dict)
+    if batch_values:
+      adv_train_feed_dict[graph.fingerprint_input] = batch_values[0]
+      adv_train_feed_dict[graph.noise_labels] = batch_values[1]
+    if feed_losses:
+      audio_processor.update_sample_losses(sample_losses)
 
     tf.logging.info('Main Step #%d: rate %f, accuracy %.1f%%, cross entropy %f' %
                     (training_step, learning_rate_value, train_accuracy * 100,
@@ -195,13 +412,7 @@ def main(_):
             [
                 graph.adv_evaluation_step, graph.adv_cross_entropy_mean, graph.adv_train_step
             ],
-            feed_dict={
-                graph.fingerprint_input: train_fingerprints,
-                graph.noise_labels: train_noise_labels,
-                graph.adv_learning_rate_input: learning_rate_value,
-                graph.is_training: 1,
-                graph.dropout_prob: 0.5
-            })
+            feed_dict=adv_train_feed_dict)
         tf.logging.info('Adversarial Step #%d: rate %f, accuracy %.1f%%, cross entropy %f' %
                     (training_step, learning_rate_value, adv_train_accuracy * 100,
                      adv_cross_entropy_value))
@@ -210,33 +421,32 @@ def main(_):
 
     is_last_step = (training_step == training_steps_max)
     if (training_step % model_settings['eval_step_interval']) == 0 or is_last_step:
-      set_size = audio_processor.set_size('validation')
-      total_accuracy = 0
-      total_conf_matrix = None
-      for i in xrange(0, set_size, batch_size):
-        validation_fingerprints, validation_ground_truth, noise_labels, _ = (
-            audio_processor.get_data(batch_size, i, model_settings, 0.0,
-                                     0.0, 0, 'validation', sess, features=model_settings['features']))
-        # Run a validation step and capture training summaries for TensorBoard
-        # with the `merged` op.
-        validation_summary, validation_accuracy, conf_matrix = sess.run(
-            [merged_summaries, graph.evaluation_step, graph.confusion_matrix],
-            feed_dict={
-                graph.fingerprint_input: validation_fingerprints,
-                graph.ground_truth_input: validation_ground_truth,
-                graph.is_training: 0,
-                graph.dropout_prob: 1.0
-            })
-        validation_writer.add_summary(validation_summary, training_step)
-        bs = min(batch_size, set_size - i)
-        total_accuracy += (validation_accuracy * bs) / set_size
-        if total_conf_matrix is None:
-          total_conf_matrix = conf_matrix
-        else:
-          total_conf_matrix += conf_matrix
-      tf.logging.info('Confusion Matrix:\n %s' % (total_conf_matrix))
-      tf.logging.info('Step %d: Validation accuracy = %.1f%% (N=%d)' %
-                      (training_step, total_accuracy * 100, set_size))
+      # The validation set isn't augmented, so its features are only
+      # extracted on the first evaluation and kept in memory.
+      if validation_fingerprints is None:
+        validation_fingerprints, validation_ground_truth = load_validation_set(
+            audio_processor, model_settings, batch_size, sess)
+        if background_eval:
+          background_evaluator = BackgroundEvaluator(
+              model_settings, validation_fingerprints, validation_ground_truth,
+              batch_size, validation_writer)
+          cleanup.callback(background_evaluator.close)
+      if background_evaluator is not None:
+        snapshot_values = sess.run(graph.model_variables)
+        background_evaluator.evaluate(
+            dict((v.op.name, value) for v, value in
+                 zip(graph.model_variables, snapshot_values)),
+            training_step)
+      else:
+        # Run the validation set and capture training summaries for
+        # TensorBoard with the `merged` op.
+        total_accuracy, total_conf_matrix = evaluate(
+            sess, graph, validation_fingerprints, validation_ground_truth,
+            batch_size, merged_summaries, validation_writer, training_step)
+        tf.logging.info('Confusion Matrix:\n %s' % (total_conf_matrix))
+        tf.logging.info('Step %d: Validation accuracy = %.1f%% (N=%d)' %
+                        (training_step, total_accuracy * 100,
+                         validation_fingerprints.shape[0]))
 
     # Save the model checkpoint periodically.
     if (training_step % model_settings['save_step_interval'] == 0 or
@@ -244,21 +454,20 @@ def main(_):
       checkpoint_path = os.path.join(FLAGS.checkpoint_dir,
                                      graph.get_arch_name() + '.ckpt')
       tf.logging.info('Saving to "%s-%d"', checkpoint_path, training_step)
-      saver.save(sess, checkpoint_path, global_step=training_step)
+      saved_path = saver.save(sess, checkpoint_path, global_step=training_step)
+      if save_sampler:
+        save_sampler_state(saved_path + SAMPLER_STATE_SUFFIX,
+                           audio_processor.sampler)
 
+  cleanup.close()
+  if background_evaluator is not None:
+    total_conf_matrix = background_evaluator.total_conf_matrix
 
   # Evaluation metric
-  true_positives = np.diag(total_conf_matrix)
-  false_positives = np.sum(total_conf_matrix, axis=0) - true_positives
-  false_negatives = np.sum(total_conf_matrix, axis=1) - true_positives
-  precision = (true_positives / (true_positives + false_positives)).squeeze()
-  recall = (true_positives / (true_positives + false_negatives)).squeeze()
-  F1_score = (2 * (precision * recall) / (precision + recall)).squeeze()
-  final_statistics = np.stack([precision, recall, F1_score], axis=1)
   path_to_labels = model_settings['path_to_labels']
   labels = load_labels(path_to_labels)
-  stat_df = pd.DataFrame(final_statistics, index=labels, columns=['precision', 'recall', 'F1_score'])
-  stat_df.to_csv(model_settings['arch'] + '_metric.csv', index=True, header=True, sep='\t')
+  stat_df = label_metrics(total_conf_matrix, labels)
+  save_label_metrics(stat_df, model_settings['arch'] + '_metric.csv')
 
 
 if __name__ == '__main__':